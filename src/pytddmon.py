@@ -48,19 +48,50 @@ THE SOFTWARE.
 
 import os
 import sys
-import platform
 import optparse
 import re
-import unittest
-import doctest
 import time
-import multiprocessing
 import fnmatch
 import functools
-from collections import namedtuple
+import errno
+import struct
+import hashlib
+import json
+import zlib
+import select
+import threading
+import queue
+from collections import deque, namedtuple, OrderedDict
 
 ON_PYTHON3 = sys.version_info[0] == 3
-ON_WINDOWS = platform.system() == "Windows"
+ON_WINDOWS = sys.platform == "win32"
+
+# Seconds between showing the results of a run that is still going on
+PROGRESS_INTERVAL = 0.1
+
+# Milliseconds between the GUI looking for news from the engine thread
+DRAIN_INTERVAL = 50
+
+# Seconds between asking whether a run in progress should be cancelled
+CANCEL_CHECK_INTERVAL = 0.1
+
+# Seconds between looking at how much memory busy workers use
+MEMORY_CHECK_INTERVAL = 0.1
+
+# Seconds a terminated worker process gets to exit before it is killed
+TERMINATE_GRACE = 1.0
+
+# Seconds a test file counts as recently edited, and so runs early
+RECENT_EDIT = 600
+
+# Seconds a test file may take before its TestCases are run in parallel
+SPLIT_SECONDS = 2.0
+
+# Seconds of tests from quick test files that one worker task may run
+BATCH_SECONDS = 0.5
+
+# Bytes a test file that has not run yet may have to count as quick
+SMALL_TEST_FILE = 4096
 
 ####
 ## Core
@@ -81,12 +112,36 @@ class Pytddmon:
         self,
         file_finder,
         monitor,
-        project_name="<pytddmon>"
+        project_name="<pytddmon>",
+        worker_pool=None,
+        impact_analysis=True,
+        coverage_map=None,
+        history=None,
+        result_cache=None,
+        run_first=True,
+        reporter=None,
+        test_filter=None
     ):
         self.file_finder = file_finder
         self.project_name = project_name
         self.monitor = monitor
+        self.worker_pool = worker_pool or WorkerPool()
+        self.impact_analysis = impact_analysis
+        self.import_graph = ImportGraph(
+            getattr(file_finder, "root", os.getcwd())
+        )
+        self.module_results = {}  # file path -> result of its last run
+        self.serial_answers = {}  # file path -> (file state, runs serially?)
+        self.coverage_map = coverage_map
+        self.history = history or RunHistory()
+        self.result_cache = result_cache
+        self.reporter = reporter
+        self.test_filter = test_filter
+        self.import_seconds = 0.0  # spent by workers in the current run
+        self.discovery_seconds = 0.0
         self.change_detected = False
+        self.queued_change = None  # changes seen while tests were running
+        self.next_change_check = 0
 
         # This is not composition this is a functionality.
         # Since Pytddmon Class is a composer it should not have
@@ -98,240 +153,3648 @@ class Pytddmon:
         )
         self.log = ""
         self.status_message = 'n/a'
+        self.stale = False  # showing the last session's result?
         # end of rant, btw pylint agreas with me!
-        self.run_tests()
+        if run_first:
+            self.run_tests()
+        else:
+            self.show_last_result()
+
+    def show_last_result(self):
+        """shows the result of the last session, if known, as stale until
+        the tests have run"""
+        if self.history.last_result is None:
+            return
+        (passed, total, log) = self.history.last_result
+        self.result = Result(
+            total=total if total.imag else int(total.real),
+            passed=passed if passed.imag else int(passed.real),
+            time=-1
+        )
+        self.log = "From the last session, the tests have not run yet:\n"
+        self.log += log
+        self.status_message = 'Last session'
+        self.stale = True
+
+    def run_tests(self, changed_paths=None, progress=None,
+                  preemptible=False):
+        """Runs the tests affected by changed_paths (all tests if None) and
+        updates state variables with results. While the tests run, calls
+        progress() whenever the state variables show new results. A
+        preemptible run keeps looking for changes, and starts over with
+        the tests affected by them as soon as there are any."""
+
+        start = time.time()
+        cancelled = None
+        if preemptible:
+            cancelled = self.change_arrived
+        ran = set()  # the files run, before and after starting over
+        reused = set()  # and those whose results came from the cache
+        self.import_seconds = 0.0
+        self.discovery_seconds = 0.0
+        if self.reporter is not None:
+            self.reporter.start_run()
+        while True:
+            file_paths = sorted(self.file_finder())
+            (selected, test_ids) = self.select_test_files(
+                file_paths,
+                changed_paths
+            )
+            self.module_results = dict(
+                (path, self.module_results[path])
+                for path in file_paths if path in self.module_results
+            )
+            selected = self.skip_files_without_tests(selected, test_ids)
+            (selected, cache_keys) = self.reuse_results(selected, test_ids)
+            ran.update(selected)
+            reused.update(set(cache_keys).difference(selected))
+            pending = self.run_selected(
+                file_paths,
+                selected,
+                test_ids,
+                start,
+                progress,
+                cancelled,
+                cache_keys
+            )
+            if self.queued_change is None:
+                break
+            # Files that did not finish have no result, so they are
+            # selected again along with those affected by the change.
+            for path in pending:
+                self.module_results.pop(path, None)
+                if self.reporter is not None:
+                    self.reporter.discard(path)
+            # What the run shows as changed is all it ran for.
+            if isinstance(changed_paths, (set, frozenset)) and \
+                    isinstance(self.queued_change, (set, frozenset)):
+                self.change_detected = changed_paths | self.queued_change
+            else:
+                self.change_detected = self.queued_change
+            changed_paths = self.queued_change
+            self.queued_change = None
+        run_time = time.time() - start
+        self.summarize(
+            self.results_for(file_paths),
+            run_time,
+            len(ran.intersection(file_paths)),
+            files_reused=len(reused.difference(ran))
+        )
+        self.history.last_result = (
+            self.result.passed,
+            self.result.total,
+            self.log
+        )
+        self.history.save()
+        if self.coverage_map is not None:
+            self.coverage_map.save()
+        if self.result_cache is not None:
+            self.result_cache.save()
+        if self.test_filter is not None:
+            self.test_filter.save()
+        if self.reporter is not None:
+            self.reporter.write(file_paths, self.result)
+
+    def skip_files_without_tests(self, selected, test_ids):
+        """Gives the selected files whose sources show no sign of tests a
+        result without tests, instead of importing them in a worker.
+        Returns the files to run."""
+        if self.test_filter is None:
+            return selected
+        to_run = []
+        for path in selected:
+            if path in test_ids or self.test_filter.may_have_tests(
+                    path, self.import_graph if self.impact_analysis else None):
+                to_run.append(path)
+            else:
+                module = file_name_to_module("", path)
+                self.module_results[path] = (
+                    module, 0, 0, "All 0 tests passed\n"
+                )
+        return to_run
+
+    def reuse_results(self, selected, test_ids):
+        """Takes the results of the selected files whose sources and local
+        imports are unchanged since an earlier run from the result cache.
+        Returns (files to run, {file: cache key}) where the keys are those
+        of every selected file that runs all of its tests. Files that
+        import modules which could not be found have no key, since they
+        may depend on files that are not known."""
+        if self.result_cache is None or not self.impact_analysis:
+            return (selected, {})
+        cache_keys = {}
+        to_run = []
+        for path in selected:
+            dependencies = self.import_graph.dependencies(path)
+            if path in test_ids or \
+                    self.import_graph.unresolved.intersection(dependencies):
+                to_run.append(path)
+                continue
+            key = self.result_cache.key(dependencies)
+            cache_keys[path] = key
+            cached = self.result_cache.get(key)
+            if cached is None:
+                to_run.append(path)
+            else:
+                self.module_results[path] = cached
+        return (to_run, cache_keys)
+
+    def run_selected(self, file_paths, selected, test_ids, start, progress,
+                     cancelled, cache_keys=None):
+        """runs the selected tests, keeping the results and showing
+        progress, returns the selected files that did not finish"""
+        pending = set(selected)
+        last_progress = start
+        cache_keys = cache_keys or {}
+        for (path, result) in self.iterate_test_results(
+                selected, test_ids, cancelled):
+            self.module_results[path] = result
+            if path in cache_keys:
+                self.result_cache.put(cache_keys[path], result)
+            pending.discard(path)
+            # Failures are shown right away, other results now and then.
+            if progress is not None and pending and (
+                    is_failure(result) or
+                    time.time() - last_progress > PROGRESS_INTERVAL):
+                self.summarize(
+                    self.results_for(file_paths),
+                    time.time() - start,
+                    len(selected),
+                    len(pending)
+                )
+                progress()
+                last_progress = time.time()
+        return pending
+
+    def change_arrived(self):
+        """has anything changed since the run started? Looks for changes
+        once every poll interval, and keeps them for the next run."""
+        if self.queued_change is None and \
+                time.time() >= self.next_change_check:
+            self.queued_change = self.monitor.look_for_changes() or None
+            self.next_change_check = \
+                time.time() + self.get_poll_interval() / 1000.0
+        return self.queued_change is not None
+
+    def results_for(self, file_paths):
+        "the latest result of each of file_paths that has one"
+        return [
+            self.module_results[path]
+            for path in file_paths if path in self.module_results
+        ]
+
+    def select_test_files(self, file_paths, changed_paths):
+        """Returns (files, test ids): the files whose tests may be affected
+        by changed_paths, and {file: ids} of the only tests to run in some
+        of them. All files are selected if changed_paths is not a set of
+        paths, if something else than Python modules changed, or if a
+        changed module that is no test module has no known importers."""
+        if not self.impact_analysis:
+            return (file_paths, {})
+        if not isinstance(changed_paths, (set, frozenset)):
+            changed_paths = None
+        whole_files = changed_paths
+        test_ids = {}
+        if changed_paths is not None and self.coverage_map is not None and \
+                all(PYTHON_FILE.match(path) for path in changed_paths):
+            (whole_files, test_ids) = self.coverage_map.split_changes(
+                changed_paths
+            )
+        if whole_files is not None:
+            # Importers of removed modules are only known from before.
+            affected = self.import_graph.affected(whole_files)
+            unimported = self.import_graph.unimported(whole_files)
+        self.import_graph.update(file_paths, changed_paths)
+        if changed_paths is None or \
+                not all(PYTHON_FILE.match(path) for path in changed_paths):
+            return (file_paths, {})
+        affected.update(self.import_graph.affected(whole_files))
+        unimported.intersection_update(
+            self.import_graph.unimported(whole_files)
+        )
+        if any(not TEST_FILE_NAME.match(os.path.basename(path))
+               for path in unimported):
+            # Some module is changed that no test seems to import, which
+            # more likely means its importers could not be resolved.
+            return (file_paths, {})
+        selected = [
+            path for path in file_paths
+            if path in affected or path in test_ids or
+            path not in self.module_results
+        ]
+        test_ids = dict(
+            (path, ids) for (path, ids) in test_ids.items()
+            if ids is not None and path not in affected and
+            path in self.module_results and
+            self.coverage_map.has_outcomes(path)
+        )
+        return (selected, test_ids)
+
+    def iterate_test_results(self, file_paths, test_ids=None,
+                             cancelled=None):
+        """Runs the tests in file_paths, or only those with the given ids
+        for the files in test_ids, and yields (file path, result) as soon
+        as each file is done. Stops early once cancelled() is true."""
+        # We need to run the tests in separate processes, since
+        # Python caches loaded modules, and unittest/doctest
+        # imports modules to run them. The worker pool replaces
+        # workers that imported any file that has changed since.
+        # Modules can run at the same time when there are several
+        # workers, unless they are marked to run serially.
+        # The files most likely to tell something new run first. With
+        # several workers the rest run longest first, so that no worker is
+        # left with a slow file at the end, and slow files are split.
+        several_workers = getattr(self.worker_pool, "processes", 1) > 1
+        file_paths = self.history.order(file_paths, several_workers)
+        serial = [path for path in file_paths if self.runs_serially(path)]
+        parallel = [path for path in file_paths if path not in serial]
+        for (batch, max_busy) in ((parallel, None), (serial, 1)):
+            if cancelled is not None and cancelled():
+                return
+            if not batch:
+                continue
+            if max_busy is None and several_workers and \
+                    self.coverage_map is None:
+                results = self.run_parts_in_workers(batch, cancelled)
+            else:
+                results = self.run_in_workers(
+                    batch,
+                    test_ids,
+                    max_busy,
+                    cancelled
+                )
+            for packed in results:
+                yield packed
+
+    def runs_serially(self, path):
+        """runs_serially(path) below the project root, known from earlier
+        runs unless the file has changed"""
+        state = file_state(path)
+        (known_state, answer) = self.serial_answers.get(path, (None, None))
+        if state is None or state != known_state:
+            answer = runs_serially(path, self.import_graph.root)
+            self.serial_answers[path] = (state, answer)
+        return answer
+
+    def run_in_workers(self, file_paths, test_ids, max_busy=None,
+                       cancelled=None):
+        """runs the tests in file_paths in the worker pool, yields (file
+        path, result) as each file is done, and adds it to the history"""
+        durations = getattr(self.worker_pool, "durations", {})
+        batches = self.batches(file_paths)
+        if self.coverage_map is None:
+            for (index, result) in self.worker_pool.imap_unordered(
+                    run_tests_in_file, file_paths, max_busy, cancelled,
+                    batches):
+                path = file_paths[index]
+                self.history.record(path, result, durations.get(index))
+                self.report(path, index, result)
+                yield (path, result)
+            return
+        test_ids = test_ids or {}
+        tasks = [
+            (path, test_ids.get(path), self.coverage_map.root)
+            for path in file_paths
+        ]
+        for (index, covered) in self.worker_pool.imap_unordered(
+                run_covered_tests_in_file, tasks, max_busy, cancelled,
+                batches):
+            path = file_paths[index]
+            ids = test_ids.get(path)
+            if len(covered) != 3:
+                covered = (covered, None, None)  # the worker failed
+            result = self.coverage_map.record(path, ids, covered)
+            if path not in test_ids:
+                # Only runs of every test in the file tell how long it takes.
+                self.history.record(path, result, durations.get(index))
+            self.report(path, index, result, partial=path in test_ids)
+            yield (path, result)
+
+    def run_parts_in_workers(self, file_paths, cancelled=None):
+        """runs the tests in file_paths like run_in_workers, but splits the
+        files that were slow last time by TestCase class, so that the parts
+        can run on several workers at the same time"""
+        durations = getattr(self.worker_pool, "durations", {})
+        tasks = []
+        for path in file_paths:
+            tasks.extend(self.split_file(path))
+        parts_left = {}
+        for (path, _name, _names) in tasks:
+            parts_left[path] = parts_left.get(path, 0) + 1
+        merged = {}
+        spent = {}
+        # Parts of split files are slow, so only whole files are batched.
+        batches = self.batches([
+            None if names else path for (path, _name, names) in tasks
+        ])
+        for (index, result) in self.worker_pool.imap_unordered(
+                run_part_of_file, tasks, None, cancelled, batches):
+            (path, name, names) = tasks[index]
+            seconds = durations.get(index)
+            if names:
+                self.history.record(part_key(path, name), result, seconds)
+            self.report(path, index, result)
+            merged[path] = merge_results(merged.get(path), result)
+            if seconds is not None and spent.get(path, 0) is not None:
+                spent[path] = spent.get(path, 0) + seconds
+            else:
+                spent[path] = None
+            parts_left[path] -= 1
+            if not parts_left[path]:
+                self.history.record(path, merged[path], spent[path])
+                yield (path, merged[path])
+
+    def report(self, path, index, result, partial=False):
+        """adds up how long importing the module and finding its tests took,
+        from the test records of the task with index in the last run of the
+        worker pool, and hands them to the reporter, if any"""
+        test_records = getattr(self.worker_pool, "test_records", {}).get(
+            index
+        )
+        for test_record in test_records or ():
+            if "module" in test_record:
+                self.import_seconds += test_record["import_seconds"]
+                self.discovery_seconds += test_record["discovery_seconds"]
+        if self.reporter is not None:
+            self.reporter.record(path, test_records, result, partial)
+
+    def batches(self, file_paths):
+        """lists of indexes of the quick files in file_paths (skipping
+        None) to run together in one worker task each: as many as take
+        BATCH_SECONDS all together, but with several workers no more than
+        an even share of each"""
+        quick = []
+        for (index, path) in enumerate(file_paths):
+            if path is None:
+                continue
+            seconds = self.expected_seconds(path)
+            if seconds is not None and seconds <= BATCH_SECONDS / 2:
+                quick.append((index, seconds))
+        processes = getattr(self.worker_pool, "processes", 1)
+        share = max(1, -(-len(quick) // processes))
+        batches = []
+        batch = []
+        batch_seconds = 0
+        for (index, seconds) in quick:
+            if batch and (len(batch) == share or
+                          batch_seconds + seconds > BATCH_SECONDS):
+                batches.append(batch)
+                batch = []
+                batch_seconds = 0
+            batch.append(index)
+            batch_seconds += seconds
+        batches.append(batch)
+        return [batch for batch in batches if len(batch) > 1]
+
+    def expected_seconds(self, path):
+        """how long the tests in path are expected to take, from the last
+        time or else a guess for small files, or None if unknown"""
+        seconds = self.history.seconds(path, None)
+        if seconds is None:
+            try:
+                if os.path.getsize(path) <= SMALL_TEST_FILE:
+                    return BATCH_SECONDS / 10
+            except OSError:
+                pass
+        return seconds
+
+    def split_file(self, path):
+        """tasks for run_part_of_file: the whole file, or one part for each
+        TestCase class and one for the rest if it was slow last time, the
+        longest first"""
+        seconds = self.history.seconds(path)
+        names = ()
+        if seconds >= SPLIT_SECONDS:
+            names = tuple(top_level_classes(path))
+        if len(names) < 2:
+            return [(path, None, ())]
+        parts = [(path, name, names) for name in names + (None,)]
+        guess = seconds / len(parts)
+        parts.sort(key=lambda part: -self.history.seconds(
+            part_key(path, part[1]),
+            guess
+        ))
+        return parts
+
+    def summarize(self, results, run_time, files_run, files_pending=0,
+                  files_reused=0):
+        """updates the log, status message and result from module results,
+        files_pending tells how many files are still running and
+        files_reused how many results came from the result cache"""
+        now = time.strftime("%H:%M:%S", time.localtime())
+        passed = 0
+        total = 0
+        failed_logs = []  # Summary for each module, those with errors first
+        module_logs = []
+        for packed in results:
+            (module, green, number_of, logtext) = packed
+            passed += green
+            total += number_of
+            module_log = "\nLog from " + module + ":\n" + logtext
+            if not isinstance(number_of, int) or number_of - green > 0:
+                failed_logs.append(module_log)
+            else:
+                module_logs.append(module_log)
+        total_tests = int(total.real)
+        # logging?
+        self.stale = False
+        self.log = ""
+        self.log += "Monitoring folder %s.\n" % self.project_name
+        self.log += "Found %i tests in %i files.\n" % (
+            total_tests,
+            len(results)
+        )
+        self.log += "Last change detected at %s.\n" % now
+        if files_run < len(results):
+            self.log += "Ran the %i files affected by the change.\n" % (
+                files_run
+            )
+        if files_reused:
+            self.log += "Reused earlier results of %i unchanged files.\n" % (
+                files_reused
+            )
+        if files_pending:
+            self.log += "Still running %i files, for %.2f seconds now.\n" % (
+                files_pending,
+                run_time
+            )
+        else:
+            self.log += "Test run took %.2f seconds.\n" % run_time
+        if self.import_seconds or self.discovery_seconds:
+            self.log += (
+                "Workers spent %.2f seconds importing test modules, and "
+                "%.2f finding the tests in them.\n" % (
+                    self.import_seconds,
+                    self.discovery_seconds
+                )
+            )
+        notice = getattr(self.worker_pool, "notice", None)
+        if notice:
+            self.log += notice + "\n"
+        self.log += "\n"
+        failed_logs.reverse()
+        self.log += ''.join(failed_logs + module_logs)
+        # /logging?
+        if files_pending:
+            self.status_message = "Testing... %i of %i files done" % (
+                files_run - files_pending,
+                files_run
+            )
+        else:
+            self.status_message = now
+        self.result = Result(
+            total=total,
+            passed=passed,
+            time=run_time
+        )
+
+    def get_and_set_change_detected(self):
+        self.change_detected = self.monitor.look_for_changes()
+        return self.change_detected
+
+    def main(self):
+        """This is the main loop body"""
+        self.change_detected = self.monitor.look_for_changes()
+        if self.change_detected:
+            self.run_tests(self.change_detected)
+
+    def get_poll_interval(self):
+        "milliseconds until the monitor wants to look for changes again"
+        get_poll_interval = getattr(self.monitor, 'get_poll_interval', None)
+        if get_poll_interval is None:
+            return 750
+        return get_poll_interval()
+
+    def get_event_fileno(self):
+        """file descriptor that becomes readable when the monitor has changes
+        to report, or None if the monitor has to be polled"""
+        fileno = getattr(self.monitor, 'fileno', None)
+        if fileno is None:
+            return None
+        return fileno()
+
+    def close(self):
+        "stops the worker processes, and the monitor if it can be stopped"
+        self.worker_pool.close()
+        close = getattr(self.monitor, "close", None)
+        if close is not None:
+            close()
+
+    def get_log(self):
+        """Access the log string created during test run"""
+        return self.log
+
+    def get_status_message(self):
+        """Return message in status bar"""
+        return self.status_message
+
+
+def is_failure(result):
+    "does the (module, green, total, log) result have failures or errors?"
+    (_module, green, total, _log) = result
+    return bool(total.imag) or green < total
+
+
+class Monitor:
+    'Looks for file changes when prompted to'
+
+    min_poll_interval = 100
+    max_poll_interval = 2000
+
+    def __init__(self, file_finder, get_file_size, get_file_modtime):
+        self.file_finder = file_finder
+        self.get_file_size = get_file_size
+        self.get_file_modtime = get_file_modtime
+        self.poll_interval = self.min_poll_interval
+        self.scan_time = 0.0
+        self.snapshot = self.get_snapshot()
+
+    def get_snapshot(self):
+        snapshot = {}
+        for file in self.file_finder():
+            file_size = self.get_file_size(file)
+            file_modtime = self.get_file_modtime(file)
+            snapshot[file] = (file_size, file_modtime)
+        return snapshot
+
+    def look_for_changes(self):
+        """Returns the set of changed files, which is empty (and falsy) when
+        nothing changed."""
+        start = time.time()
+        new_snapshot = self.get_snapshot()
+        self.scan_time = time.time() - start
+        changed = changed_paths(self.snapshot, new_snapshot)
+        self.snapshot = new_snapshot
+        self.back_off(changed)
+        return changed
+
+    def back_off(self, change_detected):
+        """Polls quickly right after a change and slower the longer nothing
+        happens, but never spends more than a tenth of the time scanning."""
+        if change_detected:
+            self.poll_interval = self.min_poll_interval
+        else:
+            self.poll_interval = min(
+                self.poll_interval * 2,
+                self.max_poll_interval
+            )
+        self.poll_interval = max(
+            self.poll_interval,
+            int(self.scan_time * 10 * 1000)
+        )
+
+    def get_poll_interval(self):
+        "milliseconds to wait before the next call to look_for_changes"
+        return self.poll_interval
+
+
+class IncrementalMonitor(Monitor):
+    """Looks for file changes, but only lists the folders whose modification
+    time moved. Files in other folders are known already and only need a
+    single stat each."""
+
+    def __init__(self, file_finder):
+        self.folders = {}
+        Monitor.__init__(self, file_finder, None, None)
+
+    def get_snapshot(self):
+        snapshot = {}
+        folders = {}
+        pending = [self.file_finder.root]
+        while pending:
+            folder = pending.pop()
+            try:
+                folder_modtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue  # removed since its parent was listed
+            cached = self.folders.get(folder)
+            if cached is not None and cached[0] == folder_modtime:
+                (_modtime, file_paths, subfolders) = cached
+                self.stat_files(file_paths, snapshot)
+            else:
+                (file_paths, subfolders) = self.scan_folder(folder, snapshot)
+            folders[folder] = (folder_modtime, file_paths, subfolders)
+            pending.extend(subfolders)
+        self.folders = folders
+        return snapshot
+
+    @staticmethod
+    def stat_files(file_paths, snapshot):
+        "adds (size, modtime) of already known files to snapshot"
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            snapshot[file_path] = (stat.st_size, stat.st_mtime_ns)
+
+    def scan_folder(self, folder, snapshot):
+        """lists folder, adds matching files to snapshot and returns
+        (matching files, subfolders)"""
+        file_paths = []
+        subfolders = []
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            return (file_paths, subfolders)
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    # like os.walk, do not follow symlinked folders
+                    if not entry.is_symlink() and \
+                            not self.file_finder.excluded_folder(entry.path):
+                        subfolders.append(entry.path)
+                    continue
+                if not self.file_finder.matches(entry.path):
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            file_paths.append(entry.path)
+            snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return (file_paths, subfolders)
+
+
+def changed_paths(old_snapshot, new_snapshot):
+    "returns the set of paths added, removed or changed between snapshots"
+    changed = set(old_snapshot).symmetric_difference(new_snapshot)
+    for path, state in new_snapshot.items():
+        if path in old_snapshot and old_snapshot[path] != state:
+            changed.add(path)
+    return changed
+
+
+class InotifyMonitor:
+    """Looks for file changes by reading Linux inotify events, so that
+    nothing is walked or stat'ed while no files change."""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+        IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    )
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, file_finder, build_fallback, libc=None):
+        self.file_finder = file_finder
+        self.build_fallback = build_fallback
+        self.fallback = None
+        self.libc = libc or load_libc()
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise_errno("inotify_init1")
+        self.watches = {}
+        try:
+            self.add_watches(file_finder.root)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.files = set(file_finder())
+
+    def fileno(self):
+        "file descriptor that becomes readable when events are pending"
+        if self.fallback is not None:
+            return None
+        return self.fd
+
+    def add_watches(self, root):
+        "watches root and all folders below it, returns the folders watched"
+        folders = []
+        for path, subfolders, _filenames in os.walk(root):
+            subfolders[:] = [
+                folder for folder in subfolders
+                if not self.file_finder.excluded_folder(
+                    os.path.join(path, folder)
+                )
+            ]
+            watch = self.libc.inotify_add_watch(
+                self.fd,
+                path.encode(sys.getfilesystemencoding()),
+                self.EVENT_MASK
+            )
+            if watch < 0:
+                if ctypes_errno() == errno.ENOSPC:
+                    raise_errno("inotify_add_watch")
+                continue  # removed or unreadable folder, nothing to watch
+            self.watches[watch] = path
+            folders.append(path)
+        return folders
+
+    def read_events(self):
+        "yields (folder, name, mask) for every pending event"
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            offset = 0
+            while offset < len(data):
+                (watch, mask, _cookie, length) = \
+                    self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if mask & self.IN_IGNORED:
+                    self.watches.pop(watch, None)
+                    continue
+                yield (
+                    self.watches.get(watch),
+                    name.decode(sys.getfilesystemencoding()),
+                    mask
+                )
+
+    def look_for_changes(self):
+        """Returns the set of changed files, which is empty (and falsy) when
+        nothing changed."""
+        if self.fallback is not None:
+            return self.fallback.look_for_changes()
+        try:
+            return self.collect_changes()
+        except OSError:
+            # Most likely out of inotify watches, keep going by polling.
+            self.close()
+            self.fallback = self.build_fallback()
+            return set(self.files)
+
+    def collect_changes(self):
+        "translates pending events into the set of changed files"
+        changed = set()
+        for (folder, name, mask) in self.read_events():
+            if mask & self.IN_Q_OVERFLOW:
+                changed.update(self.files)
+                self.files = set(self.file_finder())
+                changed.update(self.files)
+                continue
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, name)
+            if mask & self.IN_ISDIR:
+                changed.update(self.folder_changed(path, mask))
+            elif self.file_finder.matches(path):
+                if mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    self.files.discard(path)
+                else:
+                    self.files.add(path)
+                changed.add(path)
+        return changed
+
+    def folder_changed(self, path, mask):
+        "returns the files that came or went along with the folder at path"
+        if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+            added = set()
+            if self.file_finder.excluded_folder(path):
+                return added
+            for folder in self.add_watches(path):
+                try:
+                    names = os.listdir(folder)
+                except OSError:
+                    continue  # already gone again
+                for name in names:
+                    file_path = os.path.join(folder, name)
+                    if self.file_finder.matches(file_path) and \
+                            os.path.isfile(file_path):
+                        added.add(file_path)
+            self.files.update(added)
+            return added
+        if mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+            prefix = path + os.sep
+            removed = set(f for f in self.files if f.startswith(prefix))
+            self.files.difference_update(removed)
+            return removed
+        return set()
+
+    def get_poll_interval(self):
+        "milliseconds to wait before the next call to look_for_changes"
+        if self.fallback is not None:
+            return self.fallback.get_poll_interval()
+        return 750
+
+    def close(self):
+        "stops watching"
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class ContentFilter:
+    """Wraps a monitor and only passes on the changed files whose contents
+    differ from the last time they were passed on, so touching a file or
+    switching back and forth between branches does not trigger a run."""
+
+    def __init__(self, monitor, file_finder, max_digests=50000):
+        self.monitor = monitor
+        self.max_digests = max_digests
+        self.digests = OrderedDict()
+        for file_path in file_finder():
+            self.remember(file_path, file_digest(file_path))
+
+    def __getattr__(self, name):
+        return getattr(self.monitor, name)
+
+    def look_for_changes(self):
+        """Returns the set of files with new contents, which is empty (and
+        falsy) when nothing really changed."""
+        changed = set()
+        for file_path in self.monitor.look_for_changes():
+            digest = file_digest(file_path)
+            # Forgotten files count as changed, to be on the safe side.
+            if file_path not in self.digests or \
+                    self.digests[file_path] != digest:
+                changed.add(file_path)
+            self.remember(file_path, digest)
+        return changed
+
+    def remember(self, file_path, digest):
+        "stores digest, forgetting the least recently changed when full"
+        self.digests.pop(file_path, None)
+        self.digests[file_path] = digest
+        while len(self.digests) > self.max_digests:
+            self.digests.popitem(last=False)
+
+
+class Precompiler:
+    """Wraps a monitor and compiles the Python files it reports changed,
+    and all of them to start with, into their __pycache__ folders in a
+    thread of its own. So the workers importing them find up to date
+    bytecode, instead of compiling them while the tests wait. Changed files
+    are compiled before the rest, maybe in the middle of a burst of
+    changes, so the bytecode is checked against a hash of the source, not
+    its modification time in whole seconds."""
+
+    def __init__(self, monitor, file_finder):
+        self.monitor = monitor
+        self.file_finder = file_finder
+        self.pending = deque()
+        self.queued = set()
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread = threading.Thread(
+            target=self.work,
+            name="pytddmon-precompiler"
+        )
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.monitor, name)
+
+    def look_for_changes(self):
+        """Returns the set of changed files, which is empty (and falsy) when
+        nothing changed."""
+        changed = self.monitor.look_for_changes()
+        self.compile_soon(changed, first=True)
+        return changed
+
+    def compile_soon(self, paths, first=False):
+        "has the Python files in paths compiled, before the others if first"
+        with self.condition:
+            for path in paths:
+                if not path.endswith(".py"):
+                    continue
+                if path in self.queued:
+                    if not first:
+                        continue
+                    self.pending.remove(path)
+                if first:
+                    self.pending.appendleft(path)
+                else:
+                    self.pending.append(path)
+                self.queued.add(path)
+            self.condition.notify()
+
+    def work(self):
+        "compiles pending files until stopped, starting with all files"
+        import py_compile
+        checked_hash = py_compile.PycInvalidationMode.CHECKED_HASH
+        self.compile_soon(sorted(self.file_finder()))
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                path = self.pending.popleft()
+                self.queued.discard(path)
+            try:
+                py_compile.compile(
+                    path,
+                    doraise=True,
+                    invalidation_mode=checked_hash
+                )
+            except (py_compile.PyCompileError, IOError, OSError):
+                pass  # the import will tell what is wrong
+
+    def close(self):
+        "stops compiling, and stops the monitor"
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join()
+        close = getattr(self.monitor, "close", None)
+        if close is not None:
+            close()
+
+
+class Debouncer:
+    """Wraps a monitor and holds changes back until none have come for
+    quiet_period seconds, so that a burst of saves, or a refactoring
+    touching many files, ends up in a single run. Changes are held back at
+    most max_wait seconds, so that constant churn can not keep the tests
+    from running."""
+
+    def __init__(self, monitor, quiet_period=0.2, max_wait=2.0,
+                 clock=time.time):
+        self.monitor = monitor
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self.clock = clock
+        self.pending = set()
+        self.first_change = None
+        self.last_change = None
+
+    def __getattr__(self, name):
+        return getattr(self.monitor, name)
+
+    def look_for_changes(self):
+        """Returns all files changed during the last burst of changes once
+        it is over, or an empty (and falsy) set."""
+        now = self.clock()
+        changed = self.monitor.look_for_changes()
+        if changed:
+            if not self.pending:
+                self.first_change = now
+            self.pending.update(changed)
+            self.last_change = now
+        if not self.pending or now < self.due():
+            return set()
+        (changed, self.pending) = (self.pending, set())
+        return changed
+
+    def due(self):
+        "when the changes held back are to be passed on"
+        return min(
+            self.last_change + self.quiet_period,
+            self.first_change + self.max_wait
+        )
+
+    def get_poll_interval(self):
+        "milliseconds to wait before the next call to look_for_changes"
+        poll_interval = self.monitor.get_poll_interval()
+        if not self.pending:
+            return poll_interval
+        until_due = int((self.due() - self.clock()) * 1000)
+        return max(0, min(poll_interval, until_due))
+
+
+def file_digest(file_path):
+    "returns a digest of the file contents, or None if it can not be read"
+    digest = hashlib.sha1()
+    try:
+        with open(file_path, "rb") as file_object:
+            for block in iter(lambda: file_object.read(64 * 1024), b""):
+                digest.update(block)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+
+def load_libc():
+    "loads the C library, which has the inotify functions on Linux"
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(
+        ctypes.util.find_library("c") or "libc.so.6",
+        use_errno=True
+    )
+    # Raises AttributeError on systems without inotify.
+    libc.inotify_init1
+    libc.inotify_add_watch
+    return libc
+
+
+def ctypes_errno():
+    "errno of the last call made through ctypes"
+    import ctypes
+    return ctypes.get_errno()
+
+
+def raise_errno(function_name):
+    "raises OSError for the errno left by a failed libc call"
+    error_number = ctypes_errno()
+    raise OSError(
+        error_number,
+        "%s: %s" % (function_name, os.strerror(error_number))
+    )
+
+
+####
+## Finding files
+####
+
+# Folders that never hold files worth monitoring, as gitignore patterns
+DEFAULT_EXCLUDES = [
+    ".git/", ".hg/", ".svn/", "__pycache__/", "node_modules/", ".tox/",
+    ".nox/", ".eggs/", "*.egg-info/", ".mypy_cache/", ".pytest_cache/",
+    ".pytddmon_cache/",
+]
+
+
+class FileFinder:
+    """Returns all files matching given regular expression from root
+    downwards, without looking into excluded folders: those matching the
+    exclude patterns or the root's .gitignore, and virtualenvs."""
+
+    def __init__(self, root, regexp, exclude=(), gitignore=True):
+        self.root = os.path.abspath(root)
+        self.regexp = regexp
+        self.pattern = re.compile("(?:%s)$" % regexp)
+        self.ignore_rules = IgnoreRules(self.root, DEFAULT_EXCLUDES)
+        if gitignore:
+            self.ignore_rules.read(os.path.join(self.root, ".gitignore"))
+        for pattern in exclude:
+            self.ignore_rules.add(pattern)
+
+    def __call__(self):
+        return self.find_files()
+
+    def find_files(self):
+        "recursively finds files matching regexp"
+        file_paths = set()
+        for path, folders, filenames in os.walk(self.root):
+            folders[:] = [
+                folder for folder in folders
+                if not self.excluded_folder(os.path.join(path, folder))
+            ]
+            for filename in filenames:
+                file_path = os.path.join(path, filename)
+                if self.matches(file_path):
+                    file_paths.add(os.path.abspath(file_path))
+        return file_paths
+
+    def re_complete_match(self, string_to_match):
+        "full string regexp check"
+        return self.pattern.match(string_to_match) is not None
+
+    def matches(self, file_path):
+        "is the file at file_path, in a folder not excluded, to be found?"
+        return self.re_complete_match(os.path.basename(file_path)) and \
+            not self.ignore_rules.excluded(file_path)
+
+    def excluded_folder(self, path):
+        "is the folder at path, and everything below it, to be left out?"
+        return self.ignore_rules.excluded(path, is_folder=True) or \
+            os.path.isfile(os.path.join(path, "pyvenv.cfg"))
+
+
+class IgnoreRules:
+    """Patterns in the format of .gitignore files, for paths below root.
+    Like in git, the last pattern matching a path decides."""
+
+    def __init__(self, root, patterns=()):
+        self.root = root
+        self.rules = []  # (regex, negated, folders only)
+        for pattern in patterns:
+            self.add(pattern)
+
+    def read(self, file_path):
+        "adds the patterns of the file at file_path, if there is one"
+        try:
+            with open(file_path) as ignore_file:
+                lines = ignore_file.read().splitlines()
+        except (IOError, OSError, UnicodeDecodeError):
+            return
+        for line in lines:
+            self.add(line)
+
+    def add(self, pattern):
+        "adds a pattern, skipping blank lines and comments"
+        pattern = pattern.rstrip()
+        if not pattern or pattern.startswith("#"):
+            return
+        negated = pattern.startswith("!")
+        if negated:
+            pattern = pattern[1:]
+        elif pattern.startswith("\\"):
+            pattern = pattern[1:]
+        folders_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if not pattern:
+            return
+        # Patterns without a slash match at any depth.
+        prefix = "" if "/" in pattern else "(?:.*/)?"
+        regex = re.compile(
+            prefix + ignore_pattern_to_regex(pattern.lstrip("/")) + "$"
+        )
+        self.rules.append((regex, negated, folders_only))
+
+    def excluded(self, path, is_folder=False):
+        "does the file, or folder, at path match the patterns?"
+        relative_path = os.path.relpath(path, self.root).replace(os.sep, "/")
+        excluded = False
+        for (regex, negated, folders_only) in self.rules:
+            if folders_only and not is_folder:
+                continue
+            if regex.match(relative_path):
+                excluded = not negated
+        return excluded
+
+
+def ignore_pattern_to_regex(pattern):
+    "translates a gitignore pattern into a regex, where * stops at slashes"
+    parts = []
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            parts.append("(?:.*/)?")
+            index += 3
+        elif pattern.startswith("**", index):
+            parts.append(".*")
+            index += 2
+        elif pattern[index] == "*":
+            parts.append("[^/]*")
+            index += 1
+        elif pattern[index] == "?":
+            parts.append("[^/]")
+            index += 1
+        elif pattern[index] == "[" and "]" in pattern[index + 2:]:
+            end = pattern.index("]", index + 2)
+            characters = pattern[index + 1:end]
+            if characters.startswith("!"):
+                characters = "^" + characters[1:]
+            parts.append("[%s]" % characters.replace("\\", "\\\\"))
+            index = end + 1
+        else:
+            parts.append(re.escape(pattern[index]))
+            index += 1
+    return "".join(parts)
+
+####
+## Finding dependencies
+####
+
+IMPORT_LINE = re.compile(r"[ \t]*(?:import|from)[ \t]")
+PYTHON_FILE = re.compile(r".*\.pyw?$")
+# The names unittest discovers test modules by
+TEST_FILE_NAME = re.compile(r"test.*\.pyw?$")
+
+
+class ImportGraph:
+    """Knows which of the monitored modules import which, by parsing their
+    import statements instead of importing them. Only the files that
+    changed are parsed again. Module names are resolved relative to root
+    and to the folders of path_entries (sys.path by default) below it, as
+    for a src layout."""
+
+    def __init__(self, root, path_entries=None):
+        self.root = os.path.abspath(root)
+        self.folders = import_folders(
+            self.root,
+            sys.path if path_entries is None else path_entries
+        )
+        self.imports = {}  # file path -> file paths it imports
+        self.modules = {}  # module name -> file path
+        self.resolved = {}  # file path -> monitored file paths it imports
+        self.unresolved = set()  # files importing modules not found
+        self.importable = set()  # names of modules found outside of them
+
+    def update(self, file_paths, changed_paths=None):
+        """Takes in the current set of files, parsing new files and the
+        changed_paths (all files if None) again."""
+        file_paths = set(file_paths)
+        for path in list(self.imports):
+            if path not in file_paths:
+                del self.imports[path]
+        self.modules = {}
+        for path in file_paths:
+            for folder in self.folders:
+                if folder != self.root and \
+                        not path.startswith(os.path.join(folder, "")):
+                    continue
+                module = file_name_to_module(folder, path)
+                if module.endswith(".__init__"):
+                    self.modules.setdefault(module[:-len(".__init__")], path)
+                self.modules.setdefault(module, path)
+        for path in file_paths:
+            if path in self.imports and changed_paths is not None and \
+                    path not in changed_paths:
+                continue
+            self.imports[path] = self.parse_imports(path)
+        # Imports can only be resolved once all modules are known.
+        self.resolved = dict(
+            (path, self.resolve(path, imports))
+            for path, imports in self.imports.items()
+        )
+        self.unresolved = set(
+            path for path, imports in self.imports.items()
+            if not self.all_found(path, imports)
+        )
+
+    @staticmethod
+    def parse_imports(path):
+        "returns the import statements in the file at path, as ast nodes"
+        try:
+            with open(path, "rb") as module_file:
+                source = module_file.read().decode("utf-8", "replace")
+        except (IOError, OSError):
+            return []
+        return find_imports(source)
+
+    def resolve(self, path, imports):
+        "returns the monitored files that the import statements refer to"
+        # For a package's __init__ module that is the package itself.
+        package = file_name_to_module(self.root, path).split(".")[:-1]
+        names = set()
+        for node in imports:
+            for name in imported_names(node, package):
+                names.add(name)
+                # Modules next to the importer are on sys.path when it is
+                # run as a script, and in Python 2 packages.
+                names.add(".".join(package + [name]))
+        files = set()
+        for name in names:
+            parts = name.split(".")
+            for end in range(1, len(parts) + 1):
+                file_path = self.modules.get(".".join(parts[:end]))
+                if file_path is not None and file_path != path:
+                    files.add(file_path)
+        return files
+
+    def all_found(self, path, imports):
+        """are the modules that the absolute import statements refer to
+        either monitored files or importable from outside the project? If
+        not, they may be found in ways that are not known here, like a test
+        adding to sys.path, or be project files that are not monitored."""
+        package = file_name_to_module(self.root, path).split(".")[:-1]
+        for node in imports:
+            if getattr(node, "level", 0):
+                continue  # relative to a monitored package
+            if getattr(node, "module", None):
+                names = [node.module]
+            else:
+                names = [alias.name for alias in node.names]
+            for name in names:
+                parts = name.split(".")
+                if not any(
+                        ".".join(base + parts[:end]) in self.modules
+                        for base in ([], package)
+                        for end in range(1, len(parts) + 1)) and \
+                        not self.is_importable(parts[0]):
+                    return False
+        return True
+
+    def is_importable(self, name):
+        """can the top level module with name be found outside the project,
+        without importing it? Modules found below root are not monitored,
+        or they would be known, so changes to them would go unnoticed."""
+        if name not in self.importable:
+            import importlib.util
+            try:
+                spec = None
+                if name not in sys.builtin_module_names:
+                    spec = importlib.util.find_spec(name)
+                    if spec is None:
+                        return False
+            except (ImportError, ValueError):
+                return False
+            if spec is not None and self.in_project(spec):
+                return False
+            self.importable.add(name)
+        return True
+
+    def in_project(self, spec):
+        "is the module of spec found below root, but not installed there?"
+        locations = list(spec.submodule_search_locations or ())
+        if spec.has_location:
+            locations.append(spec.origin)
+        project = os.path.join(self.root, "")
+        return any(
+            os.path.abspath(location).startswith(project) and
+            "site-packages" not in location.split(os.sep)
+            for location in locations
+        )
+
+    def dependencies(self, path):
+        "returns path and all monitored files it imports, directly or not"
+        dependencies = set([path])
+        pending = [path]
+        while pending:
+            for imported_path in self.resolved.get(pending.pop(), ()):
+                if imported_path not in dependencies:
+                    dependencies.add(imported_path)
+                    pending.append(imported_path)
+        return dependencies
+
+    def unimported(self, paths):
+        "returns the paths that no monitored file imports"
+        imported = set()
+        for files in self.resolved.values():
+            imported.update(files)
+        return set(paths).difference(imported)
+
+    def affected(self, changed_paths):
+        "returns changed_paths and all files that import them, directly or not"
+        imported_by = {}
+        for path, imported in self.resolved.items():
+            for imported_path in imported:
+                imported_by.setdefault(imported_path, set()).add(path)
+        affected = set(changed_paths)
+        pending = list(affected)
+        while pending:
+            for path in imported_by.get(pending.pop(), ()):
+                if path not in affected:
+                    affected.add(path)
+                    pending.append(path)
+        return affected
+
+
+def import_folders(root, path_entries):
+    """returns root and the folders of path_entries, like sys.path, below
+    it, which project modules are imported from"""
+    folders = [root]
+    for entry in path_entries:
+        folder = os.path.abspath(entry or os.curdir)
+        if folder.startswith(os.path.join(root, "")) and \
+                folder not in folders:
+            folders.append(folder)
+    return folders
+
+
+def find_imports(source):
+    """Returns the import statements in source as ast nodes. Only the
+    statements are parsed, not the whole module, which is a lot faster.
+
+    >>> [node.names[0].name for node in find_imports("import os\\nx = 1")]
+    ['os']
+    >>> len(find_imports("x = '''\\nfrom the docstring\\n'''"))
+    0
+    """
+    import ast
+    nodes = []
+    lines = source.splitlines()
+    for first, line in enumerate(lines):
+        if not IMPORT_LINE.match(line):
+            continue
+        statement = line.strip()
+        last = first
+        while (statement.endswith("\\") or
+               statement.count("(") > statement.count(")")) and \
+                last + 1 < len(lines):
+            last += 1
+            statement += "\n" + lines[last].strip()
+        try:
+            tree = ast.parse(statement)
+        except (SyntaxError, ValueError):
+            continue  # not an import statement after all
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                nodes.append(node)
+    return nodes
+
+
+def imported_names(node, package):
+    """Returns the absolute names of the modules an import statement in a
+    module in package (a list of names) may import."""
+    import ast
+    if isinstance(node, ast.Import):
+        return [alias.name for alias in node.names]
+    if node.level:
+        base = package[:len(package) - node.level + 1]
+    else:
+        base = []
+    if node.module:
+        base = base + node.module.split(".")
+    names = [".".join(base + [alias.name]) for alias in node.names]
+    if base:
+        names.append(".".join(base))
+    return names
+
+
+####
+## Finding & running tests
+####
+
+
+SERIAL_MARKER = "pytddmon: serial"
+SERIAL_MARKER_LINE = re.compile(
+    br"^[ \t]*#[ \t]*pytddmon:[ \t]*serial\b",
+    re.M
+)
+SERIAL_FOLDER_MARKER = ".pytddmon_serial"
+
+
+def runs_serially(file_path, root=None):
+    """Should the test module not run at the same time as other modules?
+
+    That is the case when it contains a "# pytddmon: serial" comment, or
+    a file named .pytddmon_serial is in its folder or a folder above it,
+    up to root when given."""
+    try:
+        with open(file_path, "rb") as module_file:
+            if SERIAL_MARKER_LINE.search(module_file.read()):
+                return True
+    except (IOError, OSError):
+        pass
+    folder = os.path.dirname(os.path.abspath(file_path))
+    if root is not None:
+        root = os.path.abspath(root)
+    while True:
+        if os.path.exists(os.path.join(folder, SERIAL_FOLDER_MARKER)):
+            return True
+        parent = os.path.dirname(folder)
+        if folder == root or parent == folder:
+            return False
+        folder = parent
+
+
+class StaticTestFilter:
+    """Knows which files may contain tests, from a look at their sources,
+    so that modules without tests need not be imported to find out. The
+    answers are kept by file digest in .pytddmon_cache/test_files.json,
+    and only files with new contents are looked at again."""
+
+    def __init__(self, root, load=True):
+        self.path = cache_file_path(root, "test_files.json")
+        self.answers = {}  # file digest -> may the file contain tests?
+        self.used = set()  # digests asked about in this session
+        self.digests = {}  # file path -> (file state, digest)
+        if load:
+            self.load()
+
+    def load(self):
+        "reads the answers saved by an earlier session, if any"
+        try:
+            with open(self.path) as cache_file:
+                self.answers = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            self.answers = {}
+
+    def may_have_tests(self, path, import_graph=None):
+        """may the file at path contain tests? Classes based on classes
+        imported from monitored modules, as import_graph tells, may be
+        tests. Without an import_graph, any imported base may be one."""
+        digest = known_file_digest(self.digests, path)
+        if digest is None:
+            return True  # let the worker tell what is wrong with it
+        self.used.add(digest)
+        if digest not in self.answers:
+            try:
+                with open(path, "rb") as source_file:
+                    source = source_file.read()
+            except (IOError, OSError):
+                return True
+            self.answers[digest] = may_contain_tests(source)
+        answer = self.answers[digest]
+        if not isinstance(answer, list):
+            return answer
+        if import_graph is None:
+            return bool(answer)
+        imports = find_imports("\n".join(answer))
+        return bool(import_graph.resolve(path, imports))
+
+    def save(self):
+        "writes the answers about the files seen in this session"
+        self.answers = dict(
+            (digest, answer) for (digest, answer) in self.answers.items()
+            if digest in self.used
+        )
+        write_file_atomically(self.path, json.dumps(self.answers))
+
+
+TEST_NAME = re.compile(r"Test|Case")
+
+
+def may_contain_tests(source):
+    """Could unittest or doctest find tests in the Python source, given as
+    bytes? That is when it has doctest examples, TestCase-like classes or
+    imports, test functions, a load_tests function or module level names
+    for test classes made elsewhere, as in TestMachine = Machine.TestCase.
+    Errs on the side of yes, also for sources that do not parse.
+
+    Returns True, or else the import statements of the classes that other
+    classes are based on, as a list of strings: when one of those is a
+    test base from the project, whatever its name, the module may also
+    have tests. The list is empty when there are no tests."""
+    import ast
+    if b">>>" in source:
+        return True
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return True  # the import will show the error
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            targets = node.targets
+        elif isinstance(node, ast.AnnAssign):
+            targets = [node.target]
+        else:
+            continue
+        if any(isinstance(target, ast.Name) and TEST_NAME.search(target.id)
+               for target in targets):
+            return True
+        if isinstance(node.value, ast.Attribute) and \
+                node.value.attr.endswith("TestCase"):
+            return True
+    imports = {}  # name bound by an import -> the import statement
+    base_names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            names = [node.name] if node.bases else []
+            for base in node.bases:
+                if isinstance(base, ast.Name):
+                    names.append(base.id)
+                    base_names.add(base.id)
+                elif isinstance(base, ast.Attribute):
+                    names.append(base.attr)
+                    while isinstance(base, ast.Attribute):
+                        base = base.value
+                    if isinstance(base, ast.Name):
+                        base_names.add(base.id)
+                else:
+                    return True  # a base found at run time
+            if any(TEST_NAME.search(name) for name in names):
+                return True
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if node.name.startswith("test") or node.name == "load_tests":
+                return True
+        elif isinstance(node, ast.ImportFrom):
+            for alias in node.names:
+                if alias.name == "*" or TEST_NAME.search(alias.name):
+                    return True
+                imports[alias.asname or alias.name] = "from %s%s import %s" % (
+                    "." * (node.level or 0), node.module or "", alias.name
+                )
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                name = alias.asname or alias.name.split(".")[0]
+                imports[name] = "import %s" % (
+                    alias.name if alias.asname else name
+                )
+    return sorted(set(
+        imports[name] for name in base_names if name in imports
+    ))
+
+
+CLASS_LINE = re.compile(r"^class[ \t]+(\w+)", re.M)
+
+
+def top_level_classes(file_path):
+    "names of the classes defined at the top level of the file"
+    try:
+        with open(file_path) as module_file:
+            return CLASS_LINE.findall(module_file.read())
+    except (IOError, OSError, UnicodeDecodeError):
+        return []
+
+
+def error_result(module, log):
+    """the result of a file whose tests could not run, with log telling
+    why: the total is a complex number to tell it is an error"""
+    return ('Exception(%s)' % (module,), 0, 1j, log)
+
+
+def log_exceptions(func):
+    """Decorator that forwards the error message from an exception to the log
+    slot of the return value, and also returns a complexnumber to signal that
+    the result is an error."""
+    wraps = functools.wraps
+
+    @wraps(func)
+    def wrapper(*a, **k):
+        "Docstring"
+        try:
+            return func(*a, **k)
+        except:
+            import traceback
+            return error_result(a[0], traceback.format_exc())
+    return wrapper
+
+
+@log_exceptions
+def run_tests_in_file(file_path):
+    module = file_name_to_module("", file_path)
+    return run_module(module)
+
+
+def run_module(module):
+    suite = find_tests_in_module(module)
+    (green, total, log) = run_suite(suite)
+    return (module, green, total, log)
+
+
+def run_part_of_file(task):
+    """Runs part of the tests in a file, so that a slow file can run on
+    several workers. The task is the tuple (file path, class name, split
+    class names): runs the tests of the TestCase class with that name, or
+    if it is None, the tests outside all of the split classes."""
+    import unittest
+    (file_path, name, names) = task
+    try:
+        module = file_name_to_module("", file_path)
+        suite = find_tests_in_module(module)
+    except:
+        import traceback
+        return error_result(file_path, traceback.format_exc())
+    def in_part(test):
+        if name is None:
+            return test.__class__.__name__ not in names
+        return test.__class__.__name__ == name
+    part = unittest.TestSuite(
+        test for test in iterate_tests(suite) if in_part(test)
+    )
+    (green, total, log) = run_suite(part)
+    return (module, green, total, log)
+
+
+def merge_results(first, second):
+    "the result of a file whose tests ran in parts, from those of two parts"
+    if first is None:
+        return second
+    (module, green, total, log) = first
+    if total.imag and second[2].imag:
+        return first  # every part failed to load the module the same way
+    green += second[1]
+    total += second[2]
+    if green == total:
+        log = "All %i tests passed\n" % green
+    elif second[1] != second[2]:
+        log = second[3] if first[1] == first[2] else log + second[3]
+    return (module, green, total, log)
+
+
+def file_name_to_module(base_path, file_name):
+    r"""Converts filenames of files in packages to import friendly dot
+    separated paths.
+
+    Examples:
+    >>> print(file_name_to_module("","pytddmon.pyw"))
+    pytddmon
+    >>> print(file_name_to_module("","pytddmon.py"))
+    pytddmon
+    >>> print(file_name_to_module("","tests/pytddmon.py"))
+    tests.pytddmon
+    >>> print(file_name_to_module("","./tests/pytddmon.py"))
+    tests.pytddmon
+    >>> print(file_name_to_module("",".\\tests\\pytddmon.py"))
+    tests.pytddmon
+    >>> print(
+    ...     file_name_to_module(
+    ...         "/User/pytddmon\\ geek/pytddmon/",
+    ...         "/User/pytddmon\\ geek/pytddmon/tests/pytddmon.py"
+    ...     )
+    ... )
+    tests.pytddmon
+    """
+    symbol_stripped = os.path.relpath(file_name, base_path)
+    for symbol in r"/\.":
+        symbol_stripped = symbol_stripped.replace(symbol, " ")
+    words = symbol_stripped.split()
+    # remove .py/.pyw
+    module_words = words[:-1]
+    module_name = '.'.join(module_words)
+    return module_name
+
+
+def find_tests_in_module(module):
+    import unittest
+    start = time.time()
+    try:
+        __import__(module)
+    except ImportError:
+        pass  # the loader makes a test that shows the error
+    imported = time.time()
+    suite = unittest.TestSuite()
+    suite.addTests(find_unittests_in_module(module))
+    suite.addTests(find_doctests_in_module(module))
+    test_records.append({
+        "module": module,
+        "import_seconds": imported - start,
+        "discovery_seconds": time.time() - imported
+    })
+    return suite
+
+
+def find_unittests_in_module(module):
+    import unittest
+    test_loader = unittest.TestLoader()
+    return test_loader.loadTestsFromName(module)
+
+
+def find_doctests_in_module(module):
+    import doctest
+    import unittest
+    try:
+        return doctest.DocTestSuite(
+            module,
+            optionflags=doctest.ELLIPSIS,
+            test_finder=doctest_cache
+        )
+    except ValueError:
+        return unittest.TestSuite()
+
+
+# Keeps the doctests found by this process, once use_doctest_cache is called
+doctest_cache = None
+
+
+def use_doctest_cache(root):
+    """has this process keep the doctests it finds in the DocTestCache
+    below root, and returns it"""
+    global doctest_cache
+    doctest_cache = DocTestCache(root)
+    return doctest_cache
+
+
+class DocTestCache:
+    """Finds the doctests in modules like doctest.DocTestFinder, but keeps
+    the parsed examples by digest of the module source, in the
+    .pytddmon_cache/doctests folder that all workers share. So docstrings
+    are only parsed again when the module changed. Modules with a __test__
+    dictionary, which may hold docstrings from elsewhere, are always
+    parsed. Files unused for max_age seconds are dropped by prune."""
+
+    def __init__(self, root, max_age=30 * 24 * 3600):
+        self.folder = cache_file_path(root, "doctests")
+        self.max_age = max_age
+
+    def find(self, module, globs=None, extraglobs=None):
+        "the doctest.DocTests in module, like DocTestFinder.find"
+        import doctest
+        path = self.path(module)
+        found = None
+        if path is not None:
+            found = self.load(path)
+        if found is None:
+            tests = doctest.DocTestFinder().find(
+                module,
+                globs=globs,
+                extraglobs=extraglobs
+            )
+            if path is not None:
+                self.save(path, [
+                    (t.examples, t.name, t.filename, t.lineno, t.docstring)
+                    for t in tests
+                ])
+            return tests
+        globs = dict(module.__dict__ if globs is None else globs)
+        globs.update(extraglobs or {})
+        # DocTest copies globs, so that every test has its own.
+        return [
+            doctest.DocTest(examples, globs, name, filename, lineno, docstring)
+            for (examples, name, filename, lineno, docstring) in found
+        ]
+
+    def path(self, module):
+        "where the doctests of module are kept, None if they can not be"
+        source = getattr(module, "__file__", None)
+        if getattr(module, "__test__", None) is not None or \
+                not source or not source.endswith(".py"):
+            return None
+        digest = file_digest(source)
+        if digest is None:
+            return None
+        key = hashlib.sha1(("%s\0%s\0%s" % (
+            sys.version,
+            module.__name__,
+            digest
+        )).encode("utf-8"))
+        return os.path.join(self.folder, key.hexdigest() + ".pickle")
+
+    @staticmethod
+    def load(path):
+        "the doctests kept in path, or None"
+        import pickle
+        try:
+            with open(path, "rb") as cache_file:
+                found = pickle.load(cache_file)
+            os.utime(path, None)  # still in use, see prune
+        except Exception:
+            return None  # missing, or written by another Python version
+        return found
+
+    def save(self, path, found):
+        "keeps the found doctests in path, ignoring errors"
+        import pickle
+        temporary = "%s.%i.tmp" % (path, os.getpid())
+        try:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            with open(temporary, "wb") as temporary_file:
+                pickle.dump(found, temporary_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+        except (IOError, OSError, pickle.PicklingError):
+            pass
+
+    def prune(self):
+        "drops the doctests of modules that were not used for max_age"
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return
+        too_old = time.time() - self.max_age
+        for name in names:
+            path = os.path.join(self.folder, name)
+            try:
+                if os.stat(path).st_mtime < too_old:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def run_suite(suite):
+    def string_io():
+        if ON_PYTHON3:
+            import io as StringIO
+        else:
+            import StringIO
+        return StringIO.StringIO()
+    import unittest
+    err_log = string_io()
+    text_test_runner = unittest.TextTestRunner(
+        stream=err_log,
+        verbosity=1,
+        resultclass=reporting_result_class(unittest.TextTestResult)
+    )
+    result = text_test_runner.run(suite)
+    green = result.testsRun - len(result.failures) - len(result.errors)
+    total = result.testsRun
+
+    if green < total:
+        log = err_log.getvalue()
+    else:
+        log = "All %i tests passed\n" % green
+
+    return (green, total, log)
+
+
+# What happened to each test run by this process that was not yet sent on:
+# a {"module", "import_seconds", "discovery_seconds"} record for each test
+# module loaded, and a {"id", "outcome", "seconds", "traceback"} record for
+# each test.
+test_records = []
+
+
+def take_test_records():
+    "returns and forgets the test records"
+    records = test_records[:]
+    del test_records[:]
+    return records
+
+
+def reporting_result_class(base):
+    """Returns a subclass of the TestResult class base, that adds a record
+    of the outcome and duration of each test to test_records."""
+
+    class ReportingTestResult(base):
+
+        def startTest(self, test):
+            self.current = (test, time.time())
+            self.outcome = ("passed", None)
+            base.startTest(self, test)
+
+        def stopTest(self, test):
+            base.stopTest(self, test)
+            (_test, started) = self.current
+            self.add_record(test, time.time() - started)
+            self.current = None
+
+        def add_record(self, test, seconds):
+            (outcome, details) = self.outcome
+            test_records.append({
+                "id": test.id(),
+                "outcome": outcome,
+                "seconds": seconds,
+                "traceback": details,
+            })
+
+        def set_outcome(self, test, outcome, details=None):
+            self.outcome = (outcome, details)
+            if getattr(self, "current", None) is None or \
+                    self.current[0] is not test:
+                # Errors outside of tests, like in setUpClass.
+                self.add_record(test, 0.0)
+
+        def addError(self, test, err):
+            base.addError(self, test, err)
+            self.set_outcome(test, "error", self.errors[-1][1])
+
+        def addFailure(self, test, err):
+            base.addFailure(self, test, err)
+            self.set_outcome(test, "failure", self.failures[-1][1])
+
+        def addSubTest(self, test, subtest, err):
+            base.addSubTest(self, test, subtest, err)
+            if err is None:
+                return
+            if issubclass(err[0], test.failureException):
+                self.outcome = ("failure", self.failures[-1][1])
+            else:
+                self.outcome = ("error", self.errors[-1][1])
+
+        def addSkip(self, test, reason):
+            base.addSkip(self, test, reason)
+            self.set_outcome(test, "skipped", reason)
+
+        def addExpectedFailure(self, test, err):
+            base.addExpectedFailure(self, test, err)
+            self.set_outcome(test, "expected failure")
+
+        def addUnexpectedSuccess(self, test):
+            base.addUnexpectedSuccess(self, test)
+            self.set_outcome(test, "unexpected success")
+
+    return ReportingTestResult
+
+
+####
+## Scheduling
+####
+
+
+class RunHistory:
+    """Remembers whether each test file failed and how long it took in its
+    last run, so that the next run can start with the files most likely to
+    tell something new: those that failed, or were edited lately, and then
+    the rest, fastest first. Also remembers the (passed, total, log) of the
+    last run, to show at the next start until the tests have run again.
+
+    The history is saved to .pytddmon_cache/history.json when there is a
+    root to save it below."""
+
+    def __init__(self, root=None, load=True):
+        self.path = None
+        if root is not None:
+            self.path = cache_file_path(root, "history.json")
+        self.files = {}  # file, or part_key of a part -> (failed, seconds)
+        self.last_result = None
+        if load:
+            self.load()
+
+    def load(self):
+        "reads the history saved by an earlier session, if any"
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as history_file:
+                saved = json.load(history_file)
+        except (IOError, OSError, ValueError):
+            return
+        for path, (failed, seconds) in saved.get("files", {}).items():
+            self.files[path] = (failed, seconds)
+        if saved.get("last_result"):
+            (passed, total, log) = saved["last_result"]
+            self.last_result = (complex(*passed), complex(*total), log)
+
+    def save(self):
+        "writes the history for the next session"
+        if self.path is None:
+            return
+        saved = {"files": self.files}
+        if self.last_result is not None:
+            (passed, total, log) = self.last_result
+            # JSON has no complex numbers, which errors are counted in.
+            saved["last_result"] = (
+                (passed.real, passed.imag),
+                (total.real, total.imag),
+                log
+            )
+        write_file_atomically(self.path, json.dumps(saved))
+
+    def record(self, path, result, seconds):
+        "remembers the result of running the file, and how long it took"
+        if seconds is None:
+            seconds = self.files.get(path, (False, 0))[1]
+        self.files[path] = (is_failure(result), seconds)
+
+    def seconds(self, key, default=0):
+        "how long the file or part took last time"
+        return self.files.get(key, (False, default))[1]
+
+    def order(self, file_paths, longest_first=False, now=None):
+        """file_paths sorted to run files that failed or were edited lately
+        first, fastest first, and then the rest; fastest first as well
+        unless longest_first"""
+        if now is None:
+            now = time.time()
+        def key(path):
+            (failed, seconds) = self.files.get(path, (False, 0))
+            try:
+                edited = now - os.stat(path).st_mtime < RECENT_EDIT
+            except OSError:
+                edited = False
+            first = failed or edited or path not in self.files
+            if longest_first and not first:
+                seconds = -seconds
+            return (not first, seconds, path)
+        return sorted(file_paths, key=key)
+
+
+def part_key(path, class_name):
+    "key of the part of a split file in the RunHistory"
+    return "%s::%s" % (path, class_name or "")
+
+
+class ResultCache:
+    """Results of test files from earlier runs, kept in
+    .pytddmon_cache/results.json so that files whose sources did not change
+    need not run again, not even after a restart. The key of a result is a
+    digest of the Python version and the contents of the test file and
+    every monitored file it imports, directly or not.
+
+    Results that were not used for max_age seconds, and the least recently
+    used ones beyond max_entries, are dropped when the cache is saved.
+    Results of files that could not run are not kept."""
+
+    def __init__(self, root, max_entries=5000, max_age=30 * 24 * 3600,
+                 load=True):
+        self.path = cache_file_path(root, "results.json")
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries = {}  # key -> [module, green, total, log, last used]
+        self.digests = {}  # file path -> (file state, digest)
+        if load:
+            self.load()
+
+    def load(self):
+        "reads the results saved by an earlier session, if any"
+        try:
+            with open(self.path) as cache_file:
+                self.entries = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        "drops old results and writes the rest for the next session"
+        now = time.time()
+        used = sorted(
+            (entry[4], key) for (key, entry) in self.entries.items()
+            if now - entry[4] < self.max_age
+        )
+        self.entries = dict(
+            (key, self.entries[key])
+            for (_, key) in used[len(used) - self.max_entries:]
+        )
+        write_file_atomically(self.path, json.dumps(self.entries))
+
+    def key(self, file_paths):
+        "the key of the result of a test file that depends on file_paths"
+        key = hashlib.sha1(sys.version.encode("utf-8"))
+        for path in sorted(file_paths):
+            key.update(("%s\0%s\0" % (path, self.digest(path))).encode(
+                "utf-8",
+                "replace"
+            ))
+        return key.hexdigest()
+
+    def digest(self, path):
+        "file_digest of path, only read again when the file has changed"
+        return known_file_digest(self.digests, path)
+
+    def get(self, key):
+        "the (module, green, total, log) result with the key, or None"
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        entry[4] = time.time()
+        return tuple(entry[:4])
+
+    def put(self, key, result):
+        "keeps the result under key, unless the tests could not run"
+        if not result[2].imag:
+            self.entries[key] = list(result) + [time.time()]
+
+
+####
+## Reports
+####
+
+
+class Reporter:
+    """Writes what happened to each test, with its outcome, how long it took,
+    how long loading its module took and the traceback of failures, for
+    other tools to read:
+
+    - as JSON Lines to json_path: an event for each test that ran, and one
+      for the whole run, added to the end of the file after each run.
+    - as JUnit XML to junit_path: all tests that ran in this session,
+      replacing the file after each run."""
+
+    def __init__(self, json_path=None, junit_path=None):
+        self.json_path = json_path
+        self.junit_path = junit_path
+        self.tests = {}  # file path -> records of its tests' last runs
+        self.fresh = set()  # file paths that ran in this run
+
+    def start_run(self):
+        "starts collecting the records of a new run"
+        self.fresh = set()
+
+    def record(self, path, test_records, result, partial=False):
+        """keeps the test records of a task that ran the tests, or some
+        tests when partial, in the file"""
+        tests = []
+        module = {
+            "module": result[0],
+            "import_seconds": None,
+            "discovery_seconds": None,
+        }
+        for test_record in test_records or ():
+            if "module" in test_record:
+                module = test_record
+                continue
+            test = dict(test_record)
+            test.update(module, file=path)
+            tests.append(test)
+        if not tests and result[2].imag:
+            # The module could not be loaded, or the worker died.
+            module = file_name_to_module("", path)
+            tests.append({
+                "id": module, "outcome": "error", "seconds": 0.0,
+                "traceback": result[3], "file": path, "module": module,
+                "import_seconds": None, "discovery_seconds": None,
+            })
+        if path not in self.fresh:
+            self.fresh.add(path)
+            ran = set(test["id"] for test in tests)
+            if partial:
+                self.tests[path] = [
+                    test for test in self.tests.get(path, ())
+                    if test["id"] not in ran
+                ]
+            else:
+                self.tests[path] = []
+        self.tests[path].extend(tests)
+
+    def discard(self, path):
+        "forgets the records of the file from this run, which did not finish"
+        if path in self.fresh:
+            self.fresh.remove(path)
+            del self.tests[path]
+
+    def write(self, file_paths, result):
+        "writes the reports after a run with the (passed, total) result"
+        for path in list(self.tests):
+            if path not in file_paths:
+                del self.tests[path]
+        if self.json_path is not None:
+            self.write_json_lines(result)
+        if self.junit_path is not None:
+            write_file_atomically(self.junit_path, self.junit_xml())
+
+    def write_json_lines(self, result):
+        "adds an event for each test that ran and for the run to json_path"
+        now = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
+        events = []
+        for path in sorted(self.fresh):
+            for test in self.tests.get(path, ()):
+                event = {"event": "test", "time": now}
+                event.update(test)
+                events.append(event)
+        events.append({
+            "event": "run",
+            "time": now,
+            "passed": int(result.passed.real),
+            "total": int(result.total.real),
+            "error": bool(result.total.imag),
+            "seconds": result.time,
+            "files_run": len(self.fresh),
+        })
+        try:
+            with open(self.json_path, "a") as json_file:
+                for event in events:
+                    json_file.write(json.dumps(event, sort_keys=True) + "\n")
+        except (IOError, OSError):
+            pass
+
+    def junit_xml(self):
+        "the JUnit XML report of all tests known"
+        from xml.etree import ElementTree
+        suites = ElementTree.Element("testsuites")
+        for path in sorted(self.tests):
+            tests = self.tests[path]
+            module = tests[0]["module"] if tests else path
+            suite = ElementTree.SubElement(suites, "testsuite", name=module)
+            suite.set("file", path)
+            properties = ElementTree.SubElement(suite, "properties")
+            for name in ["import_seconds", "discovery_seconds"]:
+                if tests and tests[0].get(name) is not None:
+                    ElementTree.SubElement(
+                        properties,
+                        "property",
+                        name=name,
+                        value="%.3f" % tests[0][name]
+                    )
+            counts = dict.fromkeys(["failures", "errors", "skipped"], 0)
+            for test in tests:
+                (class_name, _, name) = test["id"].rpartition(".")
+                case = ElementTree.SubElement(
+                    suite,
+                    "testcase",
+                    classname=class_name or module,
+                    name=name,
+                    time="%.3f" % test["seconds"]
+                )
+                kind = JUNIT_OUTCOMES.get(test["outcome"])
+                if kind is None:
+                    continue
+                counts[kind] += 1
+                details = ElementTree.SubElement(case, JUNIT_ELEMENTS[kind])
+                details.set("message", test["outcome"])
+                details.text = test["traceback"] or ""
+            suite.set("tests", str(len(tests)))
+            for (kind, count) in counts.items():
+                suite.set(kind, str(count))
+            suite.set("time", "%.3f" % sum(test["seconds"] for test in tests))
+        return '<?xml version="1.0" encoding="utf-8"?>\n' + \
+            ElementTree.tostring(suites, encoding="unicode") + "\n"
+
+
+# Outcomes of tests that JUnit XML reports as failures, errors or skipped
+JUNIT_OUTCOMES = {
+    "failure": "failures",
+    "unexpected success": "failures",
+    "error": "errors",
+    "skipped": "skipped",
+}
+JUNIT_ELEMENTS = {
+    "failures": "failure",
+    "errors": "error",
+    "skipped": "skipped",
+}
+
+
+####
+## Coverage-driven test selection
+####
+
+COVERAGE_SEPARATOR = "=" * 70
+
+
+class CoverageMap:
+    """Knows which lines of which files each test executed, so that a change
+    to lines executed by some tests only reruns those tests. Changes that
+    can not be mapped to tests, like new code or code that runs on import,
+    make the importers of the changed file run in whole instead.
+
+    The map is kept up to date from every run, and saved to
+    .pytddmon_cache/coverage.json."""
+
+    def __init__(self, root, load=True):
+        self.root = os.path.abspath(root)
+        self.path = cache_file_path(self.root, "coverage.json")
+        self.tests = {}  # test id -> (module file, {file: lines})
+        self.module_lines = {}  # module file -> {file: lines} outside tests
+        self.sources = {}  # file -> (line hashes, executable lines)
+        self.outcomes = {}  # module file -> {test id: failure logs}
+        if load:
+            self.load()
+
+    def load(self):
+        "reads the map saved by an earlier session, if any"
+        try:
+            with open(self.path) as map_file:
+                saved = json.load(map_file)
+        except (IOError, OSError, ValueError):
+            return
+        if saved.get("python") != sys.version:
+            return
+        for test_id, (module, files) in saved["tests"].items():
+            self.tests[test_id] = (module, lines_to_sets(files))
+        for module, files in saved["module_lines"].items():
+            self.module_lines[module] = lines_to_sets(files)
+        for path, (hashes, executable) in saved["sources"].items():
+            self.sources[path] = (hashes, set(executable))
+
+    def save(self):
+        "writes the map for the next session"
+        saved = {
+            "python": sys.version,
+            "tests": dict(
+                (test_id, (module, lines_to_lists(files)))
+                for test_id, (module, files) in self.tests.items()
+            ),
+            "module_lines": dict(
+                (module, lines_to_lists(files))
+                for module, files in self.module_lines.items()
+            ),
+            "sources": dict(
+                (path, (hashes, sorted(executable)))
+                for path, (hashes, executable) in self.sources.items()
+            ),
+        }
+        write_file_atomically(self.path, json.dumps(saved))
+
+    def has_outcomes(self, module):
+        "are the outcomes of every test in module known?"
+        return module in self.outcomes
+
+    def split_changes(self, changed_paths):
+        """Returns (whole_files, tests): the changed files whose importers
+        all have to run, and {module file: test ids, or None for all tests}
+        of the tests to run for the other changes."""
+        whole_files = set()
+        tests = {}
+        modules_with_tests = set(module for module, _ in self.tests.values())
+        for path in changed_paths:
+            if path in modules_with_tests:
+                tests[path] = None  # its tests may have changed too
+            picked = self.tests_executing_changes(path)
+            if picked is None:
+                whole_files.add(path)
+                continue
+            for test_id in picked:
+                module = self.tests[test_id][0]
+                if tests.get(module, ()) is not None:
+                    tests.setdefault(module, set()).add(test_id)
+        return (whole_files, tests)
+
+    def tests_executing_changes(self, path):
+        """Returns the tests that executed the lines changed in the file at
+        path, or None if that can not be told. Moves the recorded lines of
+        all tests to where they are in the changed file."""
+        old_source = self.sources.get(path)
+        new_source = read_source_lines(path)
+        if old_source is None or new_source is None:
+            self.forget(path, new_source)
+            return None
+        (old_hashes, old_executable) = old_source
+        (new_hashes, new_executable) = new_source
+        import difflib
+        opcodes = difflib.SequenceMatcher(
+            None, old_hashes, new_hashes, autojunk=False
+        ).get_opcodes()
+        touched = set()
+        for (tag, old_start, old_end, new_start, new_end) in opcodes:
+            if tag == "equal":
+                continue
+            old_lines = set(range(old_start + 1, old_end + 1))
+            new_lines = set(range(new_start + 1, new_end + 1))
+            if old_lines & old_executable:
+                touched.update(old_lines & old_executable)
+            elif new_lines & new_executable:
+                # New code, it runs wherever the code around it runs.
+                touched.update(neighbours(old_start, old_executable))
+        picked = set()
+        covered = set()
+        for test_id, (_module, files) in self.tests.items():
+            hit = touched.intersection(files.get(path, ()))
+            if hit:
+                picked.add(test_id)
+                covered.update(hit)
+        if touched - covered or touched & self.lines_outside_tests(path):
+            picked = None
+        self.move_lines(path, opcodes)
+        self.sources[path] = new_source
+        return picked
+
+    def lines_outside_tests(self, path):
+        "lines of path that ran when a module was imported or set up"
+        lines = set()
+        for files in self.module_lines.values():
+            lines.update(files.get(path, ()))
+        return lines
+
+    def move_lines(self, path, opcodes):
+        """moves the recorded lines of path to their line numbers in the
+        changed file, dropping the lines that changed"""
+        moved = {}
+        for (tag, old_start, old_end, new_start, _new_end) in opcodes:
+            if tag == "equal":
+                for offset in range(old_end - old_start):
+                    moved[old_start + 1 + offset] = new_start + 1 + offset
+        for files in [f for _, f in self.tests.values()] + \
+                list(self.module_lines.values()):
+            if path in files:
+                files[path] = set(
+                    moved[line] for line in files[path] if line in moved
+                )
+
+    def forget(self, path, new_source):
+        "starts over for path, with nothing known about its lines"
+        for files in [f for _, f in self.tests.values()] + \
+                list(self.module_lines.values()):
+            files.pop(path, None)
+        if new_source is None:
+            self.sources.pop(path, None)
+        else:
+            self.sources[path] = new_source
+
+    def record(self, module, test_ids, covered_result):
+        """Takes in the result of run_covered_tests_in_file for module,
+        where test_ids were run (all if None). Returns the usual
+        (module name, green, total, log) result for all tests in module."""
+        (result, outcomes, lines) = covered_result
+        if outcomes is None:
+            self.outcomes.pop(module, None)
+            return result
+        # The files may have changed since their lines were recorded, with
+        # no split_changes to move the lines, as in a full run.
+        for path in set(path for files in lines.values() for path in files):
+            source = read_source_lines(path)
+            if source != self.sources.get(path):
+                self.forget(path, source)
+        if test_ids is None:
+            for test_id in [t for t, (m, _) in self.tests.items()
+                            if m == module and t not in outcomes]:
+                del self.tests[test_id]
+            self.outcomes[module] = outcomes
+        else:
+            self.outcomes[module].update(outcomes)
+        for test_id in outcomes:
+            self.tests[test_id] = (module, lines.get(test_id, {}))
+        self.module_lines[module] = lines.get(None, {})
+        return summarize_outcomes(result[0], self.outcomes[module])
+
+
+def summarize_outcomes(module_name, outcomes):
+    "(module name, green, total, log) from {test id: failure logs}"
+    failures = [
+        "".join(outcomes[test_id])
+        for test_id in sorted(outcomes) if outcomes[test_id]
+    ]
+    total = len(outcomes)
+    green = total - len(failures)
+    if failures:
+        log = "".join(failures)
+    else:
+        log = "All %i tests passed\n" % green
+    return (module_name, green, total, log)
+
+
+def neighbours(index, lines):
+    "the closest of lines before and after the gap before line index + 1"
+    before = [line for line in lines if line <= index]
+    after = [line for line in lines if line > index]
+    return set(([max(before)] if before else []) +
+               ([min(after)] if after else []))
+
+
+def read_source_lines(path):
+    """(hashes of each line, numbers of lines with code) of the Python file
+    at path, or None if it can not be read or compiled"""
+    try:
+        with open(path, "rb") as source_file:
+            source = source_file.read()
+    except (IOError, OSError):
+        return None
+    executable = executable_lines(source)
+    if executable is None:
+        return None
+    hashes = [zlib.crc32(line) for line in source.splitlines()]
+    return (hashes, executable)
+
+
+def executable_lines(source):
+    "numbers of the lines that have code in source, None if it has errors"
+    import dis
+    try:
+        code = compile(source, "<source>", "exec", dont_inherit=True)
+    except (SyntaxError, ValueError):
+        return None
+    lines = set()
+    pending = [code]
+    while pending:
+        code = pending.pop()
+        lines.update(line for (_, line) in dis.findlinestarts(code) if line)
+        pending.extend(c for c in code.co_consts if hasattr(c, "co_code"))
+    return lines
+
+
+def lines_to_sets(files):
+    "{file: line list} as {file: line set}"
+    return dict((path, set(lines)) for path, lines in files.items())
+
+
+def lines_to_lists(files):
+    "{file: line set} as {file: sorted line list}"
+    return dict((path, sorted(lines)) for path, lines in files.items())
+
+
+def cache_file_path(root, name):
+    """path of the file name in the .pytddmon_cache folder below root,
+    which is created if needed"""
+    folder = os.path.join(root, ".pytddmon_cache")
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+            with open(os.path.join(folder, ".gitignore"), "w") as ignore:
+                ignore.write("# Created by pytddmon\n*\n")
+        except (IOError, OSError):
+            pass  # writing to the cache will fail quietly later
+    return os.path.join(folder, name)
+
+
+def write_file_atomically(path, content):
+    "replaces the file at path with content, ignoring errors"
+    temporary = "%s.%i.tmp" % (path, os.getpid())
+    try:
+        with open(temporary, "w") as temporary_file:
+            temporary_file.write(content)
+        os.replace(temporary, path)
+    except (IOError, OSError):
+        pass
+
+
+class LineRecorder:
+    """Records which lines of the files below root get executed, separately
+    for each test. Uses sys.monitoring where available (Python 3.12 and
+    later), and a trace function otherwise."""
+
+    def __init__(self, root):
+        self.root = os.path.join(os.path.abspath(root), "")
+        self.lines = {None: {}}  # test id, or None -> {file: lines}
+        self.current = self.lines[None]
+        self.paths = {}  # co_filename -> absolute path, or None if outside
+        self.monitoring = getattr(sys, "monitoring", None)
+
+    def start(self):
+        "starts recording"
+        if self.monitoring is not None:
+            tool = self.monitoring.COVERAGE_ID
+            try:
+                self.monitoring.use_tool_id(tool, "pytddmon")
+            except ValueError:
+                self.monitoring = None  # in use by a coverage tool already
+        if self.monitoring is not None:
+            self.monitoring.register_callback(
+                self.monitoring.COVERAGE_ID,
+                self.monitoring.events.LINE,
+                self.on_line
+            )
+            self.monitoring.set_events(
+                self.monitoring.COVERAGE_ID,
+                self.monitoring.events.LINE
+            )
+        else:
+            sys.settrace(self.on_call)
+
+    def stop(self):
+        "stops recording"
+        if self.monitoring is not None:
+            tool = self.monitoring.COVERAGE_ID
+            self.monitoring.set_events(tool, 0)
+            self.monitoring.register_callback(
+                tool, self.monitoring.events.LINE, None
+            )
+            self.monitoring.free_tool_id(tool)
+        else:
+            sys.settrace(None)
+
+    def start_test(self, test_id):
+        "records the lines executed from now on for test_id"
+        self.current = self.lines.setdefault(test_id, {})
+        self.restart()
+
+    def stop_test(self):
+        "records the lines executed from now on as outside any test"
+        self.current = self.lines[None]
+        self.restart()
+
+    def restart(self):
+        "lets sys.monitoring report the lines it was told to disable again"
+        if self.monitoring is not None:
+            self.monitoring.restart_events()
+
+    def path(self, filename):
+        "absolute path of filename if it is below root, otherwise None"
+        try:
+            return self.paths[filename]
+        except KeyError:
+            path = os.path.abspath(filename)
+            if filename.startswith("<") or not path.startswith(self.root):
+                path = None
+            self.paths[filename] = path
+            return path
+
+    def on_line(self, code, line):
+        "sys.monitoring callback, records each line once per test"
+        path = self.path(code.co_filename)
+        if path is not None:
+            self.current.setdefault(path, set()).add(line)
+        return self.monitoring.DISABLE
+
+    def on_call(self, frame, _event, _arg):
+        "global trace function, only traces the frames of files below root"
+        if self.path(frame.f_code.co_filename) is None:
+            return None
+        return self.on_trace
+
+    def on_trace(self, frame, event, _arg):
+        "local trace function"
+        if event == "line":
+            path = self.path(frame.f_code.co_filename)
+            self.current.setdefault(path, set()).add(frame.f_lineno)
+        return self.on_trace
+
+
+def recording_test_result(recorder):
+    """Returns a TestResult that tells the LineRecorder which test is running
+    and collects the failure logs of each test. The class is made here, so
+    that unittest is only imported once tests run."""
+    import unittest
+    base = reporting_result_class(unittest.TestResult)
+
+    class RecordingTestResult(base):
+
+        def __init__(self, recorder):
+            base.__init__(self)
+            self.recorder = recorder
+            self.outcomes = {}  # test id -> failure logs
+
+        def startTest(self, test):
+            base.startTest(self, test)
+            self.outcomes.setdefault(test.id(), [])
+            self.recorder.start_test(test.id())
+
+        def stopTest(self, test):
+            self.recorder.stop_test()
+            base.stopTest(self, test)
+
+        def collect_failures(self):
+            """adds the failures and errors, also those outside of tests
+            like in setUpClass, to outcomes"""
+            for (flavour, failures) in (("ERROR", self.errors),
+                                        ("FAIL", self.failures)):
+                for (test, log) in failures:
+                    # Failed subtests are reported for their test.
+                    test_id = getattr(test, "test_case", test).id()
+                    self.outcomes.setdefault(test_id, []).append(
+                        "%s\n%s: %s\n%s\n%s\n" % (
+                            COVERAGE_SEPARATOR, flavour, test.id(),
+                            "-" * len(COVERAGE_SEPARATOR), log
+                        )
+                    )
+
+    return RecordingTestResult(recorder)
+
+
+def run_covered_tests_in_file(task):
+    """Runs the tests with the given ids (all if None) in a file, recording
+    the lines they execute below root. The task is the tuple
+    (file path, test ids, root).
+
+    Returns (result, outcomes, lines), where outcomes is {test id: failure
+    logs} and lines is {test id, or None for outside tests: {file: lines}}.
+    If the tests could not be loaded, result is the usual error result and
+    outcomes and lines are None."""
+    import unittest
+    (file_path, test_ids, root) = task
+    recorder = LineRecorder(root)
+    recorder.start()
+    try:
+        module = file_name_to_module("", file_path)
+        suite = find_tests_in_module(module)
+    except:
+        recorder.stop()
+        import traceback
+        return (error_result(file_path, traceback.format_exc()), None, None)
+    if test_ids is not None:
+        suite = unittest.TestSuite(
+            test for test in iterate_tests(suite) if test.id() in test_ids
+        )
+    result = recording_test_result(recorder)
+    try:
+        suite.run(result)
+    finally:
+        recorder.stop()
+    result.collect_failures()
+    return ((module, 0, 0, ""), result.outcomes, recorder.lines)
+
+
+def iterate_tests(suite):
+    "yields the test cases in suite and the suites within it"
+    import unittest
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for inner in iterate_tests(test):
+                yield inner
+        else:
+            yield test
+
+
+####
+## Worker processes
+####
+
+
+class WorkerPool:
+    """Test worker processes that are kept warm between test runs.
+
+    A worker is replaced before a run when it imported any project file,
+    or any file it imported has changed, and after max_tasks tasks, so
+    test modules are imported fresh for every run. Modules from outside
+    the project that earlier workers imported are imported by new workers
+    before they get any work, and replacements for workers that imported
+    project files are started in advance, as standby, as soon as a run is
+    over.
+
+    A run can be cancelled: then no more tasks are started, and the tasks
+    that are still running get grace_period seconds to finish before their
+    workers are terminated.
+
+    Items can be run in batches, several in one task, to save the cost of
+    a task each for items that take little time.
+
+    A worker that runs a task for more than timeout seconds, or uses more
+    than max_memory bytes of memory (where that can be told), is killed,
+    and the item gets an error result. A batch whose worker is killed, or
+    dies, is split up, and its items run again one at a time, so that a
+    batch takes no longer than one item to give up on."""
+
+    def __init__(self, processes=1, max_tasks=100, root=None,
+                 fork_server=None, grace_period=1.0, timeout=None,
+                 max_memory=None):
+        self.processes = processes
+        self.max_tasks = max_tasks
+        self.grace_period = grace_period
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.root = root
+        self.fork_server = fork_server
+        self.workers = []
+        self.standby = []
+        self.preload = set()
+        self.durations = {}  # index -> seconds, of the tasks of the last run
+        self.test_records = {}  # index -> test records, of the same tasks
+
+    def imap_unordered(self, func, items, max_busy=None, cancelled=None,
+                       batches=None):
+        """runs func(item) for each item, on at most max_busy workers at a
+        time, yields (index, result) as they finish. Stops early, without
+        results for the rest of the items, once cancelled() is true.
+        batches are lists of indexes of items to run in one task."""
+        self.recycle()
+        self.durations.clear()
+        self.test_records.clear()
+        pending = batch_tasks(func, items, batches or ())
+        pending.reverse()
+        busy = []
+        deadline = None
+        try:
+            while pending or busy:
+                if deadline is None and cancelled is not None and cancelled():
+                    pending = []
+                    deadline = time.time() + self.grace_period
+                for worker in self.workers:
+                    if not pending or len(busy) == max_busy:
+                        break
+                    if worker not in busy:
+                        worker.send(*pending.pop())
+                        busy.append(worker)
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                elif cancelled is not None:
+                    timeout = CANCEL_CHECK_INTERVAL
+                timeout = self.time_to_check_limits(busy, timeout)
+                ready = wait_for_connections(
+                    [w.connection for w in busy], timeout
+                )
+                for worker in list(busy):
+                    (index, item) = worker.task
+                    if worker.connection in ready:
+                        try:
+                            result = worker.receive()
+                        except (EOFError, OSError):
+                            reason = worker.death_reason()
+                        else:
+                            busy.remove(worker)
+                            for packed in self.task_done(
+                                    worker, index, result):
+                                yield packed
+                            continue
+                    else:
+                        reason = self.limit_exceeded(worker)
+                        if reason is None:
+                            continue
+                    busy.remove(worker)
+                    self.replace(worker)
+                    for packed in self.task_failed(
+                            index, item, reason,
+                            pending if deadline is None else None):
+                        yield packed
+        finally:
+            # Workers still busy, when the run was cancelled or the caller
+            # stopped early, would give their results to the next run.
+            for worker in busy:
+                self.replace(worker)
+        if self.fork_server is not None:
+            self.fork_server.learn_preload(self.preload)
+        self.prepare_standby()
+
+    def task_done(self, worker, index, result):
+        "returns the (index, result) of each item of the task worker did"
+        self.learn_preload(worker)
+        if worker.tasks >= self.max_tasks:
+            self.replace(worker)
+        if not isinstance(index, tuple):
+            self.durations[index] = worker.duration
+            self.test_records[index] = worker.test_records
+            return [(index, result)]
+        for (one_index, (_result, seconds, records)) in zip(index, result):
+            self.durations[one_index] = seconds
+            self.test_records[one_index] = records
+        return [
+            (one_index, one_result)
+            for (one_index, (one_result, _, _)) in zip(index, result)
+        ]
+
+    @staticmethod
+    def task_failed(index, item, reason, pending=None):
+        """returns the (index, result) of a task whose worker could not
+        finish it, or puts the items of a batch back on pending to run one
+        at a time, so that only the item to blame fails"""
+        if not isinstance(index, tuple):
+            return [(index, worker_failed(item, reason))]
+        (func, items) = item
+        if pending is None:
+            return []
+        for (one_index, one_item) in reversed(list(zip(index, items))):
+            pending.append((func, (one_index, one_item)))
+        return []
+
+    def limit_exceeded(self, worker):
+        """why busy worker has to be killed, if it ran out of time or used
+        too much memory, else None"""
+        if self.timeout and \
+                time.time() - worker.started > self.timeout:
+            return "Killed after running for more than %g seconds." % (
+                self.timeout
+            )
+        if self.max_memory:
+            memory = process_memory(worker.process.pid)
+            if memory is not None and memory > self.max_memory:
+                return "Killed for using more than %i MB of memory." % (
+                    self.max_memory // 2 ** 20
+                )
+        return None
+
+    def time_to_check_limits(self, busy, timeout):
+        """seconds to wait for busy workers, at most timeout (None for no
+        limit), before one of them may have to be killed"""
+        waits = [] if timeout is None else [timeout]
+        if busy and self.max_memory:
+            waits.append(MEMORY_CHECK_INTERVAL)
+        if busy and self.timeout:
+            now = time.time()
+            waits.extend(
+                max(0, worker.started + self.timeout - now)
+                for worker in busy
+            )
+        if not waits:
+            return None
+        return min(waits)
+
+    def recycle(self):
+        """replaces stale workers, and those that imported project files,
+        so that test modules are imported fresh, and starts missing ones"""
+        if self.fork_server is not None and self.fork_server.is_stale():
+            # Every worker was forked with the stale modules loaded.
+            for worker in self.workers + self.standby:
+                worker.terminate()
+            self.workers = []
+            self.standby = []
+            self.fork_server.restart()
+        imported = set()
+        for worker in self.workers + self.standby:
+            imported.update(worker.imported)
+        states = dict((path, file_state(path)) for path in imported)
+        for worker in list(self.workers):
+            if worker.is_stale(states) or self.imported_project_files(worker):
+                self.replace(worker)
+        for worker in [w for w in self.standby if w.is_stale(states)]:
+            worker.terminate()
+            self.standby.remove(worker)
+        while len(self.workers) < self.processes:
+            self.workers.append(self.new_worker())
+
+    def replace(self, worker):
+        "terminates worker and puts a fresh one in its place"
+        worker.terminate()
+        self.workers[self.workers.index(worker)] = self.new_worker()
+
+    def new_worker(self):
+        "a standby worker if there is one, otherwise a newly started one"
+        if self.standby:
+            return self.standby.pop()
+        return self.start_worker()
+
+    def start_worker(self):
+        "starts a worker, forked by the fork server if there is one"
+        if self.fork_server is not None:
+            return self.fork_server.fork_worker()
+        return start_worker_process(self.preload, self.root)
+
+    def learn_preload(self, worker):
+        "remembers the modules from outside the project that worker imported"
+        for (name, path) in worker.imported_modules:
+            if not self.in_project(path):
+                self.preload.add(name)
+        worker.imported_modules = []
+
+    def in_project(self, path):
+        "is path the file of a project module, that may change?"
+        if self.root is None:
+            return True
+        return path.startswith(os.path.join(self.root, ""))
+
+    def imported_project_files(self, worker):
+        "has worker imported any project file, which may be a test module?"
+        return any(self.in_project(path) for path in worker.imported)
+
+    def prepare_standby(self):
+        "starts replacements for the workers that imported project files"
+        if self.fork_server is not None:
+            return  # forking a worker takes no time worth saving
+        dirty = [w for w in self.workers if self.imported_project_files(w)]
+        while len(self.standby) < len(dirty):
+            self.standby.append(self.start_worker())
+
+    def close(self):
+        "terminates all workers"
+        for worker in self.workers + self.standby:
+            worker.terminate()
+        self.workers = []
+        self.standby = []
+        if self.fork_server is not None:
+            self.fork_server.close()
+
+
+class Worker:
+    "One worker process of a WorkerPool, running tasks sent over a pipe"
+
+    def __init__(self, connection, process):
+        self.connection = connection
+        self.process = process
+        self.tasks = 0
+        self.task = None
+        self.started = None  # when the task was sent
+        self.duration = None  # seconds the last task took
+        self.test_records = []  # the test records of the last task
+        self.imported = {}
+        self.imported_modules = []
+
+    def send(self, func, task):
+        "starts running func(item) for the (index, item) task"
+        self.task = task
+        self.tasks += 1
+        self.started = time.time()
+        self.connection.send((func, task[1]))
+
+    def receive(self):
+        "returns the result of the task, once the worker is done"
+        (result, imported, self.duration, self.test_records) = \
+            self.connection.recv()
+        for (name, path, state) in imported:
+            self.imported[path] = state
+            self.imported_modules.append((name, path))
+        self.task = None
+        return result
+
+    def is_stale(self, states):
+        "has any file the worker imported changed since?"
+        for (path, state) in self.imported.items():
+            if states[path] != state:
+                return True
+        return False
+
+    def death_reason(self):
+        "tells how the worker process, which closed its pipe, died"
+        # The process may still be on its way out.
+        self.process.join(TERMINATE_GRACE)
+        if self.process.exitcode is None:
+            return "The worker process died."
+        return "The worker process died (exit code %s)." % (
+            self.process.exitcode
+        )
+
+    def terminate(self):
+        """stops the worker process, killing it if it does not exit soon
+        after being asked to, as when a test handles SIGTERM"""
+        self.connection.close()
+        self.process.terminate()
+        self.process.join(TERMINATE_GRACE)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+def batch_tasks(func, items, batches):
+    """the (func, (index, item)) tasks to run func(item) for each item, in
+    order, where the items with indexes in one of batches run together as
+    (run_batch, (indexes, (func, items))) at the place of the first one"""
+    batch_at = dict((batch[0], batch) for batch in batches)
+    batched = set(index for batch in batches for index in batch)
+    tasks = []
+    for (index, item) in enumerate(items):
+        if index in batch_at:
+            batch = batch_at[index]
+            tasks.append((run_batch, (
+                tuple(batch),
+                (func, [items[one_index] for one_index in batch])
+            )))
+        elif index not in batched:
+            tasks.append((func, (index, item)))
+    return tasks
+
+
+def run_batch(batch):
+    """Runs func(item) for each item of the (func, items) batch, in a single
+    worker task. Returns (result, seconds, test records) for each item."""
+    (func, items) = batch
+    results = []
+    for item in items:
+        start = time.time()
+        result = func(item)
+        results.append((result, time.time() - start, take_test_records()))
+    return results
+
+
+def start_worker_process(preload, root=None):
+    """starts a Worker in a new process, that imports preload first, and
+    keeps the doctests it finds below root, if given"""
+    import multiprocessing
+    (connection, child_connection) = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=worker_main,
+        args=(child_connection, sorted(preload), root)
+    )
+    process.daemon = True
+    process.start()
+    child_connection.close()
+    return Worker(connection, process)
+
+
+def worker_main(connection, preload, root=None):
+    """Main function of worker processes: runs each func(item) received from
+    connection and sends back the result, together with the modules that
+    were imported meanwhile."""
+    import multiprocessing
+    if root is not None:
+        use_doctest_cache(root)
+    # Tests may start processes of their own, daemons may not.
+    multiprocessing.current_process().daemon = False
+    known_modules = set(sys.modules)
+    import_modules(preload)
+    while True:
+        try:
+            (func, item) = connection.recv()
+        except EOFError:
+            return
+        start = time.time()
+        result = func(item)
+        duration = time.time() - start
+        connection.send((
+            result,
+            imported_since(known_modules),
+            duration,
+            take_test_records()
+        ))
+
+
+def import_modules(module_names):
+    "imports the modules that can be imported"
+    for module_name in module_names:
+        try:
+            __import__(module_name)
+        except Exception:
+            pass  # the tests will run into it again, if it matters
+
+
+class ForkServer:
+    """A process that imports modules that rarely change, like third-party
+    packages, once, and then forks a worker for the WorkerPool whenever
+    asked to. The workers start with the modules already imported.
+
+    The modules to import are given, or else those from outside the project
+    that workers imported in earlier runs, remembered in
+    .pytddmon_cache/preload.json. If the file of any module the server
+    imported changes, it has to be restarted. Only works where os.fork
+    does."""
+
+    def __init__(self, root, preload=None):
+        self.root = root
+        self.auto_preload = preload is None
+        self.preload_path = cache_file_path(root, "preload.json")
+        if self.auto_preload:
+            preload = self.load_preload()
+        self.preload = set(preload)
+        self.process = None
+        self.control = None
+        self.imported = {}
+        self.start()
+
+    def load_preload(self):
+        "module names remembered from earlier sessions"
+        try:
+            with open(self.preload_path) as preload_file:
+                return json.load(preload_file)
+        except (IOError, OSError, ValueError):
+            return []
+
+    def start(self):
+        "starts the server process, it starts importing right away"
+        # A spawned, not forked, server has no threads and no GUI state
+        # that could trouble the workers it forks.
+        import multiprocessing
+        context = multiprocessing.get_context("spawn")
+        (self.control, server_control) = context.Pipe()
+        self.process = context.Process(
+            target=fork_server_main,
+            args=(server_control, sorted(self.preload), self.root)
+        )
+        self.process.daemon = True
+        self.process.start()
+        server_control.close()
+        self.imported = None
+
+    def restart(self):
+        "replaces the server process with a new one"
+        self.close()
+        self.start()
+
+    def is_stale(self):
+        "has the file of any module the server imported changed?"
+        self.wait_until_ready()
+        for (path, state) in self.imported.items():
+            if file_state(path) != state:
+                return True
+        return False
+
+    def wait_until_ready(self):
+        "waits for the server to report what it imported"
+        if self.imported is None:
+            try:
+                imported = self.control.recv()
+            except (EOFError, OSError):
+                imported = []
+            self.imported = dict(
+                (path, state) for (_name, path, state) in imported
+            )
+
+    def learn_preload(self, module_names):
+        """In automatic mode, remembers module_names and restarts the server
+        when there are new ones, so that it imports them too."""
+        if not self.auto_preload or self.preload.issuperset(module_names):
+            return
+        self.preload.update(module_names)
+        write_file_atomically(
+            self.preload_path,
+            json.dumps(sorted(self.preload))
+        )
+        self.restart()
+
+    def fork_worker(self):
+        "returns a Worker forked by the server"
+        from multiprocessing.reduction import recv_handle
+        from multiprocessing.connection import Connection
+        self.wait_until_ready()
+        self.control.send("fork")
+        pid = self.control.recv()
+        connection = Connection(recv_handle(self.control))
+        return Worker(connection, ForkedProcess(pid))
+
+    def close(self):
+        "stops the server process, the workers it forked keep running"
+        if self.process is not None:
+            self.control.close()
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+
+class ForkedProcess:
+    """Stands in for the multiprocessing.Process of a Worker forked by a
+    ForkServer, which is not a child of this process."""
+
+    exitcode = None
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def terminate(self):
+        "asks the process to stop"
+        import signal
+        self.signal(signal.SIGTERM)
+
+    def kill(self):
+        "stops the process at once"
+        import signal
+        self.signal(signal.SIGKILL)
+
+    def signal(self, number):
+        "sends the signal number to the process, unless it is gone"
+        try:
+            os.kill(self.pid, number)
+        except OSError:
+            pass  # already gone
+
+    def is_alive(self):
+        "is the process still there?"
+        try:
+            os.kill(self.pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def join(self, timeout=None):
+        """waits at most timeout seconds for the process to exit, the
+        ForkServer reaps it, not us"""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.is_alive():
+            if deadline is not None and time.time() >= deadline:
+                return
+            time.sleep(0.01)
+
+
+def fork_server_main(control, preload, root=None):
+    """Main function of the ForkServer process: imports preload, reports
+    what it imported, and forks a worker for every request on control. The
+    workers keep the doctests they find below root, if given."""
+    import multiprocessing
+    import signal
+    from multiprocessing.reduction import send_handle
+    # Let the system reap the forked workers.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    if root is not None:
+        use_doctest_cache(root)
+    import_modules(preload)
+    control.send(imported_since(set()))
+    while True:
+        try:
+            control.recv()
+        except EOFError:
+            return
+        (connection, worker_connection) = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            connection.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            try:
+                worker_main(worker_connection, [])
+            finally:
+                os._exit(0)
+        worker_connection.close()
+        control.send(pid)
+        send_handle(control, connection.fileno(), None)
+        connection.close()
+
+
+def imported_since(known_modules):
+    """returns (name, file, state) for modules imported since known_modules
+    was last updated, and updates it"""
+    imported = []
+    for name, module in list(sys.modules.items()):
+        if name in known_modules:
+            continue
+        known_modules.add(name)
+        path = getattr(module, "__file__", None)
+        if path:
+            path = os.path.abspath(path)
+            imported.append((name, path, file_state(path)))
+    return imported
+
+
+def known_file_digest(digests, path):
+    """file_digest of path, taken from and kept in digests, {file path:
+    (file state, digest)}, unless the file has changed"""
+    state = file_state(path)
+    (known_state, digest) = digests.get(path, (None, None))
+    if state is None or state != known_state:
+        digest = file_digest(path)
+        digests[path] = (state, digest)
+    return digest
+
+
+def file_state(path):
+    "(size, modification time) of path, or None if it does not exist"
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
 
-    def run_tests(self):
-        """Runs all tests and updates state variables with results."""
 
-        file_paths = self.file_finder()
+def wait_for_connections(connections, timeout=None):
+    """waits until any of the connections can be read from, or timeout
+    seconds have passed"""
+    from multiprocessing.connection import wait
+    return wait(connections, timeout)
 
-        # We need to run the tests in a separate process, since
-        # Python caches loaded modules, and unittest/doctest
-        # imports modules to run them.
-        # However, we do not want to assume users' unit tests
-        # are thread-safe, so we only run one test module at a
-        # time, using processes = 1.
-        start = time.time()
-        if file_paths:
-            pool = multiprocessing.Pool(processes=1)
-            results = pool.map(run_tests_in_file, file_paths)
-            pool.close()
-            pool.join()
-        else:
-            results = []
-        run_time = time.time() - start
 
-        now = time.strftime("%H:%M:%S", time.localtime())
-        passed = 0
-        total = 0
-        module_logs = []  # Summary for each module with errors first
-        for packed in results:
-            (module, green, number_of, logtext) = packed
-            passed += green
-            total += number_of
-            module_log = "\nLog from " + module + ":\n" + logtext
-            if not isinstance(number_of, int) or total - green > 0:
-                module_logs.insert(0, module_log)
-            else:
-                module_logs.append(module_log)
-        total_tests = int(total.real)
-        # logging?
-        self.log = ""
-        self.log += "Monitoring folder %s.\n" % self.project_name
-        self.log += "Found %i tests in %i files.\n" % (
-            total_tests,
-            len(results)
-        )
-        self.log += "Last change detected at %s.\n" % now
-        self.log += "Test run took %.2f seconds.\n" % run_time
-        self.log += "\n"
-        self.log += ''.join(module_logs)
-        # /logging?
-        self.status_message = now
-        self.result = Result(
-            total=total,
-            passed=passed,
-            time=run_time
-        )
+def process_memory(pid):
+    """bytes of memory the process with pid uses (its resident set size),
+    or None if that can not be told, as on systems without /proc"""
+    try:
+        with open("/proc/%i/statm" % pid) as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
 
-    def get_and_set_change_detected(self):
-        self.change_detected = self.monitor.look_for_changes()
-        return self.change_detected
 
-    def main(self):
-        """This is the main loop body"""
-        self.change_detected = self.monitor.look_for_changes()
-        if self.change_detected:
-            self.run_tests()
+def worker_failed(item, reason):
+    """the result of a task whose worker could not finish it, for the file
+    the task ran: item, or its first element for the tuples of
+    run_part_of_file and run_covered_tests_in_file"""
+    if isinstance(item, tuple):
+        item = item[0]
+    return error_result(item, reason + "\n")
 
-    def get_log(self):
-        """Access the log string created during test run"""
-        return self.log
 
-    def get_status_message(self):
-        """Return message in status bar"""
-        return self.status_message
+class InProcessPool:
+    """Stands in for a WorkerPool of one worker, but runs the tests in this
+    process, which for small pure-Python projects takes less time than
+    handing them to another process. Before each run, the modules from
+    below root that were imported since the pool was made are dropped, so
+    that the tests import them fresh.
 
+    Projects with C extensions, which can not be imported again, and tests
+    that leave global state behind for later tests, like another working
+    folder, sys.path, environment variables or running threads, make the
+    pool fall back on the WorkerPool that build_fallback returns, from then
+    on. So does running off the main thread, where tests can not set
+    signal handlers or use Tk. Then notice tells why. There are no time or
+    memory limits."""
 
-class Monitor:
-    'Looks for file changes when prompted to'
+    processes = 1
 
-    def __init__(self, file_finder, get_file_size, get_file_modtime):
-        self.file_finder = file_finder
-        self.get_file_size = get_file_size
-        self.get_file_modtime = get_file_modtime
-        self.snapshot = self.get_snapshot()
+    def __init__(self, root, build_fallback):
+        self.root = os.path.abspath(root)
+        self.build_fallback = build_fallback
+        self.fallback = None
+        self.notice = None
+        self.known_modules = set(sys.modules)
+        self.durations = {}  # index -> seconds, of the items of the last run
+        self.test_records = {}  # index -> test records, of the same items
 
-    def get_snapshot(self):
-        snapshot = {}
-        for file in self.file_finder():
-            file_size = self.get_file_size(file)
-            file_modtime = self.get_file_modtime(file)
-            snapshot[file] = (file_size, file_modtime)
-        return snapshot
+    def imap_unordered(self, func, items, max_busy=None, cancelled=None,
+                       batches=None):
+        """runs func(item) for each item, yields (index, result) in order.
+        Stops early once cancelled() is true. Batches make no difference
+        here, unless the pool falls back on worker processes."""
+        self.durations.clear()
+        self.test_records.clear()
+        start_index = 0
+        if self.fallback is None and \
+                threading.current_thread() is not threading.main_thread():
+            self.notice = (
+                "Running the tests in worker processes, since pytddmon "
+                "does not run them on the main thread."
+            )
+            self.fallback = self.build_fallback()
+        if self.fallback is None:
+            self.drop_project_modules()
+            for (index, item) in enumerate(items):
+                if cancelled is not None and cancelled():
+                    return
+                state = global_state()
+                start = time.time()
+                try:
+                    result = func(item)
+                finally:
+                    # Before yielding, since the consumer may stop here.
+                    problem = restore_global_state(state) or \
+                        self.project_extension()
+                self.durations[index] = time.time() - start
+                self.test_records[index] = take_test_records()
+                if problem is not None:
+                    self.fall_back(problem, item)
+                yield (index, result)
+                if problem is not None:
+                    start_index = index + 1
+                    break
+            else:
+                return
+        # Worker processes run the rest, if there is any.
+        rest = list(items[start_index:])
+        batches = [
+            [index - start_index for index in batch]
+            for batch in batches or () if batch[0] >= start_index
+        ]
+        for (index, result) in self.fallback.imap_unordered(
+                func, rest, max_busy, cancelled, batches):
+            self.durations[start_index + index] = \
+                self.fallback.durations.get(index)
+            self.test_records[start_index + index] = \
+                self.fallback.test_records.get(index)
+            yield (start_index + index, result)
 
-    def look_for_changes(self):
-        new_snapshot = self.get_snapshot()
-        change_detected = new_snapshot != self.snapshot
-        self.snapshot = new_snapshot
-        return change_detected
+    def drop_project_modules(self):
+        """forgets the modules imported from below root since the pool was
+        made, so that they are imported again"""
+        import importlib
+        import linecache
+        for name in list(sys.modules):
+            if name in self.known_modules:
+                continue
+            path = getattr(sys.modules[name], "__file__", None)
+            if path and self.in_project(path):
+                del sys.modules[name]
+        importlib.invalidate_caches()
+        linecache.checkcache()
 
+    def project_extension(self):
+        "why the tests can not run here if a C extension of the project is"
+        import importlib.machinery
+        suffixes = tuple(importlib.machinery.EXTENSION_SUFFIXES)
+        for module in list(sys.modules.values()):
+            path = getattr(module, "__file__", None)
+            if path and path.endswith(suffixes) and self.in_project(path):
+                return "imported the C extension %s" % path
+        return None
 
-####
-## Finding files
-####
+    def in_project(self, path):
+        "is path below root?"
+        return os.path.abspath(path).startswith(os.path.join(self.root, ""))
 
-class FileFinder:
-    "Returns all files matching given regular expression from root downwards"
+    def fall_back(self, problem, item):
+        """runs all tests in worker processes from now on, because running
+        item caused problem"""
+        self.notice = (
+            "Running the tests in worker processes, since %s %s." % (
+                item,
+                problem
+            )
+        )
+        self.fallback = self.build_fallback()
 
-    def __init__(self, root, regexp):
-        self.root = os.path.abspath(root)
-        self.regexp = regexp
+    def close(self):
+        "stops the worker processes, if any"
+        if self.fallback is not None:
+            self.fallback.close()
 
-    def __call__(self):
-        return self.find_files()
 
-    def find_files(self):
-        "recursively finds files matching regexp"
-        file_paths = set()
-        for path, _folder, filenames in os.walk(self.root):
-            for filename in filenames:
-                if self.re_complete_match(filename):
-                    file_paths.add(
-                        os.path.abspath(os.path.join(path, filename))
-                    )
-        return file_paths
+def global_state():
+    "what tests may change and leave behind, to trouble later tests"
+    return (
+        os.getcwd(),
+        list(sys.path),
+        dict(os.environ),
+        set(threading.enumerate())
+    )
+
+
+def restore_global_state(state):
+    """puts back what tests changed of the global_state, returns what they
+    changed, or None"""
+    (cwd, path, environ, threads) = state
+    changed = []
+    if os.getcwd() != cwd:
+        changed.append("changed the working folder")
+        os.chdir(cwd)
+    if sys.path != path:
+        changed.append("changed sys.path")
+        sys.path[:] = path
+    if os.environ != environ:
+        changed.append("changed environment variables")
+        os.environ.clear()
+        os.environ.update(environ)
+    if any(t.is_alive() for t in set(threading.enumerate()) - threads):
+        changed.append("left threads running")
+    if not changed:
+        return None
+    return " and ".join(changed)
 
-    def re_complete_match(self, string_to_match):
-        "full string regexp check"
-        return bool(re.match(self.regexp + "$", string_to_match))
 
 ####
-## Finding & running tests
+## Running the engine in the background
 ####
 
 
-def log_exceptions(func):
-    """Decorator that forwards the error message from an exception to the log
-    slot of the return value, and also returns a complexnumber to signal that
-    the result is an error."""
-    wraps = functools.wraps
+Snapshot = namedtuple(
+    "Snapshot",
+    ["result", "log", "status_message", "stale"]
+)
 
-    @wraps(func)
-    def wrapper(*a, **k):
-        "Docstring"
-        try:
-            return func(*a, **k)
-        except:
-            import traceback
-            return (('Exception(%s)' % a[0]), 0, 1j, traceback.format_exc())
-    return wrapper
 
+def take_snapshot(pytddmon, status_message=None):
+    "what the GUI shows of pytddmon right now"
+    return Snapshot(
+        pytddmon.result,
+        pytddmon.get_log(),
+        status_message or pytddmon.get_status_message(),
+        pytddmon.stale
+    )
 
-@log_exceptions
-def run_tests_in_file(file_path):
-    module = file_name_to_module("", file_path)
-    return run_module(module)
 
+def error_snapshot():
+    "what the GUI shows when the engine failed with the current exception"
+    import traceback
+    return Snapshot(
+        Result(total=1j, passed=0, time=0),
+        "pytddmon failed, the tests may not have run:\n" +
+        traceback.format_exc(),
+        time.strftime("%H:%M:%S", time.localtime()) + " Error",
+        False
+    )
 
-def run_module(module):
-    suite = find_tests_in_module(module)
-    (green, total, log) = run_suite(suite)
-    return (module, green, total, log)
 
+class EngineThread(threading.Thread):
+    """Looks for changes and runs the tests in a thread of its own, and
+    puts a Snapshot on the snapshots queue whenever there is news to
+    show. Only this thread touches the engine after it has started.
 
-def file_name_to_module(base_path, file_name):
-    r"""Converts filenames of files in packages to import friendly dot
-    separated paths.
+    So that the GUI can show up right away, the thread can also read what
+    earlier sessions saved with load_caches, build the engine's monitor,
+    which has to look at every file, with build_monitor, and do the first
+    run of all tests.
 
-    Examples:
-    >>> print(file_name_to_module("","pytddmon.pyw"))
-    pytddmon
-    >>> print(file_name_to_module("","pytddmon.py"))
-    pytddmon
-    >>> print(file_name_to_module("","tests/pytddmon.py"))
-    tests.pytddmon
-    >>> print(file_name_to_module("","./tests/pytddmon.py"))
-    tests.pytddmon
-    >>> print(file_name_to_module("",".\\tests\\pytddmon.py"))
-    tests.pytddmon
-    >>> print(
-    ...     file_name_to_module(
-    ...         "/User/pytddmon\\ geek/pytddmon/",
-    ...         "/User/pytddmon\\ geek/pytddmon/tests/pytddmon.py"
-    ...     )
-    ... )
-    tests.pytddmon
-    """
-    symbol_stripped = os.path.relpath(file_name, base_path)
-    for symbol in r"/\.":
-        symbol_stripped = symbol_stripped.replace(symbol, " ")
-    words = symbol_stripped.split()
-    # remove .py/.pyw
-    module_words = words[:-1]
-    module_name = '.'.join(module_words)
-    return module_name
+    Should the engine fail, the error is shown and the thread goes on
+    looking for changes."""
 
+    def __init__(self, pytddmon, build_monitor=None, first_run=False,
+                 load_caches=None):
+        threading.Thread.__init__(self, name="pytddmon-engine")
+        self.daemon = True
+        self.pytddmon = pytddmon
+        self.build_monitor = build_monitor
+        self.first_run = first_run
+        self.load_caches = load_caches
+        self.snapshots = queue.Queue()
+        self.stopping = threading.Event()
 
-def find_tests_in_module(module):
-    suite = unittest.TestSuite()
-    suite.addTests(find_unittests_in_module(module))
-    suite.addTests(find_doctests_in_module(module))
-    return suite
+    def run(self):
+        if self.load_caches is not None:
+            self.guarded(self.load_caches)
+            self.publish()
+        if self.build_monitor is not None:
+            try:
+                self.pytddmon.monitor = self.build_monitor()
+            except Exception:
+                self.publish_error()
+                return  # nothing to look for changes with
+        if self.first_run:
+            self.guarded(self.run_tests, None)
+        while not self.stopping.is_set():
+            self.guarded(self.look_for_changes)
+            self.wait_for_changes(self.pytddmon.get_poll_interval() / 1000.0)
 
+    def guarded(self, func, *args):
+        "calls func(*args), showing the error if it fails"
+        try:
+            func(*args)
+        except Exception:
+            self.publish_error()
 
-def find_unittests_in_module(module):
-    test_loader = unittest.TestLoader()
-    return test_loader.loadTestsFromName(module)
+    def look_for_changes(self):
+        "runs the tests if anything changed"
+        if self.pytddmon.get_and_set_change_detected():
+            self.run_tests(self.pytddmon.change_detected)
 
+    def run_tests(self, changed_paths):
+        "runs the tests affected by changed_paths, showing how it goes"
+        self.publish('Testing...')
+        self.pytddmon.run_tests(changed_paths, self.publish, preemptible=True)
+        self.run_finished()
 
-def find_doctests_in_module(module):
-    try:
-        return doctest.DocTestSuite(module, optionflags=doctest.ELLIPSIS)
-    except ValueError:
-        return unittest.TestSuite()
+    def run_finished(self):
+        "lets the GUI know how the run ended"
+        self.publish()
 
+    def publish(self, status_message=None):
+        "lets the GUI know how things look now"
+        self.snapshots.put(take_snapshot(self.pytddmon, status_message))
 
-def run_suite(suite):
-    def string_io():
-        if ON_PYTHON3:
-            import io as StringIO
-        else:
-            import StringIO
-        return StringIO.StringIO()
-    err_log = string_io()
-    text_test_runner = unittest.TextTestRunner(stream=err_log, verbosity=1)
-    result = text_test_runner.run(suite)
-    green = result.testsRun - len(result.failures) - len(result.errors)
-    total = result.testsRun
+    def publish_error(self):
+        "lets the GUI know that the engine failed, and why"
+        self.snapshots.put(error_snapshot())
 
-    if green < total:
-        log = err_log.getvalue()
-    else:
-        log = "All %i tests passed\n" % green
+    def wait_for_changes(self, timeout):
+        """sleeps for timeout seconds, but wakes up as soon as the monitor
+        has events or the thread is stopped"""
+        fileno = self.pytddmon.get_event_fileno()
+        if fileno is None:
+            self.stopping.wait(timeout)
+            return
+        try:
+            select.select([fileno], [], [], timeout)
+        except (OSError, ValueError, select.error):
+            # The monitor closed its file, polling from now on.
+            self.stopping.wait(timeout)
 
-    return (green, total, log)
+    def stop(self, timeout=5):
+        "stops looking for changes, waits for a run in progress a while"
+        self.stopping.set()
+        if self.is_alive():
+            self.join(timeout)
 
 
 ####
@@ -398,7 +3861,7 @@ class TKGUIButton(object):
 
 class TkGUI(object):
     """Connect pytddmon engine to Tkinter GUI toolkit"""
-    def __init__(self, pytddmon, tkinter, tk_font):
+    def __init__(self, pytddmon, tkinter, tk_font, engine=None):
         self.pytddmon = pytddmon
         self.tkinter = tkinter
         self.tk_font = tk_font
@@ -420,6 +3883,8 @@ class TkGUI(object):
         self.frame.grid()
         self.message_window = None
         self.text = None
+        self.engine = engine or EngineThread(pytddmon)
+        self.shown = take_snapshot(pytddmon)
 
         if ON_WINDOWS:
             buttons_width = 25
@@ -467,48 +3932,46 @@ class TkGUI(object):
         )
         self.status_bar.pack(expand=1, fill="both")
 
-    def _update_and_get_color(self):
+    def _update_and_get_color(self, pulse=True):
         "Calculate the current color and trigger pulse"
         self.color_picker.set_result(
-            self.pytddmon.result.passed,
-            self.pytddmon.result.total,
+            self.shown.result.passed,
+            self.shown.result.total,
+            self.shown.stale
         )
         light, color = self.color_picker.pick()
         rgb = self.color_picker.translate_color(light, color)
-        self.color_picker.pulse()
+        if pulse:
+            self.color_picker.pulse()
         return rgb
 
     def _get_text(self):
         "Calculates the text to show the user(passed/total or Error!)"
-        if self.pytddmon.result.total.imag != 0:
+        if self.shown.result.total.imag != 0:
             text = "?ERROR"
         else:
             text = "%r/%r" % (
-                self.pytddmon.result.passed,
-                self.pytddmon.result.total
+                self.shown.result.passed,
+                self.shown.result.total
             )
         return text
 
-    def update(self):
+    def update(self, pulse=True):
         """updates the tk gui"""
-        rgb = self._update_and_get_color()
+        rgb = self._update_and_get_color(pulse)
         text = self._get_text()
         self.button.update(text, rgb)
         self.root.configure(bg=rgb)
-        self.update_status(self.pytddmon.get_status_message())
-
-        if self.pytddmon.change_detected:
-            self.update_text_window()
+        self.update_status(self.shown.status_message)
 
     def update_status(self, message):
         self.status_bar.configure(
             text=message
         )
-        self.status_bar.update_idletasks()
 
     def get_text_message(self):
         """returns the logmessage from pytddmon"""
-        message = self.pytddmon.get_log()
+        message = self.shown.log
         return message
 
     def create_text_window(self):
@@ -539,17 +4002,37 @@ class TkGUI(object):
             self.message_window.state('normal')
 
     def loop(self):
-        """the main loop"""
-        if self.pytddmon.get_and_set_change_detected():
-            self.update_status('Testing...')
-            self.pytddmon.run_tests()
+        """the main loop, pulses the window"""
         self.update()
         self.frame.after(750, self.loop)
 
+    def drain_snapshots(self):
+        """shows the latest news from the engine thread, if any, and
+        schedules the next look"""
+        latest = None
+        try:
+            while True:
+                latest = self.engine.snapshots.get_nowait()
+        except queue.Empty:
+            pass
+        if latest is not None:
+            log_changed = latest.log != self.shown.log
+            self.shown = latest
+            self.update(pulse=False)
+            if log_changed:
+                self.update_text_window()
+        self.frame.after(DRAIN_INTERVAL, self.drain_snapshots)
+
     def run(self):
-        """starts the main loop and goes into sleep"""
+        """starts the engine thread and the main loop and goes into
+        sleep"""
+        self.engine.start()
         self.loop()
-        self.root.mainloop()
+        self.drain_snapshots()
+        try:
+            self.root.mainloop()
+        finally:
+            self.engine.stop()
 
 
 class ColorPicker:
@@ -557,7 +4040,8 @@ class ColorPicker:
     ColorPicker decides the background color the pytddmon window,
     based on the number of green tests, and the total number of
     tests. Also, there is a "pulse" (light color, dark color),
-    to increase the feeling of continous testing.
+    to increase the feeling of continous testing. Results from the last
+    session, that are not known to hold any more, get paler colors.
     """
     color_table = {
         (True, 'green'): '0f0',
@@ -567,7 +4051,15 @@ class ColorPicker:
         (True, 'orange'): 'fc0',
         (False, 'orange'): 'ca0',
         (True, 'gray'): '999',
-        (False, 'gray'): '555'
+        (False, 'gray'): '555',
+        (True, 'stale green'): '9c9',
+        (False, 'stale green'): '7a7',
+        (True, 'stale red'): 'c99',
+        (False, 'stale red'): 'a77',
+        (True, 'stale orange'): 'cb9',
+        (False, 'stale orange'): 'a97',
+        (True, 'stale gray'): 'bbb',
+        (False, 'stale gray'): '999'
     }
 
     def __init__(self):
@@ -586,7 +4078,7 @@ class ColorPicker:
         "resets the light state"
         self.light = True
 
-    def set_result(self, green, total):
+    def set_result(self, green, total, stale=False):
         "calculates what color should be used and may reset the lightness"
         old_color = self.color
         self.color = 'green'
@@ -596,6 +4088,8 @@ class ColorPicker:
             self.color = 'red'
         elif green < total - 1:
             self.color = 'gray'
+        if stale:
+            self.color = 'stale ' + self.color
         if self.color != old_color:
             self.reset_pulse()
 
@@ -605,6 +4099,83 @@ class ColorPicker:
         return "#" + cls.color_table[(light, color)]
 
 
+####
+## Terminal
+####
+
+
+class TerminalUI(EngineThread):
+    """Shows the results in the terminal instead of a window: a line for
+    each run with the number of passed tests, how long it took and what
+    changed, followed by the logs of the modules that failed. When quiet,
+    only runs with another result than the one before are shown.
+
+    Runs the engine in the thread that calls run(), without tkinter."""
+
+    def __init__(self, pytddmon, stream=None, quiet=False):
+        EngineThread.__init__(self, pytddmon)
+        self.stream = stream or sys.stdout
+        self.quiet = quiet
+        self.shown = None  # the result and failure logs last shown
+
+    def publish(self, status_message=None):
+        "nothing to show until the run is over"
+        pass
+
+    def run_finished(self):
+        "shows how the run ended"
+        self.show(self.pytddmon.change_detected)
+
+    def show(self, changed_paths=None):
+        "writes the result, unless it is the same as last time when quiet"
+        pytddmon = self.pytddmon
+        failures = [
+            "\nLog from %s:\n%s" % (result[0], result[3])
+            for (_path, result) in sorted(pytddmon.module_results.items())
+            if is_failure(result)
+        ]
+        shown = (pytddmon.result.passed, pytddmon.result.total, failures)
+        if self.quiet and shown == self.shown:
+            return
+        self.shown = shown
+        self.stream.write(status_line(pytddmon.result, changed_paths))
+        self.stream.write("".join(failures))
+        self.stream.flush()
+
+    def publish_error(self):
+        "shows why the engine failed"
+        snapshot = error_snapshot()
+        self.shown = None
+        self.stream.write(status_line(snapshot.result))
+        self.stream.write("\n" + snapshot.log)
+        self.stream.flush()
+
+    def watch(self):
+        "shows the result of the first run, and of every run after it"
+        self.show()
+        try:
+            self.run()
+        except KeyboardInterrupt:
+            pass
+
+
+def status_line(result, changed_paths=None):
+    """one line telling the time, passed/total tests, how long the run took
+    and which files changed"""
+    line = "[%s] " % time.strftime("%H:%M:%S", time.localtime())
+    if result.total.imag:
+        line += "?ERROR %i/%i" % (result.passed.real, result.total.real)
+    else:
+        line += "%i/%i passed" % (result.passed, result.total)
+    line += " in %.2f s" % result.time
+    if isinstance(changed_paths, (set, frozenset)) and changed_paths:
+        names = sorted(os.path.relpath(path) for path in changed_paths)
+        if len(names) > 3:
+            names[3:] = ["%i more" % (len(names) - 3)]
+        line += ", changed: " + ", ".join(names)
+    return line + "\n"
+
+
 def parse_commandline():
     """
     returns (files, test_mode) created from the command line arguments
@@ -616,21 +4187,184 @@ def parse_commandline():
         action="store_true",
         default=False,
         help='Run all tests, write the results to "pytddmon.log" and exit.')
+    parser.add_option(
+        "--json-report",
+        metavar="FILE",
+        help='After every run, add an event for each test that ran and '
+             'one for the run to FILE, as JSON Lines.')
+    parser.add_option(
+        "--junit-report",
+        metavar="FILE",
+        help='After every run, write the outcomes of all tests to FILE, as '
+             'JUnit XML.')
+    parser.add_option(
+        "--no-gui",
+        action="store_true",
+        default=False,
+        help='Write the results to the terminal instead of showing a '
+             'window. Runs the tests once and exits, with status 1 if any '
+             'failed, unless --watch is given too.')
+    parser.add_option(
+        "--watch",
+        action="store_true",
+        default=False,
+        help='With --no-gui: keep watching for changes, and write the '
+             'results of every run. The window always does.')
+    parser.add_option(
+        "-q", "--quiet",
+        action="store_true",
+        default=False,
+        help='With --no-gui --watch: only write the results of runs that '
+             'end with another result than the run before.')
+    parser.add_option(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help='Leave out the files and folders matching PATTERN, written like '
+             'a line of a .gitignore file. Can be given several times. '
+             'Those matching the .gitignore file in the current folder, and '
+             'folders like .git, __pycache__ and virtualenvs, are always '
+             'left out.')
+    parser.add_option(
+        "--watcher",
+        choices=("auto", "inotify", "poll"),
+        default="auto",
+        help='How to look for changes: "inotify" events (Linux only), '
+             '"poll" the file system, or "auto" to use inotify when '
+             'available. Default: auto.')
+    parser.add_option(
+        "--content-hash",
+        action="store_true",
+        default=False,
+        help='Only run tests when the contents of a changed file differ, '
+             'not just its modification time.')
+    parser.add_option(
+        "--debounce",
+        type="int",
+        default=200,
+        metavar="MS",
+        help='Wait until no files have changed for MS milliseconds before '
+             'running the tests, so that all changes of a burst are tested '
+             'together. 0 runs the tests right away. Default: 200.')
+    parser.add_option(
+        "--max-wait",
+        type="int",
+        default=2000,
+        metavar="MS",
+        help='Run the tests at most MS milliseconds after a change, even if '
+             'files keep changing. Default: 2000.')
+    parser.add_option(
+        "--no-precompile",
+        action="store_true",
+        default=False,
+        help='Do not compile changed Python files into __pycache__ in the '
+             'background, but leave that to the test workers.')
+    parser.add_option(
+        "-j", "--jobs",
+        type="int",
+        default=1,
+        metavar="N",
+        help='Run up to N test modules at the same time, in separate '
+             'processes. Modules containing a "# %s" comment, or below a '
+             'folder containing a %s file, still run one at a time. '
+             'Default: 1.' % (SERIAL_MARKER, SERIAL_FOLDER_MARKER))
+    parser.add_option(
+        "--full-runs",
+        action="store_true",
+        default=False,
+        help='Run all tests on every change, not only the test modules that '
+             'import the changed modules.')
+    parser.add_option(
+        "--coverage-select",
+        action="store_true",
+        default=False,
+        help='Record which lines each test executes, and only rerun the '
+             'tests that execute changed lines. Makes tests run slower '
+             'before Python 3.12.')
+    parser.add_option(
+        "--import-all",
+        action="store_true",
+        default=False,
+        help='Import every monitored module to look for tests, also those '
+             'whose sources show no sign of TestCase classes, test '
+             'functions or doctests.')
+    parser.add_option(
+        "--cold",
+        action="store_true",
+        default=False,
+        help='Forget the results of earlier sessions, instead of reusing '
+             'them for test files whose sources did not change.')
+    parser.add_option(
+        "--fork-server",
+        action="store_true",
+        default=False,
+        help='Fork a fresh worker for every test module from a process that '
+             'has already imported the modules outside the project that '
+             'earlier runs imported, or those given with --preload. Not on '
+             'Windows.')
+    parser.add_option(
+        "--preload",
+        metavar="MODULES",
+        help='Comma separated names of modules the fork server imports, '
+             'instead of finding out by itself.')
+    parser.add_option(
+        "--in-process",
+        action="store_true",
+        default=False,
+        help='Run the tests in the pytddmon process, importing the modules '
+             'of the project again for every run, instead of in worker '
+             'processes. Quickest for small pure-Python projects. Falls '
+             'back on worker processes when the project has C extensions '
+             'or a test leaves global state behind. Has no --timeout. Only '
+             'with --no-gui or --log-and-exit, since the GUI runs the '
+             'tests off the main thread.')
+    parser.add_option(
+        "--timeout",
+        type="float",
+        default=300,
+        metavar="SECONDS",
+        help='Stop a test module that runs for more than SECONDS, and show '
+             'it as an error. 0 for no limit. Default: 300.')
+    parser.add_option(
+        "--max-memory",
+        type="int",
+        default=0,
+        metavar="MB",
+        help='Stop a test module whose worker process uses more than MB '
+             'megabytes of memory, and show it as an error. Needs /proc, '
+             'as on Linux. Default: no limit.')
+    parser.add_option(
+        "--max-worker-tasks",
+        type="int",
+        default=100,
+        metavar="N",
+        help='Replace a test worker process after it has run N test '
+             'modules. Default: 100.')
     (options, args) = parser.parse_args()
-    return (args, options.log_and_exit)
+    return (args, options)
 
 
-def build_monitor(file_finder):
-    os.stat_float_times(False)
+def build_monitor(file_finder, watcher="auto"):
+    "builds the change detector, falls back to polling if inotify fails"
+    if watcher in ("auto", "inotify"):
+        def build_fallback():
+            sys.stderr.write("pytddmon: inotify failed, polling instead\n")
+            return build_polling_monitor(file_finder)
+        try:
+            return InotifyMonitor(file_finder, build_fallback)
+        except (OSError, AttributeError) as error:
+            if watcher == "inotify":
+                sys.stderr.write(
+                    "pytddmon: inotify not available (%s), "
+                    "polling instead\n" % error
+                )
+    return build_polling_monitor(file_finder)
 
-    def get_file_size(file_path):
-        stat = os.stat(file_path)
-        return stat.st_size
 
-    def get_file_modtime(file_path):
-        stat = os.stat(file_path)
-        return stat.st_mtime
-    return Monitor(file_finder, get_file_size, get_file_modtime)
+def build_polling_monitor(file_finder):
+    "builds a Monitor that only rescans folders that changed"
+    return IncrementalMonitor(file_finder)
 
 
 def run():
@@ -643,30 +4377,134 @@ def run():
     sys.path[:0] = [cwd]
 
     # Command line argument handling
-    (static_file_set, test_mode) = parse_commandline()
+    (static_file_set, options) = parse_commandline()
 
     # What files to monitor?
     if not static_file_set:
         regex = fnmatch.translate("*.py")
     else:
         regex = '|'.join(static_file_set)
-    file_finder = FileFinder(cwd, regex)
+    file_finder = FileFinder(cwd, regex, options.exclude)
 
     # The change detector: Monitor
-    monitor = build_monitor(file_finder)
+    def build_change_detector():
+        "builds the monitor, which looks at every file to start with"
+        monitor = build_monitor(file_finder, options.watcher)
+        if not options.no_precompile and not sys.dont_write_bytecode:
+            monitor = Precompiler(monitor, file_finder)
+        if options.debounce > 0:
+            monitor = Debouncer(
+                monitor,
+                options.debounce / 1000.0,
+                max(options.debounce, options.max_wait) / 1000.0
+            )
+        # The filter compares the contents with those of the last change
+        # passed on, so it goes outside the debouncer: files changed and
+        # changed back within a burst are no change.
+        if options.content_hash:
+            monitor = ContentFilter(monitor, file_finder)
+        return monitor
 
     # Python engine ready to be setup
+    # The test workers
+    def build_worker_pool():
+        "builds the pool of worker processes"
+        worker_pool = WorkerPool(
+            processes=max(1, options.jobs),
+            max_tasks=options.max_worker_tasks,
+            root=cwd,
+            timeout=options.timeout or None,
+            max_memory=options.max_memory * 2 ** 20 or None
+        )
+        if options.fork_server:
+            if not hasattr(os, "fork"):
+                sys.stderr.write("pytddmon: --fork-server needs os.fork\n")
+            else:
+                preload = None
+                if options.preload:
+                    preload = options.preload.split(",")
+                worker_pool.fork_server = ForkServer(cwd, preload)
+                worker_pool.max_tasks = 1
+        return worker_pool
+    # The GUI runs the tests on the engine thread, not the main thread.
+    gui = not options.log_and_exit and not options.no_gui
+    if options.in_process and options.jobs <= 1 and \
+            not options.coverage_select and not gui:
+        worker_pool = InProcessPool(cwd, build_worker_pool)
+    else:
+        if options.in_process:
+            sys.stderr.write(
+                "pytddmon: --in-process only goes with --no-gui or "
+                "--log-and-exit, not with --jobs or --coverage-select, "
+                "using worker processes\n"
+            )
+        worker_pool = build_worker_pool()
+
+    # Reports need the outcome of every test, that cached results lack.
+    reporter = None
+    if options.json_report or options.junit_report:
+        reporter = Reporter(
+            options.json_report and os.path.abspath(options.json_report),
+            options.junit_report and os.path.abspath(options.junit_report)
+        )
+    # The GUI shows up before the caches are read, the monitor is built
+    # and the tests have run the first time, which the engine thread does
+    # in the background.
+    result_cache = None
+    if not options.full_runs and reporter is None:
+        result_cache = ResultCache(cwd, load=not gui and not options.cold)
+    coverage_map = None
+    if options.coverage_select:
+        coverage_map = CoverageMap(cwd, load=not gui)
+    history = RunHistory(cwd, load=not gui)
+    test_filter = None
+    if not options.import_all:
+        test_filter = StaticTestFilter(cwd, load=not gui)
+
+    def load_caches():
+        "reads what earlier sessions saved, and shows their last result"
+        for cache in (history, coverage_map, test_filter):
+            if cache is not None:
+                cache.load()
+        if result_cache is not None and not options.cold:
+            result_cache.load()
+        pytddmon.show_last_result()
+
+    # Parsed doctests are kept for the workers, and for --in-process.
+    use_doctest_cache(cwd).prune()
+
+    # Runs that are over once the tests have run need no change detector.
+    watching = options.no_gui and options.watch
     pytddmon = Pytddmon(
         file_finder,
-        monitor,
-        project_name=os.path.basename(cwd)
+        build_change_detector() if watching else None,
+        project_name=os.path.basename(cwd),
+        worker_pool=worker_pool,
+        impact_analysis=not options.full_runs,
+        coverage_map=coverage_map,
+        history=history,
+        result_cache=result_cache,
+        run_first=not gui,
+        reporter=reporter,
+        test_filter=test_filter
     )
 
     # Start the engine!
-    if not test_mode:
-        TkGUI(pytddmon, import_tkinter(), import_tk_font()).run()
+    if gui:
+        engine = EngineThread(
+            pytddmon,
+            build_monitor=build_change_detector,
+            first_run=True,
+            load_caches=load_caches
+        )
+        TkGUI(pytddmon, import_tkinter(), import_tk_font(), engine).run()
+    elif options.no_gui:
+        terminal = TerminalUI(pytddmon, quiet=options.quiet)
+        if options.watch:
+            terminal.watch()
+        else:
+            terminal.show()
     else:
-        pytddmon.main()
         with open("pytddmon.log", "w") as log_file:
             log_file.write(
                 "green=%r\ntotal=%r\n" % (
@@ -674,6 +4512,9 @@ def run():
                     pytddmon.result.total
                 )
             )
+    pytddmon.close()
+    if options.no_gui and pytddmon.result.passed != pytddmon.result.total:
+        sys.exit(1)
 
 if __name__ == '__main__':
     run()
@@ -0,0 +1,85 @@
+# coding: utf-8
+import os
+
+
+def write(root, name, content=''):
+    """writes content to the file name, a path below root with / between
+    folders, making the folders that are missing, and returns its path"""
+    path = os.path.join(root, *name.split('/'))
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def map_in_order(pool, func, items):
+    "runs func(item) for each item in pool, returns the results in order"
+    results = [None] * len(items)
+    for (index, result) in pool.imap_unordered(func, items):
+        results[index] = result
+    return results
+
+
+def run_test_files(pytddmon, file_paths):
+    "runs the tests in file_paths, returns the results in the same order"
+    results = dict(pytddmon.iterate_test_results(file_paths))
+    return [results[path] for path in file_paths]
+
+
+class FakeMonitor:
+    """Stands in for a Monitor: reports the paths added to changes, or
+    when there are none the next set of queued, once each."""
+
+    def __init__(self, poll_interval=123):
+        self.changes = set()
+        self.queued = []
+        self.poll_interval = poll_interval
+        self.closed = False
+
+    def look_for_changes(self):
+        (changes, self.changes) = (self.changes, set())
+        if not changes and self.queued:
+            changes = self.queued.pop(0)
+        return changes
+
+    def get_poll_interval(self):
+        return self.poll_interval
+
+    def close(self):
+        self.closed = True
+
+
+class FakeWorkerPool:
+    """Stands in for a WorkerPool without running anything: keeps the items
+    of every call, and gives each item the result of one passing test.
+    Subclasses give other results by overriding result."""
+
+    def __init__(self):
+        self.calls = []  # the items of each call
+        self.max_busy = []  # and the max_busy of each call
+        self.durations = {}
+        self.test_records = {}
+        self.closed = False
+
+    @property
+    def ran(self):
+        "the items of all calls, in the order they were run"
+        return [item for items in self.calls for item in items]
+
+    def imap_unordered(self, func, items, max_busy=None, cancelled=None,
+                       batches=None):
+        self.calls.append(list(items))
+        self.max_busy.append(max_busy)
+        for (index, item) in enumerate(items):
+            if cancelled is not None and cancelled():
+                return
+            yield (index, self.result(index, item))
+
+    def result(self, index, item):
+        "the result of the item, for a task of run_part_of_file the file's"
+        path = item[0] if isinstance(item, tuple) else item
+        return (path, 1, 1, '')
+
+    def close(self):
+        self.closed = True
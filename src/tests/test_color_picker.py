@@ -47,6 +47,12 @@ class test_pulse(unittest.TestCase):
 		(light, color) = self.color_picker.pick()
 		self.assertEqual('green', color)
 		
+	def test_stale_result_picks_stale_color(self):
+		self.color_picker.set_result(1, 2, stale=True)
+		(light, color) = self.color_picker.pick()
+		self.assertEqual('stale red', color)
+		self.assertEqual('#c99', self.color_picker.translate_color(light, color))
+
 	def test_pulse_is_not_reset_if_colors_stays_same(self):
 		self.color_picker.pulse()
 		self.color_picker.set_result(1,1)
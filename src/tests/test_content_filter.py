@@ -0,0 +1,74 @@
+# coding: utf-8
+import os
+import shutil
+import tempfile
+import unittest
+
+from pytddmon import ContentFilter, Debouncer
+from tests import FakeMonitor, write
+
+
+class test_content_filter(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = write(self.root, 'unit.py', 'x = 1')
+        self.monitor = FakeMonitor()
+        self.content_filter = ContentFilter(self.monitor, lambda: [self.path])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def report(self, *paths):
+        self.monitor.changes.update(paths)
+        return self.content_filter.look_for_changes()
+
+    def test_touched_file_is_not_a_change(self):
+        self.assertEqual(set(), self.report(self.path))
+
+    def test_new_contents_is_a_change(self):
+        write(self.root, 'unit.py', 'x = 2')
+        self.assertEqual(set([self.path]), self.report(self.path))
+
+    def test_changing_back_is_a_change(self):
+        write(self.root, 'unit.py', 'x = 2')
+        self.report(self.path)
+        write(self.root, 'unit.py', 'x = 1')
+        self.assertEqual(set([self.path]), self.report(self.path))
+
+    def test_new_file_is_a_change(self):
+        path = write(self.root, 'test_unit.py', '')
+        self.assertEqual(set([path]), self.report(path))
+
+    def test_removed_file_is_a_change(self):
+        os.remove(self.path)
+        self.assertEqual(set([self.path]), self.report(self.path))
+
+    def test_forgotten_file_counts_as_changed(self):
+        self.content_filter.max_digests = 1
+        self.report(write(self.root, 'other.py', ''))
+        self.assertEqual(set([self.path]), self.report(self.path))
+
+    def test_changing_back_within_a_burst_is_no_change(self):
+        now = [0.0]
+        content_filter = ContentFilter(
+            Debouncer(self.monitor, 0.2, 2.0, clock=lambda: now[0]),
+            lambda: [self.path]
+        )
+        write(self.root, 'unit.py', 'x = 2')
+        self.monitor.changes.add(self.path)
+        self.assertEqual(set(), content_filter.look_for_changes())
+        now[0] = 0.1
+        write(self.root, 'unit.py', 'x = 1')
+        self.monitor.changes.add(self.path)
+        self.assertEqual(set(), content_filter.look_for_changes())
+        now[0] = 0.5
+        self.assertEqual(set(), content_filter.look_for_changes())
+        self.assertFalse(content_filter.pending)
+
+    def test_delegates_to_monitor(self):
+        self.assertEqual(123, self.content_filter.get_poll_interval())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# coding: utf-8
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from pytddmon import CoverageMap, Pytddmon, WorkerPool
+from tests import run_test_files, write
+
+CALC = '''\
+def add(a, b):
+    return a + b
+
+
+def sub(a, b):
+    return a - b
+'''
+
+TEST_CALC = '''\
+import unittest
+import calc
+
+
+class test_calc(unittest.TestCase):
+    def test_add(self):
+        self.assertEqual(3, calc.add(1, 2))
+
+    def test_sub(self):
+        self.assertEqual(1, calc.sub(3, 2))
+'''
+
+
+class SpyWorkerPool(WorkerPool):
+    def __init__(self, root):
+        WorkerPool.__init__(self, root=root)
+        self.tasks = []
+
+    def imap_unordered(self, func, items, max_busy=None, cancelled=None,
+                       batches=None):
+        self.tasks.append(list(items))
+        return WorkerPool.imap_unordered(
+            self, func, items, max_busy, cancelled)
+
+
+class test_coverage_select(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        os.chdir(self.root)
+        sys.path.insert(0, self.root)
+        self.calc = write(self.root, 'calc.py', CALC)
+        self.test_calc = write(self.root, 'test_calc.py', TEST_CALC)
+        self.pool = SpyWorkerPool(self.root)
+        self.pytddmon = Pytddmon(
+            lambda: set([self.calc, self.test_calc]),
+            None,
+            worker_pool=self.pool,
+            coverage_map=CoverageMap(self.root)
+        )
+
+    def tearDown(self):
+        self.pytddmon.close()
+        sys.path.remove(self.root)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+    def change_calc(self, old, new):
+        write(self.root, 'calc.py', CALC.replace(old, new))
+        self.pytddmon.run_tests(set([self.calc]))
+
+    def test_first_run_records_coverage(self):
+        self.assertEqual(2, self.pytddmon.result.total)
+        self.assertTrue(os.path.exists(self.pytddmon.coverage_map.path))
+
+    def test_only_tests_executing_changed_lines_run(self):
+        self.change_calc('a - b', 'b - a')
+        [(path, test_ids, _root)] = self.pool.tasks[-1]
+        self.assertEqual(self.test_calc, path)
+        self.assertEqual(set(['test_calc.test_calc.test_sub']), test_ids)
+
+    def test_results_of_other_tests_are_kept(self):
+        self.change_calc('a - b', 'b - a')
+        self.assertEqual(2, self.pytddmon.result.total)
+        self.assertEqual(1, self.pytddmon.result.passed)
+
+    def test_comment_change_runs_nothing(self):
+        runs = len(self.pool.tasks)
+        self.change_calc('def add', '# adds\ndef add')
+        self.assertEqual(runs, len(self.pool.tasks))
+
+    def test_new_function_runs_whole_importers(self):
+        self.change_calc('def sub', 'def mul(a, b):\n    return a * b\n\n\ndef sub')
+        self.assertIn(
+            (self.test_calc, None, self.root),
+            self.pool.tasks[-1]
+        )
+
+    def test_line_numbers_follow_moved_code(self):
+        self.change_calc('def add', '# adds\ndef add')
+        write(self.root, 'calc.py', CALC.replace('def add', '# adds\ndef add')
+              .replace('a - b', 'b - a'))
+        self.pytddmon.run_tests(set([self.calc]))
+        [(path, test_ids, _root)] = self.pool.tasks[-1]
+        self.assertEqual(set(['test_calc.test_calc.test_sub']), test_ids)
+
+    def test_files_changed_before_a_full_run_are_read_again(self):
+        self.pytddmon.close()
+        write(self.root, 'calc.py', '\n' * 4 + CALC)
+        self.pytddmon = Pytddmon(
+            lambda: set([self.calc, self.test_calc]),
+            None,
+            worker_pool=self.pool,
+            coverage_map=CoverageMap(self.root, load=False)
+        )
+        write(self.root, 'calc.py', CALC)
+        self.pytddmon.run_tests(None)
+        self.change_calc('a + b', 'a * b')
+        [(path, test_ids, _root)] = self.pool.tasks[-1]
+        self.assertEqual(set(['test_calc.test_calc.test_add']), test_ids)
+
+    def test_dead_worker_gives_error_for_its_file(self):
+        path = write(
+            self.root,
+            'test_exit.py',
+            'import os\n\n\ndef test_exit():\n    """\n'
+            '    >>> os._exit(1)\n    """\n'
+        )
+        [result] = run_test_files(self.pytddmon, [path])
+        self.assertEqual(('Exception(%s)' % path, 0, 1j), result[:3])
+        self.assertIn('died', result[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# coding: utf-8
+import unittest
+
+from pytddmon import Debouncer
+from tests import FakeMonitor
+
+
+class test_debouncer(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.monitor = FakeMonitor(750)
+        self.debouncer = Debouncer(
+            self.monitor,
+            quiet_period=0.2,
+            max_wait=1.0,
+            clock=lambda: self.now
+        )
+
+    def look(self, now, *paths):
+        self.now = now
+        self.monitor.changes.update(paths)
+        return self.debouncer.look_for_changes()
+
+    def test_changes_are_held_back_until_quiet(self):
+        self.assertEqual(set(), self.look(0.0, 'a.py'))
+        self.assertEqual(set(), self.look(0.1))
+        self.assertEqual(set(['a.py']), self.look(0.2))
+        self.assertEqual(set(), self.look(0.4))
+
+    def test_burst_of_changes_is_one_change(self):
+        self.look(0.0, 'a.py')
+        self.look(0.15, 'b.py')
+        self.assertEqual(set(), self.look(0.3))
+        self.assertEqual(set(['a.py', 'b.py']), self.look(0.35))
+
+    def test_constant_churn_waits_at_most_max_wait(self):
+        for now in [0.0, 0.15, 0.3, 0.45, 0.6, 0.75, 0.9]:
+            self.assertEqual(set(), self.look(now, 'a.py'))
+        self.assertEqual(set(['a.py', 'b.py']), self.look(1.0, 'b.py'))
+
+    def test_polls_again_when_quiet_period_ends(self):
+        self.assertEqual(750, self.debouncer.get_poll_interval())
+        self.look(0.0, 'a.py')
+        self.now = 0.05
+        self.assertEqual(150, self.debouncer.get_poll_interval())
+
+    def test_delegates_to_monitor(self):
+        self.monitor.fileno = lambda: 3
+        self.assertEqual(3, self.debouncer.fileno())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# coding: utf-8
+import doctest
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from pytddmon import (
+    DocTestCache, Pytddmon, find_tests_in_module, take_test_records
+)
+from tests import FakeWorkerPool
+
+DOCTEST_MODULE = '''
+def double(x):
+    """
+    >>> double(2)
+    4
+    >>> double('a')
+    'aa'
+    """
+    return x * 2
+'''
+
+
+class TimedWorkerPool(FakeWorkerPool):
+    def result(self, index, item):
+        self.test_records[index] = [{
+            'module': item,
+            'import_seconds': 0.5,
+            'discovery_seconds': 0.25,
+        }]
+        return FakeWorkerPool.result(self, index, item)
+
+
+class test_discovery_time(unittest.TestCase):
+
+    def test_log_tells_import_and_discovery_time(self):
+        pytddmon = Pytddmon(
+            lambda: set(['test_a.py', 'test_b.py']),
+            None,
+            worker_pool=TimedWorkerPool()
+        )
+        self.assertIn(
+            'Workers spent 1.00 seconds importing test modules, and 0.50 '
+            'finding the tests in them.',
+            pytddmon.log
+        )
+
+
+class test_doctest_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        sys.path.insert(0, self.root)
+        self.path = self.write_module('doctest_cache_unit', DOCTEST_MODULE)
+        self.cache = DocTestCache(self.root)
+
+    def tearDown(self):
+        sys.path.remove(self.root)
+        sys.modules.pop('doctest_cache_unit', None)
+        shutil.rmtree(self.root)
+
+    def write_module(self, name, content):
+        path = os.path.join(self.root, name + '.py')
+        with open(path, 'w') as f:
+            f.write(content)
+        sys.modules.pop(name, None)
+        return path
+
+    def module(self):
+        __import__('doctest_cache_unit')
+        return sys.modules['doctest_cache_unit']
+
+    def run_doctests(self, cache):
+        suite = doctest.DocTestSuite(
+            self.module(),
+            optionflags=doctest.ELLIPSIS,
+            test_finder=cache
+        )
+        result = unittest.TestResult()
+        suite.run(result)
+        return (result.testsRun, len(result.failures))
+
+    def test_cached_doctests_run_like_parsed_ones(self):
+        self.assertEqual((1, 0), self.run_doctests(self.cache))
+        self.assertEqual((1, 0), self.run_doctests(DocTestCache(self.root)))
+
+    def test_unchanged_module_is_not_parsed_again(self):
+        self.cache.find(self.module())
+        self.module().double.__doc__ = '>>> double(1)\n3\n'
+        [test] = DocTestCache(self.root).find(self.module())
+        self.assertEqual(2, len(test.examples))
+
+    def test_changed_module_is_parsed_again(self):
+        self.cache.find(self.module())
+        self.write_module(
+            'doctest_cache_unit',
+            DOCTEST_MODULE.replace("'aa'", "'aa'\n    >>> 1\n    1")
+        )
+        [test] = self.cache.find(self.module())
+        self.assertEqual(3, len(test.examples))
+
+    def test_modules_with_test_dictionary_are_not_kept(self):
+        self.write_module(
+            'doctest_cache_unit',
+            DOCTEST_MODULE + '__test__ = {"extra": ">>> 1\\n1\\n"}\n'
+        )
+        self.assertEqual(2, len(self.cache.find(self.module())))
+        self.assertFalse(os.path.isdir(self.cache.folder))
+
+    def test_prune_drops_unused_doctests(self):
+        self.cache.find(self.module())
+        [name] = os.listdir(self.cache.folder)
+        path = os.path.join(self.cache.folder, name)
+        old = time.time() - self.cache.max_age - 10
+        os.utime(path, (old, old))
+        self.cache.prune()
+        self.assertEqual([], os.listdir(self.cache.folder))
+
+    def test_discovery_time_is_recorded_apart_from_import_time(self):
+        take_test_records()
+        find_tests_in_module('doctest_cache_unit')
+        [record] = take_test_records()
+        self.assertEqual('doctest_cache_unit', record['module'])
+        self.assertGreaterEqual(record['import_seconds'], 0)
+        self.assertGreaterEqual(record['discovery_seconds'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
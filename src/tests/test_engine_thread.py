@@ -0,0 +1,139 @@
+# coding: utf-8
+import os
+import threading
+import unittest
+
+from pytddmon import EngineThread, Result
+
+
+class FakePytddmon:
+    "sees one change, and runs tests showing progress once"
+
+    def __init__(self):
+        self.changes = [set(['a.py'])]
+        self.change_detected = None
+        self.result = Result(total=0, passed=0, time=-1)
+        self.log = ''
+        self.status_message = 'n/a'
+        self.stale = False
+        self.runs = []
+        self.threads = set()
+        self.fileno = None
+
+    def get_and_set_change_detected(self):
+        self.threads.add(threading.current_thread())
+        self.change_detected = self.changes.pop() if self.changes else set()
+        return self.change_detected
+
+    def run_tests(self, changed_paths, progress, preemptible=False):
+        self.runs.append(changed_paths)
+        self.result = Result(total=2, passed=1, time=0)
+        self.status_message = 'Testing... 1 of 2 files done'
+        progress()
+        self.result = Result(total=2, passed=2, time=1)
+        self.log = 'all green'
+        self.status_message = '12:00:00'
+
+    def get_poll_interval(self):
+        return 10
+
+    def get_event_fileno(self):
+        return self.fileno
+
+    def get_log(self):
+        return self.log
+
+    def get_status_message(self):
+        return self.status_message
+
+
+class test_engine_thread(unittest.TestCase):
+
+    def setUp(self):
+        self.pytddmon = FakePytddmon()
+        self.engine = EngineThread(self.pytddmon)
+
+    def tearDown(self):
+        self.engine.stop()
+
+    def drain(self):
+        snapshots = []
+        while not self.engine.snapshots.empty():
+            snapshots.append(self.engine.snapshots.get())
+        return snapshots
+
+    def test_publishes_start_progress_and_end_of_a_run(self):
+        self.engine.look_for_changes()
+        self.assertEqual(
+            [
+                ('Testing...', 0),
+                ('Testing... 1 of 2 files done', 1),
+                ('12:00:00', 2),
+            ],
+            [(s.status_message, s.result.passed) for s in self.drain()]
+        )
+
+    def test_publishes_nothing_without_changes(self):
+        self.pytddmon.changes = []
+        self.engine.look_for_changes()
+        self.assertEqual([], self.drain())
+
+    def test_runs_in_a_thread_of_its_own(self):
+        self.engine.start()
+        snapshot = self.engine.snapshots.get(timeout=5)
+        self.assertEqual('Testing...', snapshot.status_message)
+        self.engine.stop()
+        self.assertFalse(self.engine.is_alive())
+        self.assertEqual([set(['a.py'])], self.pytddmon.runs)
+        self.assertNotIn(threading.current_thread(), self.pytddmon.threads)
+
+    def test_failed_run_is_shown_as_error_and_changes_still_run(self):
+        def fail(changed_paths, progress, preemptible=False):
+            self.pytddmon.runs.append(changed_paths)
+            raise OSError('monitor gone')
+        self.pytddmon.run_tests = fail
+        self.pytddmon.changes = [set(['b.py']), set(['a.py'])]
+        self.engine.start()
+        snapshots = [self.engine.snapshots.get(timeout=5) for _ in range(3)]
+        self.engine.stop()
+        self.assertEqual(1j, snapshots[1].result.total)
+        self.assertIn('OSError: monitor gone', snapshots[1].log)
+        self.assertEqual('Testing...', snapshots[2].status_message)
+        self.assertEqual([set(['a.py']), set(['b.py'])],
+                         self.pytddmon.runs[:2])
+
+    def test_event_file_wakes_it_up(self):
+        (read_end, write_end) = os.pipe()
+        self.addCleanup(os.close, read_end)
+        self.addCleanup(os.close, write_end)
+        self.pytddmon.fileno = read_end
+        os.write(write_end, b'x')
+        self.engine.wait_for_changes(60)
+
+    def test_builds_monitor_and_runs_all_tests_first(self):
+        monitor = object()
+        self.engine = EngineThread(
+            self.pytddmon,
+            build_monitor=lambda: monitor,
+            first_run=True
+        )
+        self.engine.start()
+        self.engine.snapshots.get(timeout=5)
+        self.engine.stop()
+        self.assertIs(monitor, self.pytddmon.monitor)
+        self.assertEqual(None, self.pytddmon.runs[0])
+
+    def test_loads_caches_and_shows_them_before_the_first_run(self):
+        def load_caches():
+            self.assertEqual([], self.pytddmon.runs)
+            self.pytddmon.status_message = 'Last session'
+        self.engine = EngineThread(
+            self.pytddmon,
+            first_run=True,
+            load_caches=load_caches
+        )
+        self.engine.start()
+        snapshot = self.engine.snapshots.get(timeout=5)
+        self.engine.stop()
+        self.assertEqual('Last session', snapshot.status_message)
+        self.assertEqual([None], self.pytddmon.runs[:1])
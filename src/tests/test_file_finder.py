@@ -0,0 +1,100 @@
+# coding: utf-8
+import os
+import shutil
+import tempfile
+import unittest
+
+from pytddmon import FileFinder, IgnoreRules
+from tests import write
+
+
+class test_file_finder(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def find(self, exclude=()):
+        finder = FileFinder(self.root, r'.*\.py', exclude)
+        return sorted(
+            os.path.relpath(path, self.root).replace(os.sep, '/')
+            for path in finder()
+        )
+
+    def test_whole_file_name_has_to_match(self):
+        write(self.root, 'a.py')
+        write(self.root, 'a.pyc')
+        write(self.root, 'a.py.orig')
+        self.assertEqual(['a.py'], self.find())
+
+    def test_leaves_out_usual_folders_and_virtualenvs(self):
+        write(self.root, 'pkg/a.py')
+        write(self.root, '.git/hooks/b.py')
+        write(self.root, 'pkg/__pycache__/c.py')
+        write(self.root, 'env/lib/d.py')
+        write(self.root, 'env/pyvenv.cfg')
+        self.assertEqual(['pkg/a.py'], self.find())
+
+    def test_leaves_out_what_gitignore_ignores(self):
+        write(self.root, '.gitignore', '# build output\nbuild/\n*_pb2.py\n')
+        write(self.root, 'a.py')
+        write(self.root, 'a_pb2.py')
+        write(self.root, 'build/lib/b.py')
+        write(self.root, 'sub/build/c.py')
+        self.assertEqual(['a.py'], self.find())
+
+    def test_exclude_patterns(self):
+        write(self.root, 'a.py')
+        write(self.root, 'docs/conf.py')
+        write(self.root, 'tests/data/b.py')
+        self.assertEqual(['a.py'], self.find(['/docs', 'tests/data/']))
+
+    def test_does_not_look_into_excluded_folders(self):
+        write(self.root, 'a.py')
+        write(self.root, 'deep/b.py')
+        finder = FileFinder(self.root, r'.*\.py', ['deep/'])
+        looked_into = []
+        finder.excluded_folder = lambda path: looked_into.append(path) or \
+            FileFinder.excluded_folder(finder, path)
+        self.assertEqual(set([os.path.join(self.root, 'a.py')]), finder())
+        self.assertEqual([os.path.join(self.root, 'deep')], looked_into)
+
+
+class test_ignore_rules(unittest.TestCase):
+
+    def excluded(self, patterns, path, is_folder=False):
+        rules = IgnoreRules('/root', patterns)
+        return rules.excluded('/root/' + path, is_folder)
+
+    def test_pattern_without_slash_matches_at_any_depth(self):
+        self.assertTrue(self.excluded(['*.log'], 'a/b/c.log'))
+        self.assertFalse(self.excluded(['*.log'], 'a/b/c.py'))
+
+    def test_pattern_with_slash_matches_from_root(self):
+        self.assertTrue(self.excluded(['a/*.py'], 'a/b.py'))
+        self.assertFalse(self.excluded(['a/*.py'], 'a/b/c.py'))
+        self.assertFalse(self.excluded(['a/*.py'], 'x/a/b.py'))
+
+    def test_double_star_matches_any_number_of_folders(self):
+        self.assertTrue(self.excluded(['**/gen/*.py'], 'gen/a.py'))
+        self.assertTrue(self.excluded(['**/gen/*.py'], 'x/y/gen/a.py'))
+        self.assertTrue(self.excluded(['out/**'], 'out/x/a.py'))
+
+    def test_trailing_slash_only_matches_folders(self):
+        self.assertFalse(self.excluded(['cache/'], 'cache'))
+        self.assertTrue(self.excluded(['cache/'], 'cache', is_folder=True))
+
+    def test_last_matching_pattern_decides(self):
+        patterns = ['*.py', '!keep.py']
+        self.assertTrue(self.excluded(patterns, 'drop.py'))
+        self.assertFalse(self.excluded(patterns, 'keep.py'))
+
+    def test_character_classes(self):
+        self.assertTrue(self.excluded(['test_[ab].py'], 'test_a.py'))
+        self.assertFalse(self.excluded(['test_[!ab].py'], 'test_a.py'))
+
+
+if __name__ == '__main__':
+    unittest.main()
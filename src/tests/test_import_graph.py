@@ -0,0 +1,168 @@
+# coding: utf-8
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from pytddmon import ImportGraph, Pytddmon
+from tests import FakeWorkerPool, write
+
+
+class ImportGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'package'))
+        self.files = {}
+        self.write('package/__init__.py', '')
+        self.write('package/leaf.py', 'x = 1\n')
+        self.write('package/middle.py', 'from . import leaf\n')
+        self.write('test_middle.py', 'import package.middle\n')
+        self.write('test_other.py', 'import os\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, content):
+        path = write(self.root, name, content)
+        self.files[name] = path
+        return path
+
+    def paths(self, *names):
+        return set(self.files[name] for name in names)
+
+
+class test_import_graph(ImportGraphTestCase):
+
+    def setUp(self):
+        ImportGraphTestCase.setUp(self)
+        self.graph = ImportGraph(self.root)
+        self.graph.update(self.files.values())
+
+    def test_importers_are_affected_transitively(self):
+        self.assertEqual(
+            self.paths(
+                'package/leaf.py', 'package/middle.py', 'test_middle.py'
+            ),
+            self.graph.affected(self.paths('package/leaf.py'))
+        )
+
+    def test_unrelated_module_is_not_affected(self):
+        self.assertEqual(
+            self.paths('test_other.py'),
+            self.graph.affected(self.paths('test_other.py'))
+        )
+
+    def test_package_init_affects_importers_of_package(self):
+        self.assertIn(
+            self.files['test_middle.py'],
+            self.graph.affected(self.paths('package/__init__.py'))
+        )
+
+    def test_changed_imports_are_parsed_again(self):
+        self.write('test_other.py', 'from package import leaf\n')
+        self.graph.update(self.files.values(), self.paths('test_other.py'))
+        self.assertIn(
+            self.files['test_other.py'],
+            self.graph.affected(self.paths('package/leaf.py'))
+        )
+
+    def test_multiline_import(self):
+        self.write('test_other.py', 'from package.leaf import (\n    x,\n)\n')
+        self.graph.update(self.files.values(), self.paths('test_other.py'))
+        self.assertIn(
+            self.files['test_other.py'],
+            self.graph.affected(self.paths('package/leaf.py'))
+        )
+
+    def test_modules_are_found_below_folders_on_the_path(self):
+        os.mkdir(os.path.join(self.root, 'src'))
+        os.mkdir(os.path.join(self.root, 'src', 'mypkg'))
+        self.write('src/mypkg/__init__.py', '')
+        self.write('src/mypkg/util.py', 'x = 1\n')
+        self.write('test_util.py', 'from mypkg.util import x\n')
+        graph = ImportGraph(
+            self.root,
+            ['', os.path.join(self.root, 'src'), os.path.dirname(os.__file__)]
+        )
+        graph.update(self.files.values())
+        self.assertIn(
+            self.files['test_util.py'],
+            graph.affected(self.paths('src/mypkg/util.py'))
+        )
+
+    def test_files_importing_modules_not_found_are_unresolved(self):
+        self.write('test_other.py', 'import os\nimport no_such_module\n')
+        self.write('test_middle.py', 'import package.middle\nimport sys\n')
+        self.graph.update(self.files.values())
+        self.assertEqual(self.paths('test_other.py'), self.graph.unresolved)
+
+    def test_files_importing_unmonitored_project_modules_are_unresolved(self):
+        write(self.root, 'unmonitored.py', 'x = 1\n')
+        self.write('test_other.py', 'import unmonitored\n')
+        sys.path.insert(0, self.root)
+        try:
+            self.graph.update(self.files.values())
+        finally:
+            sys.path.remove(self.root)
+        self.assertEqual(self.paths('test_other.py'), self.graph.unresolved)
+
+
+class test_impact_analysis(ImportGraphTestCase):
+
+    def setUp(self):
+        ImportGraphTestCase.setUp(self)
+        self.pool = FakeWorkerPool()
+        self.pytddmon = Pytddmon(
+            lambda: set(self.files.values()),
+            None,
+            worker_pool=self.pool
+        )
+
+    def test_runs_everything_at_start(self):
+        self.assertEqual(
+            [sorted(self.files.values())],
+            [sorted(items) for items in self.pool.calls]
+        )
+
+    def test_only_affected_modules_run(self):
+        self.pytddmon.run_tests(self.paths('package/middle.py'))
+        self.assertEqual(
+            sorted(self.paths('package/middle.py', 'test_middle.py')),
+            sorted(self.pool.calls[-1])
+        )
+
+    def test_results_of_unaffected_modules_are_kept(self):
+        self.pytddmon.run_tests(self.paths('test_other.py'))
+        self.assertEqual(5, self.pytddmon.result.total)
+
+    def test_importers_of_removed_module_run(self):
+        os.remove(self.files['package/leaf.py'])
+        removed = self.paths('package/leaf.py')
+        del self.files['package/leaf.py']
+        self.pytddmon.run_tests(removed)
+        self.assertEqual(
+            sorted(self.paths('package/middle.py', 'test_middle.py')),
+            sorted(self.pool.calls[-1])
+        )
+
+    def test_change_to_module_without_importers_runs_everything(self):
+        self.write('package/loose.py', 'x = 1\n')
+        self.pytddmon.run_tests(self.paths('package/loose.py'))
+        self.assertEqual(
+            sorted(self.files.values()),
+            sorted(self.pool.calls[-1])
+        )
+
+    def test_change_to_other_files_runs_everything(self):
+        notes = os.path.join(self.root, 'notes.txt')
+        self.pytddmon.run_tests(set([notes]))
+        self.assertEqual(
+            sorted(self.files.values()),
+            sorted(self.pool.calls[-1])
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# coding: utf-8
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+from pytddmon import InProcessPool, Pytddmon
+from tests import FakeWorkerPool, map_in_order
+
+
+def get_pid(_item):
+    return os.getpid()
+
+
+def import_value(module_name):
+    return __import__(module_name).value
+
+
+def set_environment_variable(item):
+    os.environ['PYTDDMON_TEST_LEAK'] = item
+    return item
+
+
+class FallbackPool(FakeWorkerPool):
+    "stands in for the worker processes the pool falls back on"
+
+    def result(self, index, item):
+        return (item, 1, 1, 'worker')
+
+
+class test_in_process_pool(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        sys.path.insert(0, self.root)
+        self.fallback = FallbackPool()
+        self.pool = InProcessPool(self.root, lambda: self.fallback)
+
+    def tearDown(self):
+        sys.path.remove(self.root)
+        for name in ['in_process_unit']:
+            sys.modules.pop(name, None)
+        os.environ.pop('PYTDDMON_TEST_LEAK', None)
+        shutil.rmtree(self.root)
+
+    def map(self, func, items):
+        return map_in_order(self.pool, func, items)
+
+    def write_module(self, name, content):
+        path = os.path.join(self.root, name + '.py')
+        with open(path, 'w') as f:
+            f.write(content)
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        return path
+
+    def test_runs_in_this_process(self):
+        self.assertEqual([os.getpid()], self.map(get_pid, [None]))
+
+    def test_project_modules_are_imported_fresh_for_every_run(self):
+        self.write_module('in_process_unit', 'value = 1\n')
+        self.assertEqual([1], self.map(import_value, ['in_process_unit']))
+        self.write_module('in_process_unit', 'value = 22\n')
+        self.assertEqual(
+            [22],
+            self.map(import_value, ['in_process_unit'])
+        )
+
+    def test_leaked_state_is_restored_and_rest_runs_in_workers(self):
+        results = self.map(set_environment_variable, ['a', 'b', 'c'])
+        self.assertEqual(
+            ['a', ('b', 1, 1, 'worker'), ('c', 1, 1, 'worker')],
+            results
+        )
+        self.assertNotIn('PYTDDMON_TEST_LEAK', os.environ)
+        self.assertIn('a changed environment variables', self.pool.notice)
+        self.map(get_pid, [None])
+        self.assertEqual([['b', 'c'], [None]], self.fallback.calls)
+
+    def test_state_is_restored_when_the_run_stops_after_a_result(self):
+        results = self.pool.imap_unordered(set_environment_variable, ['a'])
+        self.assertEqual((0, 'a'), next(results))
+        results.close()
+        self.assertNotIn('PYTDDMON_TEST_LEAK', os.environ)
+        self.assertIn('a changed environment variables', self.pool.notice)
+
+    def test_project_c_extension_makes_it_fall_back(self):
+        extension = types.ModuleType('in_process_unit')
+        extension.__file__ = os.path.join(self.root, 'in_process_unit.so')
+        sys.modules['in_process_unit'] = extension
+        self.pool.known_modules.add('in_process_unit')
+        self.map(get_pid, [None, None])
+        self.assertIn('C extension', self.pool.notice)
+        self.assertEqual([[None]], self.fallback.calls)
+
+    def test_off_the_main_thread_it_falls_back(self):
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.extend(self.map(get_pid, ['a']))
+        )
+        thread.start()
+        thread.join()
+        self.assertEqual([('a', 1, 1, 'worker')], results)
+        self.assertIn('not run them on the main thread', self.pool.notice)
+
+    def test_closes_fallback(self):
+        self.map(set_environment_variable, ['a'])
+        self.pool.close()
+        self.assertTrue(self.fallback.closed)
+
+    def test_notice_is_in_the_log(self):
+        path = self.write_module('test_leak', '')
+        self.pool.fall_back('changed sys.path', path)
+        pytddmon = Pytddmon(lambda: set([path]), None, worker_pool=self.pool)
+        self.assertIn(
+            'Running the tests in worker processes, since %s changed '
+            'sys.path.' % path,
+            pytddmon.log
+        )
@@ -0,0 +1,111 @@
+# coding: utf-8
+import os
+import shutil
+import tempfile
+import unittest
+
+from pytddmon import FileFinder, InotifyMonitor, Monitor, load_libc
+from tests import write
+
+
+def inotify_available():
+    try:
+        load_libc()
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+@unittest.skipUnless(inotify_available(), "inotify is Linux only")
+class test_inotify_monitor(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        write(self.root, 'unit.py', 'x = 1\n')
+        self.monitor = InotifyMonitor(
+            FileFinder(self.root, r".*\.py"),
+            self.build_fallback
+        )
+
+    def tearDown(self):
+        self.monitor.close()
+        shutil.rmtree(self.root)
+
+    def build_fallback(self):
+        raise AssertionError("should not fall back")
+
+    def test_nothing_changed(self):
+        self.assertEqual(set(), self.monitor.look_for_changes())
+
+    def test_modified_file_is_reported(self):
+        path = write(self.root, 'unit.py', 'x = 1\n')
+        self.assertEqual(set([path]), self.monitor.look_for_changes())
+
+    def test_change_is_only_reported_once(self):
+        write(self.root, 'unit.py', 'x = 1\n')
+        self.monitor.look_for_changes()
+        self.assertEqual(set(), self.monitor.look_for_changes())
+
+    def test_not_matching_file_is_ignored(self):
+        write(self.root, 'notes.txt', 'x = 1\n')
+        self.assertEqual(set(), self.monitor.look_for_changes())
+
+    def test_excluded_folder_is_not_watched(self):
+        os.mkdir(os.path.join(self.root, '.git'))
+        self.monitor.look_for_changes()
+        write(self.root, '.git/hook.py', 'x = 1\n')
+        self.assertEqual(set(), self.monitor.look_for_changes())
+
+    def test_files_in_new_folder_are_watched(self):
+        os.mkdir(os.path.join(self.root, 'package'))
+        self.monitor.look_for_changes()
+        path = write(self.root, 'package/test_unit.py', 'x = 1\n')
+        self.assertEqual(set([path]), self.monitor.look_for_changes())
+
+    def test_removed_folder_reports_its_files(self):
+        os.mkdir(os.path.join(self.root, 'package'))
+        self.monitor.look_for_changes()
+        path = write(self.root, 'package/test_unit.py', 'x = 1\n')
+        self.monitor.look_for_changes()
+        shutil.rmtree(os.path.join(self.root, 'package'))
+        self.assertIn(path, self.monitor.look_for_changes())
+
+    def test_event_fileno_is_readable_after_change(self):
+        import select
+        write(self.root, 'unit.py', 'x = 1\n')
+        (readable, _, _) = select.select([self.monitor.fileno()], [], [], 1)
+        self.assertEqual([self.monitor.fileno()], readable)
+
+
+class test_poll_back_off(unittest.TestCase):
+
+    def setUp(self):
+        self.files = ['file']
+        self.monitor = Monitor(lambda: self.files, len, lambda f: 1)
+
+    def test_polls_slower_while_nothing_changes(self):
+        first = self.monitor.get_poll_interval()
+        self.monitor.look_for_changes()
+        self.assertTrue(self.monitor.get_poll_interval() > first)
+
+    def test_never_slower_than_max_interval(self):
+        for _ in range(20):
+            self.monitor.look_for_changes()
+        self.assertEqual(
+            Monitor.max_poll_interval,
+            self.monitor.get_poll_interval()
+        )
+
+    def test_polls_fast_again_after_change(self):
+        for _ in range(20):
+            self.monitor.look_for_changes()
+        self.files.append('file2')
+        self.monitor.look_for_changes()
+        self.assertEqual(
+            Monitor.min_poll_interval,
+            self.monitor.get_poll_interval()
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
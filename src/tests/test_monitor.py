@@ -1,6 +1,10 @@
 # coding: utf-8
+import os
+import shutil
+import tempfile
 import unittest
-from pytddmon import Monitor
+from pytddmon import Monitor, IncrementalMonitor, FileFinder
+from tests import write
 
 class test_change_detection(unittest.TestCase):
 
@@ -95,5 +99,65 @@ class test_change_detection(unittest.TestCase):
         change_detected = monitor.look_for_changes()
         assert not change_detected
 
+    def test_changed_files_are_returned(self):
+        files = ['file', 'file2']
+        def file_finder():
+            return files
+        def get_file_size(file):
+            return 1
+        def get_file_modification_time(file):
+            return 1
+        monitor = Monitor(file_finder, get_file_size, get_file_modification_time)
+        files[:] = ['file', 'file3']
+        change_detected = monitor.look_for_changes()
+        self.assertEqual(set(['file2', 'file3']), change_detected)
+
+
+class test_incremental_monitor(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'package'))
+        self.path = write(self.root, 'package/unit.py', 'x = 1')
+        self.monitor = IncrementalMonitor(FileFinder(self.root, r".*\.py"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_nothing_changed(self):
+        self.assertEqual(set(), self.monitor.look_for_changes())
+
+    def test_file_changed_in_place(self):
+        write(self.root, 'package/unit.py', 'x = 22')
+        self.assertEqual(set([self.path]), self.monitor.look_for_changes())
+
+    def test_adding_file(self):
+        path = write(self.root, 'package/test_unit.py', '')
+        self.assertEqual(set([path]), self.monitor.look_for_changes())
+
+    def test_removing_folder(self):
+        shutil.rmtree(os.path.join(self.root, 'package'))
+        self.assertEqual(set([self.path]), self.monitor.look_for_changes())
+
+    def test_not_matching_file_is_ignored(self):
+        write(self.root, 'package/notes.txt', '')
+        self.assertEqual(set(), self.monitor.look_for_changes())
+
+    def test_files_in_excluded_folder_are_ignored(self):
+        os.mkdir(os.path.join(self.root, '__pycache__'))
+        write(self.root, '__pycache__/unit.py', '')
+        self.assertEqual(set(), self.monitor.look_for_changes())
+
+    def test_unchanged_folder_is_not_listed_again(self):
+        listed = []
+        scan_folder = self.monitor.scan_folder
+        def spy(folder, snapshot):
+            listed.append(folder)
+            return scan_folder(folder, snapshot)
+        self.monitor.scan_folder = spy
+        self.monitor.look_for_changes()
+        self.assertEqual([], listed)
+
+
 if __name__ == '__main__':
     unittest.main()
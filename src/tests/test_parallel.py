@@ -0,0 +1,317 @@
+# coding: utf-8
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from pytddmon import (
+    Pytddmon, RunHistory, WorkerPool, merge_results, part_key,
+    run_part_of_file, runs_serially
+)
+from tests import FakeWorkerPool, run_test_files, write
+
+
+class test_runs_serially(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'shared'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_module_without_marker_runs_in_parallel(self):
+        path = write(self.root, 'test_unit.py', 'x = 1\n')
+        self.assertFalse(runs_serially(path))
+
+    def test_module_with_marker_comment_runs_serially(self):
+        path = write(
+            self.root, 'test_db.py', 'import db\n# pytddmon: serial\n'
+        )
+        self.assertTrue(runs_serially(path))
+
+    def test_marker_in_string_does_not_count(self):
+        path = write(self.root, 'test_unit.py', 'x = "# pytddmon: serial"\n')
+        self.assertFalse(runs_serially(path))
+
+    def test_module_below_marked_folder_runs_serially(self):
+        write(self.root, 'shared/.pytddmon_serial', '')
+        path = write(self.root, 'shared/test_unit.py', 'x = 1\n')
+        self.assertTrue(runs_serially(path))
+
+    def test_marked_folder_above_root_does_not_count(self):
+        write(self.root, '.pytddmon_serial', '')
+        path = write(self.root, 'shared/test_unit.py', 'x = 1\n')
+        self.assertFalse(
+            runs_serially(path, os.path.join(self.root, 'shared'))
+        )
+
+
+class test_parallel_runs(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.paths = []
+        for name in ['test_b.py', 'test_a.py', 'test_c.py']:
+            self.paths.append(write(
+                self.root,
+                name,
+                '# pytddmon: serial\n' if name == 'test_c.py' else ''
+            ))
+        self.pool = FakeWorkerPool()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_serial_modules_run_one_at_a_time_after_the_others(self):
+        Pytddmon(lambda: set(self.paths), None, worker_pool=self.pool)
+        self.assertEqual(
+            [(sorted(self.paths[:2]), None), ([self.paths[2]], 1)],
+            list(zip(self.pool.calls, self.pool.max_busy))
+        )
+
+    def test_results_are_in_file_order(self):
+        pytddmon = Pytddmon(lambda: set(self.paths), None, worker_pool=self.pool)
+        self.assertEqual(
+            sorted(self.paths),
+            [r[0] for r in run_test_files(pytddmon, sorted(self.paths))]
+        )
+
+    def test_answer_is_kept_until_the_file_changes(self):
+        pytddmon = Pytddmon(lambda: set(self.paths), None, worker_pool=self.pool)
+        self.assertFalse(pytddmon.runs_serially(self.paths[0]))
+        write(self.root, 'test_b.py', '# pytddmon: serial\n')
+        os.utime(self.paths[0], (0, 0))
+        self.assertTrue(pytddmon.runs_serially(self.paths[0]))
+
+
+class ShardingWorkerPool(FakeWorkerPool):
+    processes = 2
+
+
+class test_sharding(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.slow = write(self.root, 'test_slow.py', SPLIT_MODULE)
+        self.quick = write(self.root, 'test_quick.py', '')
+        self.medium = write(self.root, 'test_medium.py', '')
+        self.history = RunHistory()
+        for (path, seconds) in [
+                (self.slow, 10), (self.quick, 0.1), (self.medium, 1)]:
+            self.history.record(path, ('', 1, 1, ''), seconds)
+            os.utime(path, (0, 0))
+        self.pool = ShardingWorkerPool()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def run_once(self):
+        return Pytddmon(
+            lambda: set([self.slow, self.quick, self.medium]),
+            None,
+            worker_pool=self.pool,
+            history=self.history
+        )
+
+    def test_slow_file_is_split_and_longest_run_first(self):
+        self.history.record(part_key(self.slow, 'test_b'), ('', 1, 1, ''), 6)
+        self.run_once()
+        names = ('test_a', 'test_b')
+        self.assertEqual(
+            [
+                (self.slow, 'test_b', names),
+                (self.slow, 'test_a', names),
+                (self.slow, None, names),
+                (self.medium, None, ()),
+                (self.quick, None, ()),
+            ],
+            self.pool.calls[0]
+        )
+
+    def test_parts_give_one_result_for_the_file(self):
+        pytddmon = self.run_once()
+        self.assertEqual(
+            (self.slow, 3, 3, 'All 3 tests passed\n'),
+            pytddmon.module_results[self.slow]
+        )
+        self.assertEqual(5, pytddmon.result.total)
+
+    def test_fast_files_are_not_split(self):
+        self.history.record(self.slow, ('', 1, 1, ''), 0.5)
+        self.run_once()
+        self.assertIn((self.slow, None, ()), self.pool.calls[0])
+
+    def test_one_worker_runs_fastest_first_without_splitting(self):
+        self.pool.processes = 1
+        self.run_once()
+        self.assertEqual(
+            [self.quick, self.medium, self.slow],
+            self.pool.calls[0]
+        )
+
+
+class test_batching(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.history = RunHistory()
+        self.pool = ShardingWorkerPool()
+        self.pool.processes = 1
+        self.pytddmon = Pytddmon(
+            lambda: set(),
+            None,
+            worker_pool=self.pool,
+            history=self.history
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def ran(self, name, seconds):
+        path = os.path.join(self.root, name)
+        self.history.record(path, ('', 1, 1, ''), seconds)
+        return path
+
+    def write(self, name, size):
+        return write(self.root, name, '#' * size)
+
+    def test_quick_files_run_together_slow_ones_alone(self):
+        paths = [
+            self.ran('test_a.py', 0.1),
+            self.ran('test_slow.py', 5),
+            self.ran('test_b.py', 0.2),
+            self.ran('test_c.py', 0.25),
+            self.ran('test_d.py', 0.01),
+        ]
+        self.assertEqual([[0, 2], [3, 4]], self.pytddmon.batches(paths))
+
+    def test_small_files_that_did_not_run_count_as_quick(self):
+        paths = [
+            self.write('test_a.py', 10),
+            self.write('test_big.py', 100000),
+            self.write('test_b.py', 10),
+        ]
+        self.assertEqual([[0, 2]], self.pytddmon.batches(paths))
+
+    def test_every_worker_gets_a_share(self):
+        self.pool.processes = 2
+        paths = [self.ran('test_%i.py' % i, 0) for i in range(5)]
+        self.assertEqual(
+            [[0, 1, 2], [3, 4]],
+            self.pytddmon.batches(paths)
+        )
+
+
+DYING_MODULE = '''
+import os
+import unittest
+
+
+class test_dying(unittest.TestCase):
+    def test_exit(self):
+        os._exit(1)
+'''
+
+
+class test_dead_worker_in_parallel_run(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        os.chdir(self.root)
+        sys.path.insert(0, self.root)
+        self.paths = []
+        for (name, content) in [
+                ('test_dying.py', DYING_MODULE),
+                ('test_fine.py', SPLIT_MODULE)]:
+            self.paths.append(write(self.root, name, content))
+        self.pool = WorkerPool(processes=2, root=self.root)
+
+    def tearDown(self):
+        self.pool.close()
+        sys.path.remove(self.root)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+    def test_dead_worker_gives_error_for_its_file(self):
+        pytddmon = Pytddmon(
+            lambda: set(self.paths),
+            None,
+            worker_pool=self.pool
+        )
+        results = run_test_files(pytddmon, self.paths)
+        self.assertEqual(1j, results[0][2])
+        self.assertIn('died', results[0][3])
+        self.assertEqual(4, results[1][2])
+
+
+SPLIT_MODULE = '''
+import unittest
+
+
+def double(x):
+    """
+    >>> double(2)
+    4
+    """
+    return 2 * x
+
+
+class test_a(unittest.TestCase):
+    def test_one(self):
+        pass
+
+    def test_two(self):
+        self.fail('two')
+
+
+class test_b(unittest.TestCase):
+    def test_three(self):
+        pass
+'''
+
+
+class test_run_part_of_file(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.root)
+        sys.path.insert(0, self.root)
+        with open('split_module.py', 'w') as f:
+            f.write(SPLIT_MODULE)
+        self.names = ('test_a', 'test_b')
+
+    def tearDown(self):
+        sys.path.remove(self.root)
+        sys.modules.pop('split_module', None)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+    def run_part(self, name):
+        return run_part_of_file(('split_module.py', name, self.names))
+
+    def test_runs_only_the_tests_of_the_class(self):
+        (module, green, total, log) = self.run_part('test_a')
+        self.assertEqual(('split_module', 1, 2), (module, green, total))
+        self.assertIn('two', log)
+
+    def test_rest_has_tests_outside_split_classes(self):
+        self.assertEqual(
+            ('split_module', 1, 1, 'All 1 tests passed\n'),
+            self.run_part(None)
+        )
+
+    def test_merged_parts_add_up(self):
+        merged = None
+        for name in self.names + (None,):
+            merged = merge_results(merged, self.run_part(name))
+        self.assertEqual(('split_module', 3, 4), merged[:3])
+        self.assertIn('two', merged[3])
+        self.assertNotIn('All', merged[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
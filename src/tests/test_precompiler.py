@@ -0,0 +1,86 @@
+# coding: utf-8
+import importlib.util
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pytddmon import Debouncer, Precompiler, Pytddmon, WorkerPool
+from tests import FakeMonitor, write
+
+
+class test_precompiler(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.files = [write(self.root, 'unit.py', 'x = 1\n')]
+        self.monitor = FakeMonitor()
+        self.precompiler = Precompiler(self.monitor, lambda: self.files)
+
+    def tearDown(self):
+        self.precompiler.close()
+        shutil.rmtree(self.root)
+
+    def wait_for_bytecode(self, path):
+        bytecode = importlib.util.cache_from_source(path)
+        deadline = time.time() + 5
+        while not os.path.exists(bytecode) and time.time() < deadline:
+            time.sleep(0.01)
+        return os.path.exists(bytecode)
+
+    def test_all_files_are_compiled_to_start_with(self):
+        self.assertTrue(self.wait_for_bytecode(self.files[0]))
+
+    def test_changed_files_are_compiled_and_passed_on(self):
+        path = write(self.root, 'test_unit.py', 'import unit\n')
+        self.monitor.changes.add(path)
+        self.assertEqual(set([path]), self.precompiler.look_for_changes())
+        self.assertTrue(self.wait_for_bytecode(path))
+
+    def test_bytecode_of_a_rewrite_of_the_same_size_is_not_used(self):
+        self.assertTrue(self.wait_for_bytecode(self.files[0]))
+        stat = os.stat(self.files[0])
+        write(self.root, 'unit.py', 'x = 2\n')
+        os.utime(self.files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        spec = importlib.util.spec_from_file_location('unit', self.files[0])
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        self.assertEqual(2, module.x)
+
+    def test_changed_files_are_compiled_first(self):
+        self.precompiler.close()
+        self.precompiler.pending.clear()
+        self.precompiler.queued.clear()
+        self.precompiler.compile_soon(['a.py', 'b.py'])
+        self.precompiler.compile_soon(['b.py', 'notes.txt'], first=True)
+        self.assertEqual(['b.py', 'a.py'], list(self.precompiler.pending))
+
+    def test_broken_file_does_not_stop_it(self):
+        broken = write(self.root, 'broken.py', 'def (\n')
+        path = write(self.root, 'later.py', '')
+        self.precompiler.compile_soon([broken, path], first=True)
+        self.assertTrue(self.wait_for_bytecode(path))
+
+    def test_close_stops_thread_and_monitor(self):
+        self.precompiler.close()
+        self.assertFalse(self.precompiler.thread.is_alive())
+        self.assertTrue(self.monitor.closed)
+
+    def test_closing_pytddmon_closes_it(self):
+        pytddmon = Pytddmon(
+            lambda: self.files,
+            Debouncer(self.precompiler),
+            worker_pool=WorkerPool(),
+            run_first=False
+        )
+        pytddmon.close()
+        self.assertFalse(self.precompiler.thread.is_alive())
+        self.assertTrue(self.monitor.closed)
+
+    def test_delegates_to_monitor(self):
+        self.assertEqual(123, self.precompiler.get_poll_interval())
+
+
+if __name__ == '__main__':
+    unittest.main()
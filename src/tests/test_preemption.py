@@ -0,0 +1,56 @@
+# coding: utf-8
+import os
+import shutil
+import tempfile
+import unittest
+
+from pytddmon import Pytddmon
+from tests import FakeMonitor, FakeWorkerPool
+
+
+class test_preemption(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.paths = []
+        for name in ['test_a.py', 'test_b.py', 'test_c.py']:
+            path = os.path.join(self.root, name)
+            open(path, 'w').close()
+            self.paths.append(path)
+        self.monitor = FakeMonitor(0)
+        self.pool = FakeWorkerPool()
+        self.pytddmon = Pytddmon(
+            lambda: set(self.paths),
+            self.monitor,
+            worker_pool=self.pool
+        )
+        self.pool.calls = []
+        (self.a, self.b, self.c) = self.paths
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_change_during_run_starts_over(self):
+        # Nothing changed before the run and before test_a, then test_c.
+        self.monitor.queued = [set(), set(), set([self.c])]
+        self.pytddmon.run_tests(set(self.paths), preemptible=True)
+        self.assertEqual(
+            [self.paths, [self.b, self.c]],
+            self.pool.calls
+        )
+        self.assertEqual(3, self.pytddmon.result.total)
+
+    def test_changes_before_and_after_starting_over_are_shown(self):
+        self.monitor.queued = [set(), set(), set([self.c])]
+        self.pytddmon.run_tests(set([self.a, self.b]), preemptible=True)
+        self.assertEqual(
+            [[self.a, self.b], [self.b, self.c]],
+            self.pool.calls
+        )
+        self.assertEqual(set(self.paths), self.pytddmon.change_detected)
+
+    def test_run_that_is_not_preemptible_ignores_changes(self):
+        self.monitor.queued = [set([self.c])]
+        self.pytddmon.run_tests(set(self.paths))
+        self.assertEqual([self.paths], self.pool.calls)
+        self.assertEqual([set([self.c])], self.monitor.queued)
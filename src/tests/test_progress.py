@@ -0,0 +1,59 @@
+# coding: utf-8
+import unittest
+
+from pytddmon import Pytddmon
+from tests import FakeWorkerPool
+
+
+class ReversingWorkerPool(FakeWorkerPool):
+    "finishes the files in reverse name order, failing the ones named 'red'"
+
+    def imap_unordered(self, func, items, max_busy=None, cancelled=None,
+                       batches=None):
+        indexes = sorted(range(len(items)), key=items.__getitem__)
+        for index in reversed(indexes):
+            yield (index, self.result(index, items[index]))
+
+    def result(self, index, item):
+        green = 0 if 'red' in item else 1
+        return (item, green, 1, item + '\n')
+
+
+class test_progress(unittest.TestCase):
+
+    def setUp(self):
+        self.seen = []
+
+    def build(self, files):
+        return Pytddmon(
+            lambda: set(files),
+            None,
+            worker_pool=ReversingWorkerPool()
+        )
+
+    def record(self):
+        self.seen.append((
+            self.pytddmon.get_status_message(),
+            self.pytddmon.result.passed,
+            self.pytddmon.result.total
+        ))
+
+    def test_failure_is_shown_before_the_run_is_done(self):
+        self.pytddmon = self.build(['a', 'b', 'c_red'])
+        self.pytddmon.run_tests(None, self.record)
+        self.assertEqual(('Testing... 1 of 3 files done', 2, 3), self.seen[0])
+
+    def test_no_progress_after_the_last_file(self):
+        self.pytddmon = self.build(['a', 'b_red'])
+        self.pytddmon.run_tests(None, self.record)
+        self.assertEqual([('Testing... 1 of 2 files done', 1, 2)], self.seen)
+        self.assertEqual(1, self.pytddmon.result.passed)
+        self.assertEqual(2, self.pytddmon.result.total)
+        self.assertNotIn('Testing', self.pytddmon.get_status_message())
+
+    def test_log_tells_how_many_files_are_still_running(self):
+        self.pytddmon = self.build(['a', 'b_red'])
+        logs = []
+        self.pytddmon.run_tests(None, lambda: logs.append(self.pytddmon.log))
+        self.assertIn('Still running 1 files', logs[0])
+        self.assertNotIn('Still running', self.pytddmon.log)
@@ -0,0 +1,168 @@
+# coding: utf-8
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+import pytddmon
+from pytddmon import (
+    Reporter, Result, WorkerPool, reporting_result_class, take_test_records
+)
+from tests import map_in_order
+
+
+def add_test_record(item):
+    pytddmon.test_records.append({'id': item})
+    return item
+
+
+def outcomes_case():
+    "a test case with one test of each outcome"
+
+    class Outcomes(unittest.TestCase):
+        def test_pass(self):
+            pass
+
+        def test_fail(self):
+            self.fail('boom')
+
+        def test_error(self):
+            raise ValueError('bang')
+
+        @unittest.skip('later')
+        def test_skip(self):
+            pass
+
+        @unittest.expectedFailure
+        def test_expected(self):
+            self.fail()
+
+        def test_sub(self):
+            for i in range(2):
+                with self.subTest(i=i):
+                    self.assertEqual(0, i)
+
+    return Outcomes
+
+
+class test_reporting_test_result(unittest.TestCase):
+
+    def setUp(self):
+        take_test_records()
+        suite = unittest.TestLoader().loadTestsFromTestCase(
+            outcomes_case()
+        )
+        suite.run(reporting_result_class(unittest.TestResult)())
+        self.records = dict(
+            (record['id'].split('.')[-1], record)
+            for record in take_test_records()
+        )
+
+    def test_every_test_has_an_outcome_and_duration(self):
+        self.assertEqual(
+            {
+                'test_pass': 'passed',
+                'test_fail': 'failure',
+                'test_error': 'error',
+                'test_skip': 'skipped',
+                'test_expected': 'expected failure',
+                'test_sub': 'failure',
+            },
+            dict((name, r['outcome']) for (name, r) in self.records.items())
+        )
+        for record in self.records.values():
+            self.assertGreaterEqual(record['seconds'], 0)
+
+    def test_failures_have_tracebacks(self):
+        self.assertIn('boom', self.records['test_fail']['traceback'])
+        self.assertIn('bang', self.records['test_error']['traceback'])
+        self.assertEqual(None, self.records['test_pass']['traceback'])
+
+    def test_worker_sends_records_with_result(self):
+        pool = WorkerPool()
+        self.addCleanup(pool.close)
+        map_in_order(pool, add_test_record, ['a', 'b'])
+        self.assertEqual(
+            {0: [{'id': 'a'}], 1: [{'id': 'b'}]},
+            pool.test_records
+        )
+
+
+class test_reporter(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.json_path = os.path.join(self.root, 'report.jsonl')
+        self.junit_path = os.path.join(self.root, 'report.xml')
+        self.reporter = Reporter(self.json_path, self.junit_path)
+        self.result = Result(total=2, passed=1, time=0.5)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def run_once(self, records, result=('test_a', 1, 2, ''), partial=False):
+        self.reporter.start_run()
+        self.reporter.record('test_a.py', records, result, partial)
+        self.reporter.write(['test_a.py'], self.result)
+
+    def records(self, *outcomes):
+        records = [{'module': 'test_a', 'import_seconds': 0.25}]
+        for (name, outcome) in outcomes:
+            records.append({
+                'id': 'test_a.T.' + name,
+                'outcome': outcome,
+                'seconds': 0.5,
+                'traceback': 'Traceback' if outcome != 'passed' else None,
+            })
+        return records
+
+    def events(self):
+        with open(self.json_path) as json_file:
+            return [json.loads(line) for line in json_file]
+
+    def test_json_lines_have_an_event_for_each_test_and_run(self):
+        self.run_once(self.records(('test_x', 'passed'), ('test_y', 'error')))
+        self.run_once(self.records(('test_x', 'passed')))
+        events = self.events()
+        self.assertEqual(
+            ['test', 'test', 'run', 'test', 'run'],
+            [event['event'] for event in events]
+        )
+        self.assertEqual('test_a.T.test_y', events[1]['id'])
+        self.assertEqual(0.25, events[1]['import_seconds'])
+        self.assertEqual((1, 2), (events[2]['passed'], events[2]['total']))
+
+    def test_junit_xml_counts_outcomes(self):
+        self.run_once(self.records(
+            ('test_x', 'passed'),
+            ('test_y', 'failure'),
+            ('test_z', 'skipped')
+        ))
+        suite = ElementTree.parse(self.junit_path).getroot()[0]
+        self.assertEqual(
+            ('test_a', '3', '1', '0', '1'),
+            tuple(suite.get(name) for name in
+                  ['name', 'tests', 'failures', 'errors', 'skipped'])
+        )
+        cases = suite.findall('testcase')
+        self.assertEqual('test_a.T', cases[1].get('classname'))
+        self.assertEqual('test_y', cases[1].get('name'))
+        self.assertEqual('Traceback', cases[1].find('failure').text)
+
+    def test_partial_runs_keep_other_tests(self):
+        self.run_once(self.records(('test_x', 'passed'), ('test_y', 'passed')))
+        self.run_once(self.records(('test_y', 'failure')), partial=True)
+        self.assertEqual(
+            ['test_a.T.test_x', 'test_a.T.test_y'],
+            sorted(test['id'] for test in self.reporter.tests['test_a.py'])
+        )
+
+    def test_module_that_could_not_run_is_an_error(self):
+        self.run_once([], ('Exception(test_a.py)', 0, 1j, 'ImportError'))
+        self.assertEqual(
+            [('test_a', 'error', 'ImportError')],
+            [(test['id'], test['outcome'], test['traceback'])
+             for test in self.reporter.tests['test_a.py']]
+        )
@@ -0,0 +1,124 @@
+# coding: utf-8
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pytddmon import Pytddmon, ResultCache
+from tests import FakeMonitor, FakeWorkerPool, write
+
+
+class test_result_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = ResultCache(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_key_changes_with_the_contents_of_any_file(self):
+        test = write(self.root, 'test_a.py', 'import a\n')
+        imported = write(self.root, 'a.py', 'x = 1\n')
+        key = self.cache.key([test, imported])
+        self.assertEqual(key, self.cache.key([imported, test]))
+        write(self.root, 'a.py', 'x = 2\n')
+        os.utime(imported, (time.time() + 10, time.time() + 10))
+        self.assertNotEqual(key, self.cache.key([test, imported]))
+
+    def test_results_are_kept_between_sessions(self):
+        self.cache.put('key', ('test_a', 1, 2, 'log'))
+        self.cache.save()
+        self.assertEqual(
+            ('test_a', 1, 2, 'log'),
+            ResultCache(self.root).get('key')
+        )
+
+    def test_results_of_files_that_could_not_run_are_not_kept(self):
+        self.cache.put('key', ('test_a', 0, 1j, 'ImportError'))
+        self.assertEqual(None, self.cache.get('key'))
+
+    def test_least_recently_used_results_are_dropped(self):
+        self.cache.max_entries = 2
+        for key in ['a', 'b', 'c']:
+            self.cache.put(key, (key, 1, 1, ''))
+            self.cache.entries[key][4] -= 10
+        self.cache.get('a')
+        self.cache.save()
+        self.assertEqual(['a', 'c'], sorted(ResultCache(self.root).entries))
+
+    def test_old_results_are_dropped(self):
+        self.cache.put('key', ('test_a', 1, 1, ''))
+        self.cache.entries['key'][4] -= self.cache.max_age + 1
+        self.cache.save()
+        self.assertEqual({}, ResultCache(self.root).entries)
+
+
+class test_reusing_results(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.test_a = write(self.root, 'test_a.py', 'import a\n')
+        self.a = write(self.root, 'a.py', 'x = 1\n')
+        self.test_b = write(self.root, 'test_b.py', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def start(self):
+        class FileFinder:
+            root = self.root
+
+            def __call__(finder):
+                return set([self.test_a, self.a, self.test_b])
+        pool = FakeWorkerPool()
+        pytddmon = Pytddmon(
+            FileFinder(),
+            None,
+            worker_pool=pool,
+            result_cache=ResultCache(self.root)
+        )
+        return (pytddmon, pool)
+
+    def test_restart_reuses_results_of_unchanged_files(self):
+        self.start()
+        (pytddmon, pool) = self.start()
+        self.assertEqual([], pool.ran)
+        self.assertEqual(3, pytddmon.result.total)
+        self.assertIn('Reused earlier results of 3', pytddmon.log)
+
+    def test_reused_files_are_counted_once_when_starting_over(self):
+        self.start()
+        write(self.root, 'test_b.py', 'x = 1\n')
+        (pytddmon, pool) = self.start()
+        pytddmon.monitor = FakeMonitor(0)
+        pytddmon.monitor.queued = [set(), set(), set([self.a])]
+        write(self.root, 'test_b.py', 'x = 22\n')
+        pytddmon.run_tests(None, preemptible=True)
+        self.assertEqual(2, len(pool.calls))
+        self.assertIn('Reused earlier results of 2', pytddmon.log)
+
+    def test_without_cache_nothing_is_reused(self):
+        pytddmon = Pytddmon(
+            lambda: set([self.test_a, self.a]),
+            None,
+            worker_pool=FakeWorkerPool()
+        )
+        self.assertNotIn('Reused', pytddmon.log)
+
+    def test_files_importing_modules_not_found_are_not_reused(self):
+        write(self.root, 'test_b.py', 'import module_found_somewhere_else\n')
+        self.start()
+        (pytddmon, pool) = self.start()
+        self.assertEqual([self.test_b], pool.ran)
+
+    def test_change_to_an_imported_file_runs_its_importers(self):
+        self.start()
+        write(self.root, 'a.py', 'x = 2\n')
+        os.utime(self.a, (time.time() + 10, time.time() + 10))
+        (pytddmon, pool) = self.start()
+        self.assertEqual(
+            sorted([self.test_a, self.a]),
+            sorted(pool.ran)
+        )
@@ -0,0 +1,113 @@
+# coding: utf-8
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pytddmon import Pytddmon, RunHistory
+from tests import FakeWorkerPool
+
+GREEN = ('module', 1, 1, '')
+RED = ('module', 0, 1, '')
+
+
+class test_run_history(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.history = RunHistory(self.root)
+        self.now = time.time()
+        self.paths = {}
+        for name in ['fast', 'slow', 'edited', 'failing']:
+            path = os.path.join(self.root, name + '.py')
+            open(path, 'w').close()
+            os.utime(path, (self.now - 3600, self.now - 3600))
+            self.paths[name] = path
+        os.utime(self.paths['edited'], (self.now, self.now))
+        self.history.record(self.paths['fast'], GREEN, 0.1)
+        self.history.record(self.paths['slow'], GREEN, 5)
+        self.history.record(self.paths['edited'], GREEN, 3)
+        self.history.record(self.paths['failing'], RED, 4)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def order(self, history, names):
+        paths = [self.paths[name] for name in names]
+        ordered = history.order(paths, now=self.now)
+        return [os.path.basename(path)[:-3] for path in ordered]
+
+    def test_failing_and_edited_files_run_first_then_fastest_first(self):
+        self.assertEqual(
+            ['edited', 'failing', 'fast', 'slow'],
+            self.order(self.history, ['slow', 'failing', 'fast', 'edited'])
+        )
+
+    def test_new_files_run_first(self):
+        self.history.files.clear()
+        self.assertEqual(
+            ['fast', 'slow'],
+            self.order(self.history, ['slow', 'fast'])
+        )
+
+    def test_unknown_duration_keeps_the_last_one(self):
+        self.history.record(self.paths['slow'], RED, None)
+        self.assertEqual((True, 5), self.history.files[self.paths['slow']])
+
+    def test_history_is_kept_between_sessions(self):
+        self.history.save()
+        self.assertEqual(
+            ['edited', 'failing', 'fast', 'slow'],
+            self.order(
+                RunHistory(self.root),
+                ['fast', 'slow', 'failing', 'edited']
+            )
+        )
+
+
+class FailingWorkerPool(FakeWorkerPool):
+    def result(self, index, item):
+        return (item, 0, 1, 'failed\n')
+
+
+class test_last_result(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def start(self, run_first):
+        return Pytddmon(
+            lambda: set([os.path.join(self.root, 'test_a.py')]),
+            None,
+            worker_pool=FailingWorkerPool(),
+            history=RunHistory(self.root),
+            run_first=run_first
+        )
+
+    def test_last_result_is_shown_as_stale_until_tests_run(self):
+        self.start(run_first=True)
+        pytddmon = self.start(run_first=False)
+        self.assertEqual(1, pytddmon.result.total)
+        self.assertEqual(0, pytddmon.result.passed)
+        self.assertTrue(pytddmon.stale)
+        self.assertIn('failed', pytddmon.log)
+        pytddmon.run_tests()
+        self.assertFalse(pytddmon.stale)
+
+    def test_errors_are_kept_as_complex_numbers(self):
+        history = RunHistory(self.root)
+        history.last_result = (0, 1j, 'error')
+        history.save()
+        self.assertEqual(
+            (0, 1j, 'error'),
+            RunHistory(self.root).last_result
+        )
+
+    def test_nothing_is_shown_without_an_earlier_session(self):
+        pytddmon = self.start(run_first=False)
+        self.assertEqual(0, pytddmon.result.total)
+        self.assertFalse(pytddmon.stale)
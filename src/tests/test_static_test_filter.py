@@ -0,0 +1,147 @@
+# coding: utf-8
+import os
+import shutil
+import tempfile
+import unittest
+
+from pytddmon import (
+    FileFinder, ImportGraph, Pytddmon, StaticTestFilter, may_contain_tests
+)
+from tests import FakeWorkerPool, write
+
+
+class test_may_contain_tests(unittest.TestCase):
+
+    def test_test_case_classes(self):
+        self.assertTrue(may_contain_tests(
+            b'import unittest\nclass T(unittest.TestCase):\n    pass\n'
+        ))
+        self.assertTrue(may_contain_tests(b'class TestA(Base):\n    pass\n'))
+        self.assertTrue(may_contain_tests(b'class A(bases[0]):\n    pass\n'))
+
+    def test_test_functions_and_load_tests(self):
+        self.assertTrue(may_contain_tests(b'def test_a():\n    pass\n'))
+        self.assertTrue(may_contain_tests(
+            b'def load_tests(loader, tests, pattern):\n    return tests\n'
+        ))
+
+    def test_imported_test_cases(self):
+        self.assertTrue(may_contain_tests(b'from a import SlowTests\n'))
+        self.assertTrue(may_contain_tests(b'from a import *\n'))
+
+    def test_test_cases_made_elsewhere(self):
+        self.assertTrue(may_contain_tests(
+            b'from hypothesis.stateful import RuleBasedStateMachine\n'
+            b'class Machine(RuleBasedStateMachine):\n    pass\n'
+            b'TestMachine = Machine.TestCase\n'
+        ))
+        self.assertTrue(may_contain_tests(b'Checks = make().TestCase\n'))
+
+    def test_doctests(self):
+        self.assertTrue(may_contain_tests(
+            b'def f():\n    """\n    >>> f()\n    """\n'
+        ))
+
+    def test_source_that_does_not_parse(self):
+        self.assertTrue(may_contain_tests(b'def f(:\n'))
+
+    def test_plain_module(self):
+        self.assertFalse(may_contain_tests(
+            b'import os\n\nclass Parser(object):\n'
+            b'    def parse(self, text):\n        return text\n'
+        ))
+
+    def test_imported_bases(self):
+        self.assertEqual(
+            ['from helpers import Base', 'import shared'],
+            may_contain_tests(
+                b'from helpers import Base\nimport shared\n'
+                b'class Foo(Base):\n    pass\n'
+                b'class Bar(shared.Mixin):\n    pass\n'
+            )
+        )
+
+
+class test_static_test_filter(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.test_a = write(
+            self.root, 'test_a.py', 'def test_a():\n    pass\n'
+        )
+        self.a = write(self.root, 'a.py', 'x = 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_answers_are_kept_by_digest_between_sessions(self):
+        test_filter = StaticTestFilter(self.root)
+        self.assertFalse(test_filter.may_have_tests(self.a))
+        for digest in test_filter.answers:
+            test_filter.answers[digest] = 'kept'
+        test_filter.save()
+        self.assertEqual('kept', StaticTestFilter(self.root).may_have_tests(
+            self.a
+        ))
+
+    def test_only_answers_about_current_files_are_saved(self):
+        test_filter = StaticTestFilter(self.root)
+        test_filter.may_have_tests(self.a)
+        test_filter.save()
+        test_filter = StaticTestFilter(self.root)
+        test_filter.may_have_tests(self.test_a)
+        test_filter.save()
+        self.assertEqual(
+            [True],
+            list(StaticTestFilter(self.root).answers.values())
+        )
+
+    def test_modules_without_tests_are_not_imported(self):
+        pool = FakeWorkerPool()
+        pytddmon = Pytddmon(
+            lambda: set([self.test_a, self.a]),
+            None,
+            worker_pool=pool,
+            test_filter=StaticTestFilter(self.root)
+        )
+        self.assertEqual([self.test_a], pool.ran)
+        self.assertEqual(1, pytddmon.result.total)
+        self.assertEqual(0, pytddmon.module_results[self.a][2])
+
+    def test_classes_based_on_project_classes_may_be_tests(self):
+        write(self.root, 'helpers.py', 'class Base(object):\n    pass\n')
+        foo = write(
+            self.root,
+            'foo.py', 'from helpers import Base\nclass Foo(Base):\n    pass\n'
+        )
+        graph = ImportGraph(self.root, [])
+        graph.update([foo, os.path.join(self.root, 'helpers.py')])
+        test_filter = StaticTestFilter(self.root)
+        self.assertTrue(test_filter.may_have_tests(foo, graph))
+        self.assertTrue(test_filter.may_have_tests(foo))
+
+    def test_classes_based_on_other_classes_are_no_tests(self):
+        foo = write(
+            self.root,
+            'foo.py', 'from json import JSONDecoder\n'
+            'class Foo(JSONDecoder):\n    pass\n'
+        )
+        graph = ImportGraph(self.root, [])
+        graph.update([foo])
+        test_filter = StaticTestFilter(self.root)
+        self.assertFalse(test_filter.may_have_tests(foo, graph))
+
+    def test_tests_based_on_project_classes_are_run(self):
+        write(self.root, 'helpers.py', 'class Base(object):\n    pass\n')
+        foo = write(
+            self.root,
+            'foo.py', 'from helpers import Base\nclass Foo(Base):\n    pass\n'
+        )
+        pool = FakeWorkerPool()
+        Pytddmon(
+            FileFinder(self.root, r'.*\.py'),
+            None,
+            worker_pool=pool,
+            test_filter=StaticTestFilter(self.root)
+        )
+        self.assertIn(foo, pool.ran)
@@ -0,0 +1,83 @@
+# coding: utf-8
+import io
+import os
+import unittest
+
+from pytddmon import Result, TerminalUI, status_line
+
+
+class FakePytddmon:
+    def __init__(self):
+        self.change_detected = set([os.path.abspath('test_a.py')])
+        self.stale = False
+        self.set_results(('test_a', 1, 1, 'All 1 tests passed\n'))
+
+    def set_results(self, *results):
+        self.module_results = dict(
+            ('%s.py' % result[0], result) for result in results
+        )
+        self.result = Result(
+            total=sum(result[2] for result in results),
+            passed=sum(result[1] for result in results),
+            time=0.5
+        )
+
+
+class test_terminal(unittest.TestCase):
+
+    def setUp(self):
+        self.pytddmon = FakePytddmon()
+        self.stream = io.StringIO()
+
+    def shown(self, quiet=False):
+        terminal = TerminalUI(self.pytddmon, self.stream, quiet)
+        terminal.run_finished()
+        return terminal
+
+    def test_status_line_tells_result_time_and_changes(self):
+        line = status_line(Result(total=3, passed=2, time=1.5), set(['a.py']))
+        self.assertTrue(
+            line.endswith('] 2/3 passed in 1.50 s, changed: a.py\n')
+        )
+
+    def test_status_line_shows_errors(self):
+        line = status_line(Result(total=1j, passed=0, time=0))
+        self.assertIn('?ERROR 0/0', line)
+
+    def test_status_line_shortens_long_lists_of_changes(self):
+        changed = set(['a.py', 'b.py', 'c.py', 'd.py', 'e.py'])
+        line = status_line(Result(total=0, passed=0, time=0), changed)
+        self.assertIn('changed: a.py, b.py, c.py, 2 more\n', line)
+
+    def test_logs_of_failing_modules_follow_the_status_line(self):
+        self.pytddmon.set_results(
+            ('test_a', 1, 1, 'All 1 tests passed\n'),
+            ('test_b', 0, 1, 'FAIL: test_b\n')
+        )
+        self.shown()
+        output = self.stream.getvalue()
+        self.assertIn('1/2 passed', output)
+        self.assertIn('Log from test_b:\nFAIL: test_b\n', output)
+        self.assertNotIn('test_a:', output)
+
+    def test_engine_failure_is_shown(self):
+        terminal = TerminalUI(self.pytddmon, self.stream)
+        try:
+            raise OSError('monitor gone')
+        except OSError:
+            terminal.publish_error()
+        output = self.stream.getvalue()
+        self.assertIn('?ERROR', output)
+        self.assertIn('OSError: monitor gone', output)
+
+    def test_every_run_is_shown(self):
+        terminal = self.shown()
+        terminal.run_finished()
+        self.assertEqual(2, self.stream.getvalue().count('passed'))
+
+    def test_quiet_only_shows_runs_with_another_result(self):
+        terminal = self.shown(quiet=True)
+        terminal.run_finished()
+        self.pytddmon.set_results(('test_a', 0, 1, 'FAIL\n'))
+        terminal.run_finished()
+        self.assertEqual(2, self.stream.getvalue().count('passed'))
@@ -0,0 +1,306 @@
+# coding: utf-8
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from pytddmon import ForkServer, WorkerPool
+from tests import map_in_order
+
+
+def get_pid(_item):
+    return os.getpid()
+
+
+def import_and_get_pid(module_name):
+    __import__(module_name)
+    return os.getpid()
+
+
+def import_and_count_runs(module_name):
+    module = __import__(module_name)
+    module.runs.append(None)
+    return len(module.runs)
+
+
+def is_imported(module_name):
+    return module_name in sys.modules
+
+
+def die(_item):
+    os._exit(3)
+
+
+def sleep_and_get_pid(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def ignore_sigterm_and_sleep(pid_path):
+    import signal
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    with open(pid_path, 'w') as f:
+        f.write(str(os.getpid()))
+    time.sleep(60)
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def sleep_on_first(item):
+    time.sleep(item[0])
+
+
+def die_on_zero(x):
+    if x == 0:
+        os._exit(3)
+    return x
+
+
+class test_worker_pool(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        sys.path.insert(0, self.root)
+        self.pool = WorkerPool(root=self.root)
+
+    def tearDown(self):
+        self.pool.close()
+        sys.path.remove(self.root)
+        shutil.rmtree(self.root)
+
+    def map(self, func, items):
+        return map_in_order(self.pool, func, items)
+
+    def write_module(self, name, content):
+        path = os.path.join(self.root, name + '.py')
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_results_are_in_order(self):
+        pool = WorkerPool(processes=3)
+        try:
+            self.assertEqual([1, 2, 3], map_in_order(pool, abs, [-1, -2, 3]))
+        finally:
+            pool.close()
+
+    def test_worker_is_kept_between_runs(self):
+        first = self.map(get_pid, [None])
+        second = self.map(get_pid, [None])
+        self.assertEqual(first, second)
+
+    def test_worker_is_replaced_after_max_tasks(self):
+        self.pool.max_tasks = 2
+        pids = self.map(get_pid, [None, None, None])
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+
+    def test_worker_is_replaced_when_imported_file_changes(self):
+        path = self.write_module('pool_unit', 'x = 1\n')
+        first = self.map(import_and_get_pid, ['pool_unit'])
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        second = self.map(import_and_get_pid, ['pool_unit'])
+        self.assertNotEqual(first, second)
+
+    def test_project_modules_are_imported_fresh_for_every_run(self):
+        self.write_module('pool_counter', 'runs = []\n')
+        first = self.map(import_and_count_runs, ['pool_counter'])
+        second = self.map(import_and_count_runs, ['pool_counter'])
+        self.assertEqual([[1], [1]], [first, second])
+
+    def test_dead_worker_gives_error_result(self):
+        [(module, green, total, log)] = self.map(die, ['unit.py'])
+        self.assertEqual(1j, total)
+        self.assertIn('died (exit code 3)', log)
+
+    def test_dead_worker_fails_the_file_of_a_tuple_item(self):
+        [(module, green, total, log)] = self.map(
+            die, [('unit.py', 'test_a', ('test_a',))]
+        )
+        self.assertEqual('Exception(unit.py)', module)
+        self.assertEqual(1j, total)
+
+    def test_tuple_item_running_too_long_is_killed(self):
+        self.pool.timeout = 0.2
+        [(module, green, total, log)] = self.map(
+            sleep_on_first, [(60, set(), '/root')]
+        )
+        self.assertEqual('Exception(60)', module)
+        self.assertIn('more than 0.2 seconds', log)
+
+    def test_pool_keeps_going_after_worker_died(self):
+        self.map(die, ['unit.py'])
+        self.assertEqual([1], self.map(abs, [-1]))
+
+    def test_durations_of_the_last_run_are_kept(self):
+        self.map(sleep_and_get_pid, [0, 0.2])
+        self.assertLess(self.pool.durations[0], 0.2)
+        self.assertGreaterEqual(self.pool.durations[1], 0.2)
+
+    def test_batch_runs_in_one_task(self):
+        self.pool.max_tasks = 1
+        results = dict(self.pool.imap_unordered(
+            get_pid, [None, None, None, None], batches=[[0, 2, 3]]
+        ))
+        self.assertEqual(1, len(set([results[0], results[2], results[3]])))
+        self.assertNotEqual(results[0], results[1])
+
+    def test_batch_keeps_duration_of_each_item(self):
+        list(self.pool.imap_unordered(
+            sleep_and_get_pid, [0, 0.2], batches=[[0, 1]]
+        ))
+        self.assertLess(self.pool.durations[0], 0.2)
+        self.assertGreaterEqual(self.pool.durations[1], 0.2)
+
+    def test_dead_worker_fails_every_item_of_a_batch(self):
+        results = dict(self.pool.imap_unordered(
+            die, ['a.py', 'b.py'], batches=[[0, 1]]
+        ))
+        self.assertEqual(
+            ['Exception(a.py)', 'Exception(b.py)'],
+            [results[0][0], results[1][0]]
+        )
+
+    def test_items_of_a_batch_that_died_run_again_alone(self):
+        results = dict(self.pool.imap_unordered(
+            die_on_zero, [0, 1], batches=[[0, 1]]
+        ))
+        self.assertEqual(1j, results[0][2])
+        self.assertEqual(1, results[1])
+
+    def test_item_running_too_long_is_killed(self):
+        self.pool.timeout = 0.2
+        start = time.time()
+        results = dict(self.pool.imap_unordered(sleep_and_get_pid, [60, 0]))
+        self.assertLess(time.time() - start, 30)
+        self.assertEqual(1j, results[0][2])
+        self.assertIn('more than 0.2 seconds', results[0][3])
+        self.assertEqual([results[1]], self.map(get_pid, [None]))
+
+    def test_batch_running_too_long_is_killed_within_the_timeout(self):
+        self.pool.timeout = 0.5
+        start = time.time()
+        results = dict(self.pool.imap_unordered(
+            sleep_and_get_pid, [0.3, 0.3, 60], batches=[[0, 1, 2]]
+        ))
+        self.assertLess(time.time() - start, 2.3)
+        self.assertIn('more than 0.5 seconds', results[2][3])
+        self.assertEqual(results[0], results[1])
+
+    @unittest.skipUnless(os.path.exists('/proc/self/statm'), "needs /proc")
+    def test_item_using_too_much_memory_is_killed(self):
+        self.pool.max_memory = 2 ** 20
+        [(module, green, total, log)] = self.map(sleep_and_get_pid, [60])
+        self.assertEqual(1j, total)
+        self.assertIn('more than 1 MB of memory', log)
+
+    def test_worker_ignoring_sigterm_is_killed(self):
+        self.pool.timeout = 0.2
+        pid_path = os.path.join(self.root, 'pid')
+        start = time.time()
+        [result] = self.map(ignore_sigterm_and_sleep, [pid_path])
+        self.assertLess(time.time() - start, 30)
+        self.assertEqual(1j, result[2])
+        with open(pid_path) as f:
+            self.assertFalse(is_running(int(f.read())))
+
+    def test_cancelled_run_starts_no_more_tasks(self):
+        results = list(self.pool.imap_unordered(
+            get_pid, [1, 2, 3], cancelled=lambda: True
+        ))
+        self.assertEqual([], results)
+
+    def test_running_task_may_finish_within_grace_period(self):
+        pool = WorkerPool(processes=2, grace_period=10)
+        self.addCleanup(pool.close)
+        results = []
+        for result in pool.imap_unordered(
+                sleep_and_get_pid, [0, 0.5, 0.5],
+                cancelled=lambda: bool(results)):
+            results.append(result)
+        self.assertEqual([0, 1], sorted(index for (index, _) in results))
+
+    def test_running_task_is_terminated_after_grace_period(self):
+        self.pool.grace_period = 0.1
+        pid = self.map(get_pid, [None])[0]
+        start = time.time()
+        results = list(self.pool.imap_unordered(
+            sleep_and_get_pid, [60],
+            cancelled=lambda: time.time() > start + 0.1
+        ))
+        self.assertEqual([], results)
+        self.assertLess(time.time() - start, 30)
+        self.assertNotEqual([pid], self.map(get_pid, [None]))
+
+    def test_abandoned_run_gives_no_results_to_the_next(self):
+        pool = WorkerPool(processes=2)
+        self.addCleanup(pool.close)
+        results = pool.imap_unordered(sleep_and_get_pid, [0, 0.5])
+        next(results)
+        results.close()
+        self.assertEqual([1, 2], map_in_order(pool, abs, [-1, -2]))
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), "fork server needs os.fork")
+class test_fork_server(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        sys.path.insert(0, self.root)
+        self.stable = os.path.join(self.root, 'stable_module.py')
+        with open(self.stable, 'w') as f:
+            f.write('x = 1\n')
+        self.fork_server = ForkServer(self.root, ['stable_module'])
+        self.pool = WorkerPool(
+            root=self.root,
+            max_tasks=1,
+            fork_server=self.fork_server
+        )
+
+    def tearDown(self):
+        self.pool.close()
+        sys.path.remove(self.root)
+        shutil.rmtree(self.root)
+
+    def map(self, func, items):
+        return map_in_order(self.pool, func, items)
+
+    def test_workers_have_preloaded_modules(self):
+        self.assertEqual([True], self.map(is_imported, ['stable_module']))
+
+    def test_every_task_gets_a_fresh_worker(self):
+        [first, second] = self.map(get_pid, [None, None])
+        self.assertNotEqual(first, second)
+
+    def test_server_is_restarted_when_preloaded_file_changes(self):
+        self.map(get_pid, [None])
+        server = self.fork_server.process
+        os.utime(self.stable, (time.time() + 10, time.time() + 10))
+        self.map(get_pid, [None])
+        self.assertNotEqual(server, self.fork_server.process)
+
+    def test_forked_worker_ignoring_sigterm_is_killed(self):
+        self.pool.timeout = 0.2
+        pid_path = os.path.join(self.root, 'pid')
+        [result] = self.map(ignore_sigterm_and_sleep, [pid_path])
+        self.assertEqual(1j, result[2])
+        with open(pid_path) as f:
+            self.assertFalse(is_running(int(f.read())))
+
+    def test_server_is_kept_while_nothing_changes(self):
+        self.map(get_pid, [None])
+        server = self.fork_server.process
+        self.map(get_pid, [None])
+        self.assertEqual(server, self.fork_server.process)
+
+
+if __name__ == '__main__':
+    unittest.main()